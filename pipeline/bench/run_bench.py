@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# mf_pipeline/bench/run_bench.py
+import argparse, sys, pathlib, json, time, platform, subprocess, tempfile, warnings
+# Script-mode shim: allow "python mf_pipeline/bench/run_bench.py"
+if __package__ is None or __package__ == "":
+    sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent.parent))
+
+import numpy as np, scipy
+from mf_pipeline.mf_fill import SliceReader, channel_magnitudes, robust_zscores, fill_channels, select_lattice
+from mf_pipeline.mf_geometry import ScanGeometry
+from mf_pipeline.mf_grid import grid_robust_zscores, grid_fill_channels, stencil_size
+from mf_pipeline.mf_directivity import to_spherical, design_SH, fit_SH, eval_SH_map, choose_metric, clear_solver_cache
+from mf_pipeline.mf_plots import CloudFigures
+from mf_pipeline.bench.synth import make_scan, load_truth
+
+def best_of(fn, repeat=3):
+    best, out = np.inf, None
+    for _ in range(repeat):
+        t0 = time.perf_counter(); out = fn(); best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def precision_recall(flags: np.ndarray, truth: np.ndarray) -> dict:
+    tp = int((flags & truth).sum()); fp = int((flags & ~truth).sum()); fn = int((~flags & truth).sum())
+    return dict(tp=tp, fp=fp, fn=fn,
+                precision=tp/(tp+fp) if tp+fp else 1.0, recall=tp/(tp+fn) if tp+fn else 1.0)
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=pathlib.Path(__file__).parent,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_scan(path, side, F_list, k_list, lmax_list, tau, smooth, repeat, plots, grids=("on", "off"), log=print,
+               plot_bins=4):
+    n_bins = max(F_list)
+    make_scan(path, shape=(side,)*3, n_freq=n_bins, seed=side)
+    truth = load_truth(path)
+    rows, det = [], []
+    with SliceReader(path) as R:
+        pos = R.pos; N = len(pos)
+        for F in F_list:
+            t, _ = best_of(lambda: R.read_bins(np.arange(F)), repeat)
+            rows.append(dict(stage="load", N=N, F=F, seconds=t))
+        Pk, Uk = R.read_bins(np.arange(n_bins))
+    M = channel_magnitudes(Pk, Uk)                                   # (F,4,N)
+
+    X = np.vstack([Pk[0], Uk[0].T])
+    for k in k_list:
+        t, G = best_of(lambda: ScanGeometry.build(pos, k_nn=k), repeat)
+        rows.append(dict(stage="geometry", N=N, k_nn=k, seconds=t))
+        done = set()
+        for grid in grids:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")     # stencil size is recorded below
+                lat = select_lattice(G, grid)
+            mode = "grid" if lat is not None else "knn"
+            if mode in done:
+                continue
+            done.add(mode)
+            S = stencil_size(lat, k) if lat is not None else k
+            if lat is not None:
+                zscores = lambda V: grid_robust_zscores(V, lat, k)
+                fill = lambda X, m: grid_fill_channels(X, m, lat, smooth=smooth, k_fill=G.k_fill)
+            else:
+                zscores = lambda V: robust_zscores(V, G.knn_idx)
+                fill = lambda X, m: fill_channels(pos, X, m, smooth=smooth, nbr_idx=G.fill_idx)
+            tag = dict(N=N, k_nn=k, grid=mode, stencil=S)
+            t, z = best_of(lambda: zscores(M[0]), repeat)
+            rows.append(dict(stage="robust_flags", F=1, **tag, seconds=t))
+            t, z = best_of(lambda: zscores(M), repeat)
+            rows.append(dict(stage="robust_flags", F=n_bins, **tag, seconds=t))
+            flags = z > tau
+            det.append(dict(F=n_bins, tau=tau, **tag, **precision_recall(flags, truth)))
+            t, _ = best_of(lambda: fill(X, flags[0]), repeat)
+            rows.append(dict(stage="fill_channel", **tag, n_flagged=int(flags[0].sum()), seconds=t))
+            plot_in = (flags, fill)     # the plots show the last measured path
+
+    v = choose_metric(Pk[0], Uk[0], "u_mag")
+    _, th, ph, _ = to_spherical(pos)
+    for L in lmax_list:
+        t, _ = best_of(lambda: design_SH(th, ph, L), repeat)
+        rows.append(dict(stage="design_SH", N=N, lmax=L, seconds=t))
+        # cold fit: drop the cached factorization so every repeat pays for it
+        t, (c, _) = best_of(lambda: (clear_solver_cache(), fit_SH(pos, v, lmax=L, lam=1e-3))[1], repeat)
+        rows.append(dict(stage="fit_SH", N=N, lmax=L, seconds=t))
+        t, _ = best_of(lambda: eval_SH_map(c, lmax=L), repeat)
+        rows.append(dict(stage="eval_SH_map", N=N, lmax=L, seconds=t))
+
+    if plots:
+        # the production path: one CloudFigures per scan, re-rendered for each frequency
+        flags, fill = plot_in
+        frames = []
+        for b in range(min(plot_bins, n_bins)):
+            Xf = fill(np.vstack([Pk[b], Uk[b].T]), flags[b])
+            frames.append((choose_metric(Pk[b], Uk[b], "u_mag"), choose_metric(Xf[0], Xf[1:].T, "u_mag"),
+                           flags[b, 1:].any(axis=0)))
+        with tempfile.TemporaryDirectory() as out:
+            base = pathlib.Path(out) / "bench"
+            t0 = time.perf_counter()
+            figs = CloudFigures(pos)
+            rows.append(dict(stage="plot_setup", N=N, seconds=time.perf_counter() - t0))
+            with figs:
+                t, _ = best_of(lambda: [figs.render(base, v_raw, v_fill, mask_noisy=m, dpi=100)
+                                        for v_raw, v_fill, m in frames], 1)
+        rows.append(dict(stage="plotting", N=N, frames=len(frames), seconds=t / len(frames)))   # per frequency
+    for r in rows:
+        log("  " + " ".join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}" for k, v in r.items()))
+    return rows, det
+
+def path_table(timings, detection, log=print):
+    # lattice vs kNN side by side for each grid size and k_nn
+    t = {(r["stage"], r["N"], r.get("F"), r["k_nn"], r["grid"]): r["seconds"] for r in timings if "grid" in r}
+    d = {(r["N"], r["k_nn"], r["grid"]): r for r in detection}
+    for (stage, N, F, k, g), tg in sorted(t.items(), key=lambda kv: (kv[0][0], kv[0][1], kv[0][2] or 0, kv[0][3])):
+        tk = t.get((stage, N, F, k, "knn"))
+        if g == "grid" and tk is not None:
+            log(f"{stage:14s} N={N}" + (f" F={F}" if F else "") + f" k_nn={k}: knn {tk:.4g}s grid {tg:.4g}s speedup {tk/max(tg, 1e-12):.2f}")
+    for (N, k, g), r in sorted(d.items()):
+        log(f"detection N={N} k_nn={k} {g} (stencil {r['stencil']}): "
+            f"precision={r['precision']:.3f} recall={r['recall']:.3f}")
+
+def compare(a_path, b_path):
+    A, B = (json.loads(pathlib.Path(p).read_text()) for p in (a_path, b_path))
+    for r in A["timings"] + B["timings"] + A["detection"] + B["detection"]:
+        if r.get("stage") in ("robust_flags", "fill_channel") or "precision" in r:
+            r.setdefault("grid", "knn"); r.setdefault("stencil", r["k_nn"])    # files from before --grid
+    key = lambda r: tuple(sorted((k, v) for k, v in r.items() if k not in ("seconds", "n_flagged")))
+    base = {key(r): r["seconds"] for r in A["timings"]}
+    print(f"{'case':70s} {'before':>10s} {'after':>10s} {'speedup':>8s}")
+    for r in B["timings"]:
+        t0 = base.get(key(r))
+        if t0 is not None:
+            case = " ".join(f"{k}={v}" for k, v in key(r))
+            print(f"{case:70s} {t0:10.4g} {r['seconds']:10.4g} {t0/max(r['seconds'], 1e-12):8.2f}")
+    da = {(d["N"], d["k_nn"], d["grid"]): d for d in A["detection"]}
+    for d in B["detection"]:
+        o = da.get((d["N"], d["k_nn"], d["grid"]))
+        if o is not None and (o["tp"], o["fp"], o["fn"]) != (d["tp"], d["fp"], d["fn"]):
+            print(f"[WARN] detection changed at N={d['N']} k_nn={d['k_nn']} ({d['grid']}): "
+                  f"P {o['precision']:.3f}->{d['precision']:.3f}, R {o['recall']:.3f}->{d['recall']:.3f}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark pipeline stages on synthetic Microflown scans")
+    ap.add_argument("--out", type=pathlib.Path, default=pathlib.Path("bench_results.json"), help="JSON results file")
+    ap.add_argument("--sides", type=int, nargs="+", default=[8, 12, 16], help="Cuboid grid points per side (N = side^3)")
+    ap.add_argument("--bins", type=int, nargs="+", default=[1, 16, 64], help="Frequency-bin counts to load")
+    ap.add_argument("--k-nn", dest="k_nn", type=int, nargs="+", default=[12, 24], help="Neighbour counts")
+    ap.add_argument("--lmax", type=int, nargs="+", default=[4, 8, 16], help="SH degrees")
+    ap.add_argument("--tau", type=float, default=3.5, help="Robust z-score threshold")
+    ap.add_argument("--smooth", type=float, default=0.2, help="RBF smoothing")
+    ap.add_argument("--repeat", type=int, default=3, help="Timing repeats (best of)")
+    ap.add_argument("--grid", nargs="+", choices=["auto", "on", "off"], default=["on", "off"],
+                    help="Detection/fill paths to time, as run_fill --grid (on = lattice stencils, off = kNN)")
+    ap.add_argument("--no-plots", action="store_true", help="Skip the plotting stage")
+    ap.add_argument("--compare", type=pathlib.Path, nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files")
+    args = ap.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    timings, detection = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        for side in args.sides:
+            print(f"N={side**3} ({side}^3 grid)")
+            rows, det = bench_scan(pathlib.Path(tmp) / f"scan_{side}.h5", side, args.bins, args.k_nn, args.lmax,
+                                   args.tau, args.smooth, args.repeat, not args.no_plots, grids=args.grid)
+            timings += rows; detection += det
+    meta = dict(commit=_git_commit(), time=time.strftime("%Y-%m-%dT%H:%M:%S"), python=platform.python_version(),
+                numpy=np.__version__, scipy=scipy.__version__, platform=platform.platform(), args=vars(args))
+    args.out.write_text(json.dumps(dict(meta=meta, timings=timings, detection=detection), indent=1, default=str))
+    path_table(timings, detection)
+    print(f"Saved: {args.out}")
+
+if __name__ == "__main__":
+    main()
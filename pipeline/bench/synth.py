@@ -0,0 +1,71 @@
+# mf_pipeline/bench/synth.py
+import h5py
+import numpy as np
+from pathlib import Path
+from mf_pipeline.mf_config import H5_GROUP
+
+RHO, C = 1.204, 343.0  # air density [kg/m^3], speed of sound [m/s]
+TRUTH = "/bench_truth/OUTLIERS"  # (F,4,N) bool: injected outliers in p, ux, uy, uz
+
+def cuboid_grid(shape=(12, 12, 12), spacing=0.02, origin=(0.0, 0.0, 0.0)) -> np.ndarray:
+    axes = [origin[d] + spacing*np.arange(shape[d]) for d in range(3)]
+    return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+
+def monopole_field(pos, src, freqs, amp=1.0):
+    # p = amp e^{-jkr}/r and u = -grad(p)/(j w rho); returns (F,N) and (F,N,3) complex
+    d = pos - src; r = np.linalg.norm(d, axis=1)
+    k = 2*np.pi*np.asarray(freqs)[:, None]/C
+    P = amp*np.exp(-1j*k*r)/r
+    dpdr = P*(-1j*k - 1.0/r)
+    U = (-dpdr/(1j*C*k*RHO))[..., None] * (d/r[:, None])
+    return P, U
+
+def dipole_field(pos, src, axis, freqs, sep=0.01, amp=1.0):
+    # two opposite monopoles `sep` apart along `axis`
+    a = np.asarray(axis, float); a = a/np.linalg.norm(a)
+    P1, U1 = monopole_field(pos, src + 0.5*sep*a, freqs, amp/sep)
+    P2, U2 = monopole_field(pos, src - 0.5*sep*a, freqs, amp/sep)
+    return P1 - P2, U1 - U2
+
+def make_scan(path, shape=(12, 12, 12), spacing=0.02, n_freq=32, f_range=(100.0, 4000.0),
+              source="monopole", outlier_frac=0.01, outlier_gain=(3.0, 8.0), seed=0, group=H5_GROUP) -> dict:
+    """Write a synthetic scan with the Microflown H5 layout and known outliers.
+
+    The source sits 10 cm below the centre of the bottom face of the cuboid
+    grid. Outliers scale a random `outlier_frac` of (bin, channel, sensor)
+    entries by a gain drawn from `outlier_gain` with a random phase; the
+    truth mask is stored at TRUTH and returned.
+    """
+    rng = np.random.default_rng(seed)
+    pos = cuboid_grid(shape, spacing)
+    src = np.array([pos[:, 0].mean(), pos[:, 1].mean(), pos[:, 2].min() - 0.1])
+    freqs = np.linspace(f_range[0], f_range[1], n_freq)
+    if source == "monopole":
+        P, U = monopole_field(pos, src, freqs)
+    elif source == "dipole":
+        P, U = dipole_field(pos, src, (1.0, 0.0, 0.0), freqs)
+    elif source == "mixed":
+        P, U = monopole_field(pos, src, freqs)
+        Pd, Ud = dipole_field(pos, src, (1.0, 0.0, 0.0), freqs, amp=0.02)
+        P, U = P + Pd, U + Ud
+    else:
+        raise ValueError("source must be one of: monopole, dipole, mixed")
+
+    X = np.concatenate([P[:, None, :], np.moveaxis(U, -1, 1)], axis=1)   # (F,4,N)
+    truth = rng.random(X.shape) < outlier_frac
+    n = int(truth.sum())
+    X[truth] *= rng.uniform(*outlier_gain, n) * np.exp(2j*np.pi*rng.random(n))
+    P, U = X[:, 0], np.moveaxis(X[:, 1:], 1, -1)
+
+    with h5py.File(path, "w") as f:
+        g = f.require_group(group)
+        g["POSITION"] = pos
+        g["FREQUENCY_VECTOR"] = freqs[:, None]
+        g["REAL_TFpref1"], g["IMAG_TFpref1"] = P.real, P.imag
+        g["REAL_TFxyzref1"], g["IMAG_TFxyzref1"] = U.real, U.imag
+        f[TRUTH] = truth
+    return dict(path=Path(path), pos=pos, freqs=freqs, outliers=truth)
+
+def load_truth(path) -> np.ndarray:
+    with h5py.File(path, "r") as f:
+        return f[TRUTH][()]
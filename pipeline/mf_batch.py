@@ -0,0 +1,161 @@
+# mf_pipeline/mf_batch.py
+import os, time, traceback
+import numpy as np
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from mf_pipeline.mf_config import H5_PATH, H5_GROUP
+from mf_pipeline.mf_fill import SliceReader, FillResult, noiseaware_compute, save_filled_npz
+from mf_pipeline.mf_geometry import get_geometry
+from mf_pipeline.mf_store import ResultsStore
+from mf_pipeline.mf_export import export_directivity_arrays, close_figures
+from mf_pipeline.mf_cache import StageCache
+from mf_pipeline.mf_profile import PROFILER
+
+# per-process state, set once by _init_worker
+_WORKER = {}
+
+@dataclass
+class BatchResult:
+    f0: float
+    npz: Path = None            # NPZ mode only
+    saved: list = field(default_factory=list)
+    error: str = None
+    seconds: float = 0.0
+    fill: FillResult = None     # store mode: arrays handed back to the parent for writing
+    coeffs: np.ndarray = None   # (metrics, K)
+    info: dict = None
+    lines: list = field(default_factory=list)    # log lines from the worker (e.g. --auto selections)
+    timings: list = field(default_factory=list)  # profiler records, when profiling is on
+
+def _init_worker(h5_path, group, geom, profile=None, cache=None):
+    _WORKER["reader"] = SliceReader(h5_path, group)
+    _WORKER["geom"] = geom
+    # one cache per worker, so its running size estimate survives across tasks
+    _WORKER["cache"] = cache
+    if profile is not None:
+        PROFILER.enable(**profile)
+
+def _run_one(f0, fill_kw, dir_kw, store_stem=None):
+    t0 = time.perf_counter()
+    cache = _WORKER["cache"]
+    res = BatchResult(f0)
+    mark = PROFILER.mark()
+    try:
+        R = noiseaware_compute(f0, reader=_WORKER["reader"], geom=_WORKER["geom"], cache=cache, **fill_kw)
+        if store_stem is None:
+            res.npz = save_filled_npz(R)
+            stem = res.npz.stem
+        else:
+            res.fill = R
+            stem = f"{store_stem}_{int(round(R.f0))}Hz"
+        if dir_kw is not None:
+            # store mode keeps the coefficients in sh/<metric> instead of per-bin NPZs
+            res.saved, res.coeffs, res.info = export_directivity_arrays(stem, R.pos, R.P, R.U, R.meta, cache=cache,
+                                                                        save_coeffs=store_stem is None,
+                                                                        log=res.lines.append, **dir_kw)
+    except Exception:
+        res.error = traceback.format_exc()
+    res.seconds = time.perf_counter() - t0
+    if PROFILER.enabled:
+        # hand the records back to the parent and keep the worker's list short
+        res.timings = PROFILER.since(mark); del PROFILER.records[mark:]
+        PROFILER.dump_cprofiles(tag=f"_{os.getpid()}")
+    return res
+
+def task_bytes(n_pos: int, dir_kw=None) -> int:
+    # rough in-flight footprint of one frequency: 4 complex channels (raw, filled, neighbour
+    # gathers) plus the evaluated map/sphere grids
+    b = n_pos * 4 * 16 * 8
+    if dir_kw is not None:
+        b += 4 * 8 * dir_kw.get("res_lon", 361) * dir_kw.get("res_lat", 181)
+    return b
+
+def run_batch(freqs, fill_kw=None, dir_kw=None, workers=None, max_inflight=None, mem_mb=None,
+              h5_path=H5_PATH, group=H5_GROUP, store: Path=None, store_layout: str="bins", cache: StageCache=None,
+              profile=None, log=print):
+    """Fill (+ directivity) for many frequencies in a pool of worker processes.
+
+    Each worker opens the H5 once; positions and the scan geometry are built
+    here once and handed to the workers read-only. At most `max_inflight`
+    frequencies are queued at a time (further capped by `mem_mb`).
+    With `store`, results go into one ResultsStore written by this process
+    instead of one NPZ per frequency (chunked per `store_layout`); with `cache`, stages whose inputs are
+    unchanged are skipped; `profile` (PROFILER.enable kwargs) turns on stage
+    timing in the workers. Returns BatchResults in completion order.
+    """
+    fill_kw = dict(fill_kw or {})
+    with SliceReader(h5_path, group) as R:
+        pos = R.pos
+        bins = np.unique(R.nearest_bins(freqs))
+        freqs = R.freq[bins].astype(float).tolist()
+    geom = get_geometry(pos, k_nn=fill_kw.get("k_nn", 12))
+    if fill_kw.get("grid", "auto") != "off":
+        geom.lattice   # detect once here; workers receive it with the geometry
+    workers = max(1, workers or os.cpu_count() or 1)
+    inflight = max_inflight or 2*workers
+    if mem_mb is not None:
+        inflight = min(inflight, max(1, int(mem_mb * 2**20 // task_bytes(len(pos), dir_kw))))
+    n = len(freqs)
+    results = []
+    t0 = time.perf_counter()
+
+    S = None
+    if store is not None:
+        params = dict(fill_kw, h5_path=str(h5_path), group=group)
+        S = ResultsStore.create(store, pos, freqs, params, layout=store_layout)
+    store_stem = Path(store).stem if store is not None else None
+
+    def report(res):
+        head = f"[{len(results)+1}/{n}] f0={res.f0:.1f} Hz"
+        if res.error is None and S is not None:
+            try:
+                # the bin is marked done only once its fill and SH rows are both written
+                k = S.bin_index(res.f0)
+                S.write_fill(res.fill, done=False)
+                sel = res.info.get("select") if res.info else None
+                for i, (metric, c) in enumerate(zip(res.info["metrics"] if res.info else (),
+                                                    res.coeffs if res.info else ())):
+                    S.write_sh(metric, k, c, res.info["lmax"], res.info["lam"], res.info["center"],
+                               select={f: v[i] for f, v in sel.items()} if sel is not None else None)
+                S.mark_done(k)
+            except Exception:
+                res.error = traceback.format_exc()
+            res.fill = None
+        results.append(res)
+        for line in res.lines:
+            log(line)
+        if res.error is not None:
+            log(f"{head} FAILED ({res.seconds:.1f}s)\n{res.error}")
+        else:
+            name = res.npz.name if res.npz is not None else S.path.name
+            log(f"{head} -> {name} ({res.seconds:.1f}s, elapsed {time.perf_counter()-t0:.1f}s)")
+
+    try:
+        if workers == 1:
+            _init_worker(h5_path, group, geom, profile, cache)
+            try:
+                for f0 in freqs:
+                    report(_run_one(f0, fill_kw, dir_kw, store_stem))
+            finally:
+                _WORKER.pop("reader").close(); _WORKER.pop("cache", None)
+                if dir_kw is not None:
+                    close_figures()
+            return results
+
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(h5_path, group, geom, profile, cache)) as ex:
+            todo = iter(freqs); pending = set()
+            while True:
+                for f0 in todo:
+                    pending.add(ex.submit(_run_one, f0, fill_kw, dir_kw, store_stem))
+                    if len(pending) >= inflight:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    report(fut.result())
+        return results
+    finally:
+        if S is not None:
+            S.close()
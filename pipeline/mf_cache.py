@@ -0,0 +1,124 @@
+# mf_pipeline/mf_cache.py
+import hashlib, json, os, zipfile
+import numpy as np
+from pathlib import Path
+from mf_pipeline.mf_config import EXPORTS
+
+CACHE_DIR = EXPORTS / "cache"
+
+# Mixed into every stage key: bump CACHE_VERSION when a stage's output changes for the same
+# inputs. The source of the modules that compute stage outputs is hashed in as well, so
+# editing them never serves artifacts written by the old code.
+CACHE_VERSION = 1
+_STAGE_MODULES = ("mf_fill.py", "mf_grid.py", "mf_geometry.py", "mf_directivity.py", "mf_store.py")
+
+def _code_salt() -> str:
+    h = hashlib.sha1(str(CACHE_VERSION).encode())
+    here = Path(__file__).resolve().parent
+    for name in _STAGE_MODULES:
+        try:
+            h.update((here / name).read_bytes())
+        except OSError:
+            h.update(name.encode())
+    return h.hexdigest()[:12]
+
+CODE_SALT = _code_salt()
+
+# full directory scan for eviction at least every this many puts (other processes share the cache)
+RESCAN_PUTS = 64
+
+def h5_identity(path) -> dict:
+    st = os.stat(path)
+    return dict(path=str(Path(path).resolve()), size=st.st_size, mtime_ns=st.st_mtime_ns)
+
+def array_digest(*arrays) -> str:
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(f"{a.dtype}{a.shape}".encode()); h.update(a.tobytes())
+    return h.hexdigest()
+
+def _plain(x):
+    if isinstance(x, np.generic):
+        return x.item()
+    if isinstance(x, (np.ndarray, tuple)):
+        return list(np.asarray(x).tolist()) if isinstance(x, np.ndarray) else list(x)
+    return str(x)
+
+def stage_key(stage: str, **parts) -> str:
+    """Content address of a stage: its name plus everything its output depends on.
+
+    Upstream keys are passed as parts, so a change anywhere up the chain
+    changes every downstream key while leaving unrelated stages cached.
+    """
+    blob = json.dumps(dict(parts, stage=stage, code=CODE_SALT), sort_keys=True, default=_plain)
+    return f"{stage}-{hashlib.sha1(blob.encode()).hexdigest()[:24]}"
+
+class StageCache:
+    """Stage artifacts as plain NPZ files under `root`, evicted LRU beyond `max_mb`.
+
+    A hit refreshes the file mtime, which is the LRU clock. With `force`
+    every lookup misses, so stages recompute and overwrite their artifact.
+    The cache size is tracked from this process's writes; the directory is
+    only rescanned when that estimate exceeds the budget or every
+    RESCAN_PUTS writes, so a long batch does not stat every file per put.
+    """
+    def __init__(self, root: Path=CACHE_DIR, max_mb: float=2048, force: bool=False):
+        self.root = Path(root); self.max_mb = max_mb; self.force = force
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._total = None   # bytes at the last scan plus this process's writes since
+        self._puts = 0
+
+    def path(self, key: str) -> Path:
+        return self.root / f"{key}.npz"
+
+    def get(self, key: str):
+        if self.force:
+            return None
+        p = self.path(key)
+        try:
+            with np.load(p) as Z:
+                out = {k: Z[k] for k in Z.files}
+            os.utime(p)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            # truncated or corrupt artifact (e.g. a killed writer): drop it and recompute
+            p.unlink(missing_ok=True)
+            return None
+        return out
+
+    def put(self, key: str, **arrays):
+        p = self.path(key)
+        tmp = p.with_name(f"{p.stem}.{os.getpid()}.tmp.npz")
+        np.savez(tmp, **arrays)
+        size = tmp.stat().st_size
+        os.replace(tmp, p)
+        self._puts += 1
+        if self._total is None or self._puts % RESCAN_PUTS == 0:
+            self.evict()
+            return
+        self._total += size
+        if self._total > self.max_mb * 2**20:
+            self.evict()
+
+    def evict(self):
+        files = []
+        for p in self.root.glob("*.npz"):
+            if p.name.endswith(".tmp.npz"):   # another process's write in flight
+                continue
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        total = sum(f[1] for f in files)
+        budget = self.max_mb * 2**20
+        for _, size, p in sorted(files):
+            if total <= budget:
+                break
+            try:
+                p.unlink(); total -= size
+            except FileNotFoundError:
+                pass
+        self._total = total
@@ -1,10 +1,11 @@
 # mf_pipeline/mf_config.py
+import os
 from pathlib import Path
 
-# ABSOLUTE output directory (all PNG/NPZ/CSV land here)
-EXPORTS = Path("/Users/marcialsanchis/Desktop/PhD/ModeAir/MicroFLown/mf_pipeline/exports")
+# ABSOLUTE output directory (all PNG/NPZ/CSV land here); MF_EXPORTS overrides it
+EXPORTS = Path(os.environ.get("MF_EXPORTS", "/Users/marcialsanchis/Desktop/PhD/ModeAir/MicroFLown/mf_pipeline/exports"))
 EXPORTS.mkdir(parents=True, exist_ok=True)
 
-# H5 location (absolute)
-H5_PATH = Path("/Users/marcialsanchis/Desktop/PhD/ModeAir/MicroFLown/exports") / "Loudspeaker_20mm.h5"
-H5_GROUP = "/Proc-2_3D_Cuboid,20_mm_resolution"
+# H5 location (absolute); MF_H5_PATH / MF_H5_GROUP override it (e.g. for synthetic benchmark scans)
+H5_PATH = Path(os.environ.get("MF_H5_PATH", Path("/Users/marcialsanchis/Desktop/PhD/ModeAir/MicroFLown/exports") / "Loudspeaker_20mm.h5"))
+H5_GROUP = os.environ.get("MF_H5_GROUP", "/Proc-2_3D_Cuboid,20_mm_resolution")
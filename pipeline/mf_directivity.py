@@ -1,7 +1,12 @@
 # mf_pipeline/mf_directivity.py
+import hashlib
 import numpy as np
 from pathlib import Path
-from scipy.special import sph_harm
+from dataclasses import dataclass
+from scipy.linalg import cho_factor, cho_solve
+from mf_pipeline.mf_profile import PROFILER
+
+METRICS = ("u_mag", "ux", "uy", "uz", "p")
 
 def to_spherical(P: np.ndarray, center=None):
     if center is None: center = P.mean(axis=0)
@@ -12,31 +17,137 @@ def to_spherical(P: np.ndarray, center=None):
     phi   = np.arctan2(y,x)
     return r, theta, phi, center
 
-def design_SH(theta, phi, lmax):
+def _legendre_by_order(theta, lmax):
+    """Yield (m, Pm) with Pm[l-m] the orthonormal P_l^m(cos theta), l = m..lmax.
+
+    Normalized so that P_l^m(cos theta) e^{i m phi} is the complex Y_l^m
+    (Condon-Shortley phase included); one stable three-term recurrence per order.
+    """
+    x = np.cos(theta); s = np.sin(theta)
+    pmm = np.full(x.shape, 0.5/np.sqrt(np.pi))
+    for m in range(lmax+1):
+        if m > 0:
+            pmm = -np.sqrt((2*m+1)/(2*m)) * s * pmm
+        Pm = np.empty((lmax+1-m,) + x.shape)
+        Pm[0] = pmm
+        if m < lmax:
+            Pm[1] = np.sqrt(2*m+3) * x * pmm
+        for l in range(m+2, lmax+1):
+            a = np.sqrt((4*l*l - 1) / (l*l - m*m))
+            b = np.sqrt(((l-1)**2 - m*m) / (4*(l-1)**2 - 1))
+            Pm[l-m] = a * (x*Pm[l-m-1] - b*Pm[l-m-2])
+        yield m, Pm
+
+def design_SH(theta, phi, lmax, dtype=np.float64, out=None):
+    # columns per degree l: m=0, then (sqrt2*Re, sqrt2*Im) of Y_l^m for m=1..l
+    theta = np.asarray(theta, float).ravel(); phi = np.asarray(phi, float).ravel()
     N = theta.size; cols = (lmax+1)**2
-    A = np.zeros((N, cols), float); c = 0
-    for l in range(lmax+1):
-        A[:, c] = sph_harm(0, l, phi, theta).real; c += 1
-        for m in range(1, l+1):
-            Y = sph_harm(m, l, phi, theta)
-            A[:, c] = np.sqrt(2)*Y.real; c += 1
-            A[:, c] = np.sqrt(2)*Y.imag; c += 1
+    A = np.empty((N, cols), dtype) if out is None else out
+    c1, s1 = np.cos(phi), np.sin(phi)
+    cm, sm = np.ones(N), np.zeros(N)
+    for m, Pm in _legendre_by_order(theta, lmax):
+        l = np.arange(m, lmax+1)
+        if m == 0:
+            A[:, l*l] = Pm.T
+            continue
+        cm, sm = cm*c1 - sm*s1, sm*c1 + cm*s1
+        Pm *= np.sqrt(2)
+        A[:, l*l + 2*m - 1] = (Pm*cm).T
+        A[:, l*l + 2*m] = (Pm*sm).T
     return A
 
-def fit_SH(P: np.ndarray, v: np.ndarray, lmax=8, lam=1e-3, center=None):
+@dataclass
+class SHSolver:
+    """Cached regularized least-squares operator G = (A^T A + lam I)^-1 A^T.
+
+    Positions, centre, lmax and lam are shared by every metric and frequency,
+    so one Cholesky factorization serves them all; each fit is a single GEMM.
+    """
+    lmax: int
+    lam: float
+    center: np.ndarray
+    G: np.ndarray   # (K,N)
+
+    def solve(self, V: np.ndarray) -> np.ndarray:
+        # V: (N, ...) metric values -> (K, ...) coefficients
+        V = np.asarray(V)
+        return (self.G @ V.reshape(V.shape[0], -1)).reshape((self.G.shape[0],) + V.shape[1:])
+
+_SOLVERS = {}
+
+def clear_solver_cache():
+    # drop cached factorizations, e.g. to time cold fits
+    _SOLVERS.clear()
+
+def sh_solver(P: np.ndarray, lmax=8, lam=1e-3, center=None) -> SHSolver:
     _, th, ph, C = to_spherical(P, center)
-    A = design_SH(th, ph, lmax)
-    ATA, ATv = A.T@A, A.T@v
-    coeffs = np.linalg.solve(ATA + lam*np.eye(ATA.shape[0]), ATv)
-    return coeffs, dict(lmax=lmax, center=C)
+    h = hashlib.sha1(np.ascontiguousarray(P, dtype=np.float64).tobytes())
+    h.update(np.asarray(C, np.float64).tobytes())
+    key = (h.hexdigest(), int(lmax), float(lam))
+    S = _SOLVERS.get(key)
+    if S is None:
+        with PROFILER.stage("sh_factor", n_pos=len(P), lmax=lmax, lam=lam) as st:
+            A = design_SH(th, ph, lmax)
+            G = cho_solve(cho_factor(A.T@A + lam*np.eye(A.shape[1])), A.T)
+            st.note(nbytes=A.nbytes + G.nbytes)
+        S = _SOLVERS[key] = SHSolver(lmax, lam, C, G)
+        if len(_SOLVERS) > 16:
+            _SOLVERS.pop(next(iter(_SOLVERS)))
+    return S
+
+def fit_SH(P: np.ndarray, v: np.ndarray, lmax=8, lam=1e-3, center=None):
+    S = sh_solver(P, lmax=lmax, lam=lam, center=center)
+    return S.solve(v), dict(lmax=lmax, center=S.center)
+
+def metric_block(P_fill: np.ndarray, U_fill: np.ndarray, metrics=METRICS) -> np.ndarray:
+    # (..., N) / (..., N, 3) -> (N, ..., M) block of scalar metrics, sensors first
+    V = np.stack([choose_metric(P_fill, U_fill, which=w) for w in metrics], axis=-1)
+    return np.moveaxis(V, -2, 0)
+
+def fit_SH_band(P: np.ndarray, P_fill: np.ndarray, U_fill: np.ndarray, metrics=METRICS,
+                lmax=8, lam=1e-3, center=None):
+    """Fit all metrics (and all frequencies, if P_fill is (F,N)) in one solve.
+
+    Returns coefficients shaped P_fill.shape[:-1] + (len(metrics), K).
+    """
+    S = sh_solver(P, lmax=lmax, lam=lam, center=center)
+    with PROFILER.stage("fit_SH", n_pos=len(P), lmax=lmax, n_rhs=int(np.prod(P_fill.shape[:-1]))*len(metrics)):
+        coeffs = np.moveaxis(S.solve(metric_block(P_fill, U_fill, metrics)), 0, -1)
+    return coeffs, dict(lmax=lmax, lam=lam, center=S.center, metrics=tuple(metrics))
+
+def sh_synthesize(coeffs, lmax, theta, phi):
+    """Evaluate an SH expansion on the tensor grid theta (rows) x phi (columns).
+
+    Separable: Legendre terms are computed once per theta row and reduced to
+    per-order cos/sin amplitudes, then synthesized over phi with a small
+    cos/sin(m*phi) table. Memory is O(n_theta*K + grid), never the dense
+    design matrix. `coeffs` is (K,) or (K, ...); the result is
+    (..., n_theta, n_phi).
+    """
+    theta = np.asarray(theta, float).ravel(); phi = np.asarray(phi, float).ravel()
+    with PROFILER.stage("sh_synthesize", lmax=lmax, n_theta=theta.size, n_phi=phi.size) as st:
+        V = _synthesize(np.asarray(coeffs), lmax, theta, phi)
+        st.note(nbytes=V.nbytes)
+    return V
+
+def _synthesize(coeffs, lmax, theta, phi):
+    Cc = coeffs.reshape(coeffs.shape[0], -1)            # (K,R)
+    a = np.zeros((lmax+1, Cc.shape[1], theta.size)); b = np.zeros_like(a)
+    for m, Pm in _legendre_by_order(theta, lmax):
+        l = np.arange(m, lmax+1)
+        if m == 0:
+            a[0] = Cc[l*l].T @ Pm
+        else:
+            a[m] = np.sqrt(2) * (Cc[l*l + 2*m - 1].T @ Pm)
+            b[m] = np.sqrt(2) * (Cc[l*l + 2*m].T @ Pm)
+    mphi = np.outer(np.arange(lmax+1), phi)
+    V = np.tensordot(a, np.cos(mphi), axes=(0, 0)) + np.tensordot(b, np.sin(mphi), axes=(0, 0))
+    return V.reshape(coeffs.shape[1:] + (theta.size, phi.size))
 
 def eval_SH_map(coeffs, lmax=8, res=(361,181)):
     lon = np.linspace(-np.pi, np.pi, res[0])
     lat = np.linspace(-np.pi/2, np.pi/2, res[1])
-    Lon, Lat = np.meshgrid(lon, lat)
-    th = np.pi/2 - Lat; ph = Lon
-    A = design_SH(th.ravel(), ph.ravel(), lmax)
-    V = (A @ coeffs).reshape(Lat.shape)
+    V = sh_synthesize(coeffs, lmax, np.pi/2 - lat, lon)
     return np.rad2deg(lon), np.rad2deg(lat), V
 
 def load_filled_npz(npz_path: Path):
@@ -46,13 +157,13 @@ def load_filled_npz(npz_path: Path):
 def choose_metric(P_fill: np.ndarray, U_fill: np.ndarray, which: str="u_mag"):
     which = which.lower()
     if which == "u_mag":
-        return np.linalg.norm(U_fill, axis=1)
+        return np.linalg.norm(U_fill, axis=-1)
     if which == "ux":
-        return np.abs(U_fill[:,0])
+        return np.abs(U_fill[...,0])
     if which == "uy":
-        return np.abs(U_fill[:,1])
+        return np.abs(U_fill[...,1])
     if which == "uz":
-        return np.abs(U_fill[:,2])
+        return np.abs(U_fill[...,2])
     if which == "p":
         return np.abs(P_fill)
     raise ValueError("which must be one of: u_mag, ux, uy, uz, p")
@@ -66,21 +177,146 @@ def unit_sphere_grid(n_theta=181, n_phi=361):
 
 def eval_on_sphere(coeffs, lmax=8, n_theta=181, n_phi=361):
     Th, Ph = unit_sphere_grid(n_theta=n_theta, n_phi=n_phi)
-    A = design_SH(Th.ravel(), Ph.ravel(), lmax)
-    V = (A @ coeffs).reshape(Th.shape)
+    V = sh_synthesize(coeffs, lmax, Th[:, 0], Ph[0])
     return Th, Ph, V
 
 def polar_cut_azimuth(coeffs, lmax=8, elevation_deg=0.0, n=361):
     phi = np.linspace(-np.pi, np.pi, n)
-    theta = np.deg2rad(90.0 - elevation_deg) * np.ones_like(phi)
-    A = design_SH(theta, phi, lmax)
-    v = A @ coeffs
+    theta = np.deg2rad(90.0 - elevation_deg)
+    v = sh_synthesize(coeffs, lmax, theta, phi)[..., 0, :]
     return np.rad2deg(phi), v
 
 def polar_cut_elevation(coeffs, lmax=8, azimuth_deg=0.0, n=181):
     theta = np.linspace(0.0, np.pi, n)
-    phi = np.deg2rad(azimuth_deg) * np.ones_like(theta)
-    A = design_SH(theta, phi, lmax)
-    v = A @ coeffs
+    phi = np.deg2rad(azimuth_deg)
+    v = sh_synthesize(coeffs, lmax, theta, phi)[..., :, 0]
     elev_deg = 90.0 - np.rad2deg(theta)
     return elev_deg, v
+
+# --- full-band products (coefficients stacked as (F,K)) ---
+def cut_directions(n=361):
+    """Angles (deg, -180..180) and (theta, phi) of the horizontal (el=0) and
+    vertical (x-z plane) great circles through the on-axis direction +x.
+    Vertical angle 90 is +z."""
+    a = np.linspace(-180.0, 180.0, n)
+    r = np.deg2rad(a)
+    th = np.concatenate([np.full(n, np.pi/2), np.arccos(np.clip(np.sin(r), -1, 1))])
+    ph = np.concatenate([r, np.where(np.cos(r) >= 0, 0.0, np.pi)])
+    return a, th, ph
+
+def band_cuts(coeffs, lmax, n=361):
+    # (F,K) -> angles, horizontal (F,n), vertical (F,n): one basis matrix, one GEMM
+    a, th, ph = cut_directions(n)
+    B = design_SH(th, ph, lmax)
+    with PROFILER.stage("band_cuts", lmax=lmax, n_freq=len(coeffs), n_dir=2*n) as st:
+        V = np.asarray(coeffs) @ B.T
+        st.note(nbytes=V.nbytes)
+    return a, V[:, :n], V[:, n:]
+
+def beamwidth(angle_deg, V, drop_db=6.0):
+    """Width (deg) of the lobe around angle 0 where |V| stays within drop_db of
+    the on-axis value, per row of V (F,n); crossings are linearly interpolated.
+    A side that never drops contributes 180 deg."""
+    angle_deg = np.asarray(angle_deg, float)
+    A = np.abs(V) + 1e-30
+    i0 = int(np.argmin(np.abs(angle_deg)))
+    L = 20*np.log10(A / A[:, i0:i0+1])
+    rows = np.arange(len(L))
+    width = np.zeros(len(L))
+    for idx in (np.arange(i0, len(angle_deg)), np.arange(i0, -1, -1)):
+        below = L[:, idx] < -drop_db
+        j = np.maximum(below.argmax(axis=1), 1)
+        a0, a1 = angle_deg[idx[j-1]], angle_deg[idx[j]]
+        l0, l1 = L[rows, idx[j-1]], L[rows, idx[j]]
+        t = (-drop_db - l0) / np.where(l1 != l0, l1 - l0, 1.0)
+        width += np.where(below.any(axis=1), np.abs(a0 + t*(a1 - a0)), 180.0)
+    return width
+
+def directivity_index(coeffs, v_axis):
+    # DI = 10 log10(4 pi v_axis^2 / integral v^2 dOmega); the basis is orthonormal, so the integral is sum c^2
+    coeffs = np.asarray(coeffs)
+    return 10*np.log10(4*np.pi*np.abs(v_axis)**2 / ((coeffs**2).sum(axis=-1) + 1e-300) + 1e-300)
+
+# --- automatic lmax / lambda selection ---
+LAMBDAS = np.logspace(-6, 0, 25)
+SELECT_FIELDS = ("lmax", "lam", "gcv", "rms", "loo_rms", "dof")
+
+def select_SH(P: np.ndarray, V: np.ndarray, lmax=12, lambdas=LAMBDAS, center=None, criterion="gcv", lmin=1):
+    """Pick (lmax, lam) per right-hand side of V (N, ...) from one factorization.
+
+    A = design_SH at the largest lmax is factored once as A = QR. The design
+    for a smaller degree L is the leading (L+1)^2 columns, i.e. Q R[:, :K_L],
+    so its singular values come from an SVD of that small block of R. With
+    filter factors f = s^2/(s^2+lam), every (L, lam) gets its residual,
+    effective dof, GCV score = N*RSS/(N-dof)^2 and, for criterion="loo",
+    the leave-one-out residual from the hat diagonal, all without refitting.
+    Returns coefficients (K, ...) of the chosen model, zero-padded to the
+    largest lmax (so they evaluate with lmax), and a dict of SELECT_FIELDS
+    arrays shaped V.shape[1:] plus the centre.
+    """
+    if criterion not in ("gcv", "loo"):
+        raise ValueError("criterion must be 'gcv' or 'loo'")
+    _, th, ph, C = to_spherical(P, center)
+    lambdas = np.asarray(lambdas, float)
+    V = np.asarray(V, float)
+    N = V.shape[0]
+    Vf = V.reshape(N, -1)
+    Rr = Vf.shape[1]
+    Kmax = (lmax+1)**2
+    with PROFILER.stage("sh_select", n_pos=N, lmax=lmax, n_lam=lambdas.size, n_rhs=Rr) as st:
+        Q, R = np.linalg.qr(design_SH(th, ph, lmax))
+        QtV = Q.T @ Vf
+        vv = (Vf**2).sum(axis=0)
+        coeffs = np.zeros((Kmax, Rr))
+        best = np.full(Rr, np.inf)
+        out = {k: np.full(Rr, np.nan) for k in SELECT_FIELDS}
+        for L in range(lmin, lmax+1):
+            K = (L+1)**2
+            Ur, s, Wt = np.linalg.svd(R[:, :K], full_matrices=False)
+            beta = Ur.T @ QtV                                        # (r,Rr)
+            f = s[:, None]**2 / (s[:, None]**2 + lambdas[None, :])   # (r,nlam)
+            rss = np.maximum(vv - (beta**2).sum(axis=0) + ((1 - f)**2).T @ beta**2, 0)   # (nlam,Rr)
+            dof = f.sum(axis=0)
+            gcv = N*rss / np.maximum(N - dof, 1e-12)[:, None]**2
+            U = Q @ Ur                                               # (N,r)
+            if criterion == "loo":
+                H = (U**2) @ f                                       # hat diagonal (N,nlam)
+                score = np.stack([(((Vf - U @ (f[:, j, None]*beta)) / (1 - H[:, j, None]))**2).mean(axis=0)
+                                  for j in range(lambdas.size)])
+            else:
+                score = gcv
+            j = score.argmin(axis=0)
+            sel = np.flatnonzero(score[j, np.arange(Rr)] < best)
+            if sel.size == 0:
+                continue
+            js = j[sel]
+            best[sel] = score[js, sel]
+            fs = f[:, js]                                            # (r,nsel)
+            coeffs[:, sel] = 0.0
+            coeffs[:K, sel] = Wt.T @ (np.divide(fs, s[:, None], out=np.zeros_like(fs), where=s[:, None] > 0)
+                                      * beta[:, sel])
+            E = Vf[:, sel] - U @ (fs*beta[:, sel])
+            H = (U**2) @ fs
+            out["lmax"][sel] = L; out["lam"][sel] = lambdas[js]
+            out["gcv"][sel] = gcv[js, sel]; out["dof"][sel] = dof[js]
+            out["rms"][sel] = np.sqrt((E**2).mean(axis=0))
+            out["loo_rms"][sel] = np.sqrt(((E / (1 - H))**2).mean(axis=0))
+        st.note(nbytes=Q.nbytes + R.nbytes)
+    shape = V.shape[1:]
+    info = {k: v.reshape(shape) for k, v in out.items()}
+    info["lmax"] = info["lmax"].astype(int)
+    info["center"] = C
+    return coeffs.reshape((Kmax,) + shape), info
+
+def fit_SH_band_auto(P: np.ndarray, P_fill: np.ndarray, U_fill: np.ndarray, metrics=METRICS,
+                     lmax=12, lambdas=LAMBDAS, center=None, criterion="gcv"):
+    """fit_SH_band with (lmax, lam) chosen per frequency and metric by select_SH.
+
+    Coefficients are zero-padded to `lmax`; info["select"] holds the chosen
+    values and residual statistics shaped P_fill.shape[:-1] + (len(metrics),).
+    """
+    c, sel = select_SH(P, metric_block(P_fill, U_fill, metrics), lmax=lmax, lambdas=lambdas,
+                       center=center, criterion=criterion)
+    C = sel.pop("center")
+    return np.moveaxis(c, 0, -1), dict(lmax=lmax, lam=np.nan, center=C, metrics=tuple(metrics),
+                                       criterion=criterion, select=sel)
@@ -0,0 +1,140 @@
+# mf_pipeline/mf_export.py
+import pathlib
+import numpy as np
+from mf_pipeline.mf_config import EXPORTS
+from mf_pipeline.mf_directivity import (
+    SELECT_FIELDS, load_filled_npz, fit_SH_band, fit_SH_band_auto, eval_SH_map, unit_sphere_grid,
+    eval_on_sphere, polar_cut_azimuth, polar_cut_elevation
+)
+from mf_pipeline.mf_plots import DirectivityFigures
+from mf_pipeline.mf_cache import StageCache, stage_key, array_digest
+from mf_pipeline.mf_profile import PROFILER
+
+# Directivity export of one frequency (SH fit -> maps, cuts, coefficient NPZ, figures),
+# shared by run_directivity.py and the batch workers in mf_batch.
+
+def _to_db(x, floor_db=-60.0):
+    x = np.abs(x)
+    x = x / (x.max() + 1e-18)
+    return 20.0 * np.log10(np.maximum(x, 10.0**(floor_db/20.0)))
+
+def evaluate_metric(coeffs, lmax, res_lon=361, res_lat=181):
+    lon, lat, Vmap = eval_SH_map(coeffs, lmax=lmax, res=(res_lon, res_lat))
+    _, _, Vsph = eval_on_sphere(coeffs, lmax=lmax, n_theta=res_lat, n_phi=res_lon)
+    phi_deg, v_h = polar_cut_azimuth(coeffs, lmax=lmax, elevation_deg=0.0, n=361)
+    elev_deg, v_v = polar_cut_elevation(coeffs, lmax=lmax, azimuth_deg=0.0, n=181)
+    return dict(lon=lon, lat=lat, Vmap=Vmap, Vsph=Vsph, phi_deg=phi_deg, v_h=v_h, elev_deg=elev_deg, v_v=v_v)
+
+def export_metric(base, metric, coeffs, info, meta, res_lon=361, res_lat=181, db=False,
+                  cache: StageCache=None, fit_key: str=None):
+    E = None
+    if cache is not None:
+        map_key = stage_key("sh_map", fit=fit_key, metric=metric, res_lon=res_lon, res_lat=res_lat)
+        E = cache.get(map_key)
+    if E is None:
+        with PROFILER.stage("sh_eval", f0=meta.get("f0"), metric=metric, lmax=info["lmax"]):
+            E = evaluate_metric(coeffs, info["lmax"], res_lon=res_lon, res_lat=res_lat)
+        if cache is not None:
+            cache.put(map_key, **E)
+
+    with PROFILER.stage("plot_directivity", f0=meta.get("f0"), metric=metric):
+        return _write_metric_outputs(base, metric, E, meta, res_lon=res_lon, res_lat=res_lat, db=db)
+
+# per-process figure templates, reused by every metric and frequency rendered here
+_FIGURES = {}
+
+def directivity_figures() -> DirectivityFigures:
+    if "dir" not in _FIGURES:
+        _FIGURES["dir"] = DirectivityFigures()
+    return _FIGURES["dir"]
+
+def close_figures():
+    for F in _FIGURES.values():
+        F.close()
+    _FIGURES.clear()
+
+def _write_metric_outputs(base, metric, E, meta, res_lon=361, res_lat=181, db=False):
+    saved = []
+    # Equirectangular map (lon/lat)
+    lon, lat, Vmap = E["lon"], E["lat"], E["Vmap"]
+    out_npz_map = base.with_name(base.name + "_map_lonlat.npz")
+    np.savez(out_npz_map, lon_deg=lon, lat_deg=lat, V=Vmap)
+
+    # True (theta, phi) sphere grid
+    Th, Ph = unit_sphere_grid(n_theta=res_lat, n_phi=res_lon)
+    out_npz_sph = base.with_name(base.name + "_sphere_theta_phi.npz")
+    np.savez(out_npz_sph, theta=Th, phi=Ph, V=E["Vsph"])  # radians
+
+    # Heatmap + horizontal polar (elev=0°) + vertical cut (az=0°)
+    png = directivity_figures().render(
+        base, meta.get("f0", np.nan), metric, lon, lat, _to_db(Vmap) if db else Vmap,
+        E["phi_deg"], _to_db(E["v_h"]) if db else np.abs(E["v_h"]),
+        E["elev_deg"], _to_db(E["v_v"]) if db else np.abs(E["v_v"]), db=db)
+    return [png[0], out_npz_map, out_npz_sph] + png[1:]
+
+def save_sh_coeffs(stem, coeffs, info, meta) -> pathlib.Path:
+    # the fitted model itself: (metrics, K) coefficients plus what is needed to evaluate them (see mf_shmodel)
+    # with automatic selection, coeffs are zero-padded to lmax and lam / select_* are per metric
+    out = (EXPORTS / f"{stem}_sh_coeffs.npz").resolve()
+    sel = info.get("select")
+    extra = {f"select_{k}": v for k, v in sel.items()} if sel is not None else {}
+    np.savez(out, coeffs=np.asarray(coeffs), metrics=np.array(info["metrics"]), lmax=info["lmax"],
+             lam=sel["lam"] if sel is not None else info["lam"], center=np.asarray(info["center"], float),
+             f0=float(meta.get("f0", np.nan)), **extra)
+    return out
+
+def selection_lines(meta, info) -> list:
+    sel = info["select"]
+    return [f"{meta.get('f0', np.nan):.1f} Hz {m}: lmax={sel['lmax'][i]} lam={sel['lam'][i]:.3g} "
+            f"rms={sel['rms'][i]:.4g} loo_rms={sel['loo_rms'][i]:.4g} gcv={sel['gcv'][i]:.4g} dof={sel['dof'][i]:.1f}"
+            for i, m in enumerate(info["metrics"])]
+
+def export_directivity_arrays(stem, pos, P_fill, U_fill, meta, metrics=("u_mag",), lmax=8, lam=1e-3,
+                              res_lon=361, res_lat=181, db=False, cache: StageCache=None, save_coeffs=True,
+                              auto: str=None, log=print):
+    # auto: None, or "gcv" / "loo" to pick lmax (up to `lmax`) and lam per metric (lam is then ignored)
+    metrics = list(metrics)
+    fit_key = None
+    hit = None
+    if cache is not None:
+        fit_key = stage_key("sh_fit", data=array_digest(pos, P_fill, U_fill), metrics=metrics, lmax=lmax,
+                            lam=None if auto else lam, auto=auto)
+        hit = cache.get(fit_key)
+    if hit is not None:
+        coeffs = hit["coeffs"]
+        info = dict(lmax=lmax, lam=lam, center=hit["center"], metrics=tuple(metrics))
+        if auto:
+            info.update(lam=np.nan, criterion=auto, select={k: hit[f"select_{k}"] for k in SELECT_FIELDS})
+    else:
+        if auto:
+            # one QR of the largest design matrix scores every (lmax, lam) for every metric
+            coeffs, info = fit_SH_band_auto(pos, P_fill, U_fill, metrics=metrics, lmax=lmax, criterion=auto)
+        else:
+            # One factorization + one GEMM for every requested metric
+            coeffs, info = fit_SH_band(pos, P_fill, U_fill, metrics=metrics, lmax=lmax, lam=lam, center=None)
+        if cache is not None:
+            extra = {f"select_{k}": v for k, v in info["select"].items()} if auto else {}
+            cache.put(fit_key, coeffs=coeffs, center=info["center"], **extra)
+    if auto:
+        for line in selection_lines(meta, info):
+            log(line)
+
+    # Always save into absolute EXPORTS
+    saved = [save_sh_coeffs(stem, coeffs, info, meta)] if save_coeffs else []
+    for i, (metric, c) in enumerate(zip(metrics, coeffs)):
+        base = (EXPORTS / f"{stem}_{metric}").resolve()
+        info_m = info
+        if auto:
+            L = int(info["select"]["lmax"][i])
+            c, info_m = c[:(L+1)**2], dict(info, lmax=L, lam=float(info["select"]["lam"][i]))
+        saved += export_metric(base, metric, c, info_m, meta, res_lon=res_lon, res_lat=res_lat, db=db,
+                               cache=cache, fit_key=fit_key)
+    return saved, coeffs, info
+
+def export_directivity(npz, metrics=("u_mag",), lmax=8, lam=1e-3, res_lon=361, res_lat=181, db=False,
+                       cache: StageCache=None, auto: str=None):
+    npz = pathlib.Path(npz)
+    pos, P_fill, U_fill, meta = load_filled_npz(npz)
+    saved, _, _ = export_directivity_arrays(npz.stem, pos, P_fill, U_fill, meta, metrics, lmax=lmax, lam=lam,
+                                            res_lon=res_lon, res_lat=res_lat, db=db, cache=cache, auto=auto)
+    return saved
@@ -1,10 +1,15 @@
 # mf_pipeline/mf_fill.py
+import warnings
 import numpy as np, h5py
 from pathlib import Path
 from dataclasses import dataclass
 from scipy.spatial import cKDTree
-from scipy.interpolate import Rbf
 from mf_pipeline.mf_config import H5_PATH, H5_GROUP, EXPORTS
+from mf_pipeline.mf_geometry import K_FILL, ScanGeometry, get_geometry, query_knn, multiquadric_eps
+from mf_pipeline.mf_grid import grid_robust_zscores, grid_fill_channels, stencil_size
+from mf_pipeline.mf_store import pack_flags, unpack_flags
+from mf_pipeline.mf_cache import StageCache, stage_key, h5_identity
+from mf_pipeline.mf_profile import PROFILER
 
 @dataclass
 class SliceData:
@@ -13,73 +18,294 @@ class SliceData:
     Uk: np.ndarray   # (N,3) complex
     pos: np.ndarray  # (N,3) float
 
+@dataclass
+class MultiSliceData:
+    f0: np.ndarray   # (F,) float, actual bin frequencies
+    P: np.ndarray    # (F,N) complex
+    U: np.ndarray    # (F,N,3) complex
+    pos: np.ndarray  # (N,3) float
+
+def _bin_runs(bins: np.ndarray):
+    # split sorted unique bin indices into contiguous [start, stop) runs
+    if bins.size == 0:
+        return []
+    cut = np.flatnonzero(np.diff(bins) != 1) + 1
+    return [(int(r[0]), int(r[-1]) + 1) for r in np.split(bins, cut)]
+
+class SliceReader:
+    """Keeps the H5 file open and reads frequency bins as on-disk hyperslabs.
+
+    The frequency vector, positions and dataset handles are cached, so each
+    requested bin costs roughly one bin's worth of I/O.
+    """
+    def __init__(self, h5_path=H5_PATH, group: str=H5_GROUP):
+        self.h5_path = Path(h5_path); self.group = group
+        self._f = h5py.File(self.h5_path, "r")
+        g = self._f[group]
+        self._rp, self._ip = g["REAL_TFpref1"], g["IMAG_TFpref1"]
+        self._ru, self._iu = g["REAL_TFxyzref1"], g["IMAG_TFxyzref1"]
+        self._pos_ds = g["POSITION"]
+        self.freq = np.array(g["FREQUENCY_VECTOR"]).ravel()
+        self._pos = None
+
+    @property
+    def pos(self) -> np.ndarray:
+        if self._pos is None:
+            self._pos = np.array(self._pos_ds)
+        return self._pos
+
+    def nearest_bins(self, freqs) -> np.ndarray:
+        freqs = np.atleast_1d(np.asarray(freqs, float))
+        return np.abs(self.freq[None, :] - freqs[:, None]).argmin(axis=1)
+
+    def _read(self, ds, bins: np.ndarray) -> np.ndarray:
+        out = np.empty((bins.size,) + ds.shape[1:], dtype=ds.dtype)
+        o = 0
+        for a, b in _bin_runs(bins):
+            ds.read_direct(out, source_sel=np.s_[a:b], dest_sel=np.s_[o:o+b-a])
+            o += b - a
+        return out
+
+    def read_bins(self, bins):
+        """Complex P (F,N) and U (F,N,3) for the given bin indices, in the given order."""
+        bins = np.atleast_1d(np.asarray(bins, int))
+        ub, inv = np.unique(bins, return_inverse=True)
+        P = self._read(self._rp, ub) + 1j*self._read(self._ip, ub)
+        U = self._read(self._ru, ub) + 1j*self._read(self._iu, ub)
+        return P[inv], U[inv]
+
+    def load_slices(self, freqs) -> MultiSliceData:
+        k = self.nearest_bins(freqs)
+        P, U = self.read_bins(k)
+        return MultiSliceData(self.freq[k].astype(float), P, U, self.pos)
+
+    def load_slice(self, f_target: float) -> SliceData:
+        M = self.load_slices([f_target])
+        return SliceData(float(M.f0[0]), M.P[0], M.U[0], M.pos)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close(); self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 def load_positions() -> np.ndarray:
     with h5py.File(H5_PATH, "r") as f:
         pos = np.array(f[f"{H5_GROUP}/POSITION"])
     return pos
 
 def load_slice_complex(f_target: float) -> SliceData:
-    with h5py.File(H5_PATH, "r") as f:
-        freq = np.array(f[f"{H5_GROUP}/FREQUENCY_VECTOR"]).ravel()
-        k = int(np.argmin(np.abs(freq - f_target)))
-        Rp = np.array(f[f"{H5_GROUP}/REAL_TFpref1"])[k]     # (N,)
-        Ip = np.array(f[f"{H5_GROUP}/IMAG_TFpref1"])[k]
-        Ru = np.array(f[f"{H5_GROUP}/REAL_TFxyzref1"])[k]   # (N,3)
-        Iu = np.array(f[f"{H5_GROUP}/IMAG_TFxyzref1"])[k]
-        pos = np.array(f[f"{H5_GROUP}/POSITION"])
-    Pk = Rp + 1j*Ip
-    Uk = Ru + 1j*Iu
-    return SliceData(float(freq[k]), Pk, Uk, pos)
+    with SliceReader() as R:
+        return R.load_slice(f_target)
+
+def load_slices(freqs) -> MultiSliceData:
+    with SliceReader() as R:
+        return R.load_slices(freqs)
+
+# channel order used by the batched detector/filler: |P|, |Ux|, |Uy|, |Uz|
+CHANNELS = ("p", "ux", "uy", "uz")
+
+def channel_magnitudes(Pk: np.ndarray, Uk: np.ndarray) -> np.ndarray:
+    # (..., N) and (..., N, 3) complex -> (..., 4, N) magnitudes
+    return np.abs(np.concatenate([Pk[..., None, :], np.moveaxis(Uk, -1, -2)], axis=-2))
+
+def robust_zscores(values: np.ndarray, nbr_idx: np.ndarray, max_elems: int=2**24) -> np.ndarray:
+    """Robust z-scores |v - med| / (1.4826*MAD) over each sensor's kNN set.
+
+    `values` is (..., N) (e.g. (F, C, N) for many frequencies and channels);
+    neighbour values are gathered into (..., n, k) blocks of at most
+    `max_elems` elements so memory stays bounded.
+    """
+    values = np.asarray(values)
+    N, k = nbr_idx.shape
+    lead = values.shape[:-1]
+    V = values.reshape(-1, N)
+    z = np.empty(V.shape, float)
+    step = max(1, max_elems // max(1, V.shape[0]*k))
+    for a in range(0, N, step):
+        b = min(N, a + step)
+        G = V[:, nbr_idx[a:b]]                      # (B, n, k)
+        med = np.median(G, axis=-1)
+        mad = np.median(np.abs(G - med[..., None]), axis=-1)
+        sig = 1.4826*mad + 1e-12
+        z[:, a:b] = np.abs(V[:, a:b] - med) / sig
+    return z.reshape(lead + (N,))
 
 def robust_flags(values: np.ndarray, nbr_idx: np.ndarray, tau: float=3.5) -> np.ndarray:
-    med = np.array([np.median(values[nbr_idx[i]]) for i in range(len(values))])
-    mad = np.array([np.median(np.abs(values[nbr_idx[i]] - med[i])) for i in range(len(values))])
-    sig = 1.4826*mad + 1e-12
-    z = np.abs(values - med) / sig
-    return z > tau
+    return robust_zscores(values, nbr_idx) > tau
 
 def build_knn(pos: np.ndarray, k: int=12) -> np.ndarray:
-    tree = cKDTree(pos)
-    _, idx = tree.query(pos, k=min(k, len(pos)))
-    return idx
-
-def fill_channel(pos: np.ndarray, x: np.ndarray, noisy_mask: np.ndarray, smooth: float=0.2) -> np.ndarray:
-    x2 = x.copy()
-    tree = cKDTree(pos)
-    for i in np.flatnonzero(noisy_mask):
-        _, ii = tree.query(pos[i], k=min(24, len(pos)))
-        ii = np.atleast_1d(ii)
-        ii = ii[~noisy_mask[ii]] if np.any(~noisy_mask[ii]) else ii
-        rbf_r = Rbf(pos[ii,0], pos[ii,1], pos[ii,2], np.real(x[ii]), function="multiquadric", smooth=smooth)
-        rbf_i = Rbf(pos[ii,0], pos[ii,1], pos[ii,2], np.imag(x[ii]), function="multiquadric", smooth=smooth)
-        x2[i] = rbf_r(pos[i,0], pos[i,1], pos[i,2]) + 1j*rbf_i(pos[i,0], pos[i,1], pos[i,2])
-    return x2
-
-def noiseaware_fill(f_target: float, tau: float=3.5, k_nn: int=12, smooth: float=0.2, tag: str="noiseaware") -> Path:
-    S = load_slice_complex(f_target)
-    pos, Pk, Uk = S.pos, S.Pk, S.Uk
-
-    nbr_idx = build_knn(pos, k=k_nn)
-
-    f_p  = robust_flags(np.abs(Pk),            nbr_idx, tau=tau)
-    f_ux = robust_flags(np.abs(Uk[:,0]),       nbr_idx, tau=tau)
-    f_uy = robust_flags(np.abs(Uk[:,1]),       nbr_idx, tau=tau)
-    f_uz = robust_flags(np.abs(Uk[:,2]),       nbr_idx, tau=tau)
-
-    P_fill  = fill_channel(pos, Pk, noisy_mask=f_p,  smooth=smooth)
-    Ux_fill = fill_channel(pos, Uk[:,0], noisy_mask=f_ux, smooth=smooth)
-    Uy_fill = fill_channel(pos, Uk[:,1], noisy_mask=f_uy, smooth=smooth)
-    Uz_fill = fill_channel(pos, Uk[:,2], noisy_mask=f_uz, smooth=smooth)
-    U_fill  = np.vstack([Ux_fill, Uy_fill, Uz_fill]).T
-
-    out = EXPORTS / f"filled_arrays_{tag}_{int(round(S.f0))}Hz.npz"
-    flags = dict(p=f_p, ux=f_ux, uy=f_uy, uz=f_uz)
+    return query_knn(cKDTree(pos), pos, k)
+
+def rbf_fill_batch(pos: np.ndarray, X: np.ndarray, targets: np.ndarray, chans: np.ndarray, sub: np.ndarray,
+                   nbr_idx: np.ndarray, smooth: float=0.2, max_systems: int=4096) -> np.ndarray:
+    """Multiquadric RBF estimates for many (sensor, channel) entries at once.
+
+    Entry r interpolates channel `chans[r]` of `X` (C,N complex) at sensor
+    `targets[r]` from the neighbours `nbr_idx[targets[r]][sub[r]]`. Each local
+    kernel (scipy Rbf semantics: A - smooth*I) is built once per distinct
+    neighbourhood and solved for real/imag of every channel as multiple
+    right-hand sides; systems of equal size are stacked into batched solves.
+    """
+    C = X.shape[0]
+    k = nbr_idx.shape[1]
+    key = targets.astype(np.int64) * (1 << k) + (sub.astype(np.int64) << np.arange(k)).sum(axis=1)
+    _, first, inv = np.unique(key, return_index=True, return_inverse=True)
+    t_u, sub_u = targets[first], sub[first]
+    n_u = sub_u.sum(axis=1)
+    vals = np.empty((first.size, C), complex)
+    for n in np.unique(n_u):
+        grp = np.flatnonzero(n_u == n)
+        for a in range(0, grp.size, max_systems):
+            sel = grp[a:a+max_systems]
+            idx = nbr_idx[t_u[sel]][sub_u[sel]].reshape(sel.size, n)
+            Xp = pos[idx]                                          # (B,n,3)
+            eps = multiquadric_eps(Xp)[:, None, None]
+            D = np.sqrt(((Xp[:, :, None, :] - Xp[:, None, :, :])**2).sum(-1))
+            K = np.sqrt((D/eps)**2 + 1.0) - smooth*np.eye(n)
+            Xc = np.moveaxis(X[:, idx], 0, -1)                     # (B,n,C)
+            W = np.linalg.solve(K, np.concatenate([Xc.real, Xc.imag], axis=-1))
+            dt = np.sqrt(((pos[t_u[sel]][:, None, :] - Xp)**2).sum(-1))
+            kt = np.sqrt((dt/eps[:, :, 0])**2 + 1.0)               # (B,n)
+            v = np.einsum("bn,bnr->br", kt, W)
+            vals[sel] = v[:, :C] + 1j*v[:, C:]
+    return vals[inv.ravel(), chans]
+
+def fill_channels(pos: np.ndarray, X: np.ndarray, masks: np.ndarray, smooth: float=0.2,
+                  nbr_idx: np.ndarray=None) -> np.ndarray:
+    # X: (C,N) complex channels, masks: (C,N) noisy flags; only flagged entries change
+    if nbr_idx is None:
+        nbr_idx = build_knn(pos, k=K_FILL)
+    X2 = np.array(X, dtype=np.result_type(X.dtype, np.complex128))
+    chans, targets = np.nonzero(masks)
+    if targets.size == 0:
+        return X2
+    sub = ~masks[chans[:, None], nbr_idx[targets]]
+    sub[~sub.any(axis=1)] = True   # no clean neighbour: fall back to the full neighbourhood
+    X2[chans, targets] = rbf_fill_batch(pos, X2, targets, chans, sub, nbr_idx, smooth=smooth)
+    return X2
+
+def fill_channel(pos: np.ndarray, x: np.ndarray, noisy_mask: np.ndarray, smooth: float=0.2,
+                 nbr_idx: np.ndarray=None) -> np.ndarray:
+    # nbr_idx: precomputed (N, K_FILL) neighbourhoods, e.g. ScanGeometry.fill_idx
+    return fill_channels(pos, x[None], noisy_mask[None], smooth=smooth, nbr_idx=nbr_idx)[0]
+
+@dataclass
+class FillResult:
+    f0: float
+    P: np.ndarray       # (N,) complex, filled
+    U: np.ndarray       # (N,3) complex, filled
+    P_raw: np.ndarray
+    U_raw: np.ndarray
+    flags: dict         # p, ux, uy, uz -> (N,) bool
+    pos: np.ndarray
+    meta: dict
+
+def lattice_exact(lattice, geom: ScanGeometry) -> bool:
+    # the stencils hold exactly k_nn / k_fill nodes, i.e. the same neighbourhoods as kNN away from edges
+    return stencil_size(lattice, geom.k_nn) == geom.k_nn and stencil_size(lattice, geom.k_fill) == geom.k_fill
+
+def select_lattice(geom: ScanGeometry, grid: str="auto"):
+    # grid: "auto" uses lattice stencils when POSITION is a regular grid and the stencils hold exactly
+    # k_nn / k_fill nodes; "on" always uses them (stencils rounded up to whole shells); "off" never
+    lattice = geom.lattice if grid != "off" else None
+    if grid == "on" and lattice is None:
+        raise ValueError("grid='on' but POSITION does not lie on a regular lattice")
+    if lattice is None or lattice_exact(lattice, geom):
+        return lattice
+    if grid == "auto":
+        return None
+    # stencils keep whole distance shells, so flags can differ from the kNN path
+    warnings.warn(f"lattice stencils for k_nn={geom.k_nn}/k_fill={geom.k_fill} have "
+                  f"{stencil_size(lattice, geom.k_nn)}/{stencil_size(lattice, geom.k_fill)} nodes; "
+                  "use --grid auto or off for exactly k_nn neighbours", stacklevel=2)
+    return lattice
+
+def noiseaware_compute(f_target: float, tau: float=3.5, k_nn: int=12, smooth: float=0.2, tag: str="noiseaware",
+                       geom: ScanGeometry=None, reader: SliceReader=None, cache: StageCache=None,
+                       grid: str="auto") -> FillResult:
+    # reader: an open SliceReader (e.g. one per batch worker); otherwise the H5 is opened for this call
+    # grid: lattice fast path selection, see select_lattice
+    if reader is None:
+        with SliceReader() as R:
+            return noiseaware_compute(f_target, tau=tau, k_nn=k_nn, smooth=smooth, tag=tag,
+                                      geom=geom, reader=R, cache=cache, grid=grid)
+    k = int(reader.nearest_bins(f_target)[0])
+    f0 = float(reader.freq[k])
+    if geom is None or geom.k_nn != k_nn or not np.array_equal(geom.pos, reader.pos):
+        geom = get_geometry(reader.pos, k_nn=k_nn)
+    lattice = select_lattice(geom, grid)
+    mode = "grid" if lattice is not None else "knn"
+    meta = dict(f0=f0, tau=tau, k_nn=k_nn, smooth=smooth, tag=tag, mode=mode)
+    if PROFILER.enabled:
+        mark = PROFILER.mark()
+
+    # stage keys: slice -> flags -> fill; a cached fill skips the read entirely
+    if cache is not None:
+        slice_key = stage_key("slice", h5=h5_identity(reader.h5_path), group=reader.group, bin=k)
+        flags_key = stage_key("flags", slice=slice_key, tau=tau, k_nn=k_nn, mode=mode)
+        fill_key = stage_key("fill", flags=flags_key, smooth=smooth)
+        with PROFILER.stage("fill_cache", f0=f0) as st:
+            hit = cache.get(fill_key)
+            st.note(hit=hit is not None)
+        if hit is not None:
+            if PROFILER.enabled:
+                meta["timings"] = PROFILER.since(mark)
+            return FillResult(f0, hit["p"], hit["u"], hit["p_raw"], hit["u_raw"],
+                              unpack_flags(hit["flags"]), reader.pos, meta)
+
+    with PROFILER.stage("load", f0=f0, bin=k) as st:
+        P_raw, U_raw = reader.read_bins([k])
+        pos, Pk, Uk = reader.pos, P_raw[0], U_raw[0]
+        st.note(n_pos=len(pos), nbytes=P_raw.nbytes + U_raw.nbytes)
+
+    hit = cache.get(flags_key) if cache is not None else None
+    if hit is not None:
+        flags = unpack_flags(hit["flags"])
+    else:
+        with PROFILER.stage("flags", f0=f0, k_nn=k_nn, tau=tau, mode=mode) as st:
+            M = channel_magnitudes(Pk, Uk)
+            z = grid_robust_zscores(M, lattice, k_nn) if lattice is not None else robust_zscores(M, geom.knn_idx)
+            flags = dict(zip(CHANNELS, z > tau))
+            width = stencil_size(lattice, k_nn) if lattice is not None else geom.knn_idx.shape[1]
+            st.note(nbytes=len(pos)*width*4*8)     # the (4,N,width) neighbour gather
+        if cache is not None:
+            cache.put(flags_key, flags=pack_flags(flags))
+
+    flags_all = np.stack([flags[c] for c in CHANNELS])
+    with PROFILER.stage("fill", f0=f0, smooth=smooth, n_flagged=int(flags_all.sum()), mode=mode) as st:
+        X = np.vstack([Pk, Uk.T])
+        if lattice is not None:
+            X_fill = grid_fill_channels(X, flags_all, lattice, smooth=smooth, k_fill=geom.k_fill)
+        else:
+            X_fill = fill_channels(pos, X, flags_all, smooth=smooth, nbr_idx=geom.fill_idx)
+        P_fill, U_fill = X_fill[0], X_fill[1:].T
+        st.note(nbytes=X_fill.nbytes)
+    if cache is not None:
+        cache.put(fill_key, p=P_fill, u=U_fill, p_raw=Pk, u_raw=Uk, flags=pack_flags(flags))
+
+    if PROFILER.enabled:
+        meta["timings"] = PROFILER.since(mark)
+    return FillResult(f0, P_fill, U_fill, Pk, Uk, flags, pos, meta)
+
+def save_filled_npz(R: FillResult) -> Path:
+    out = EXPORTS / f"filled_arrays_{R.meta['tag']}_{int(round(R.f0))}Hz.npz"
     np.savez(
         out,
-        p=P_fill, u=U_fill,
-        p_raw=Pk, u_raw=Uk,
-        flags=flags,
-        pos=pos,
-        meta=dict(f0=S.f0, tau=tau, k_nn=k_nn, smooth=smooth, tag=tag)
+        p=R.P, u=R.U,
+        p_raw=R.P_raw, u_raw=R.U_raw,
+        flags=R.flags,
+        pos=R.pos,
+        meta=R.meta
     )
     return out
+
+def noiseaware_fill(f_target: float, tau: float=3.5, k_nn: int=12, smooth: float=0.2, tag: str="noiseaware",
+                    geom: ScanGeometry=None, reader: SliceReader=None, cache: StageCache=None,
+                    grid: str="auto") -> Path:
+    return save_filled_npz(noiseaware_compute(f_target, tau=tau, k_nn=k_nn, smooth=smooth, tag=tag,
+                                              geom=geom, reader=reader, cache=cache, grid=grid))
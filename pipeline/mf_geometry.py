@@ -0,0 +1,94 @@
+# mf_pipeline/mf_geometry.py
+import hashlib
+import numpy as np
+from pathlib import Path
+from dataclasses import dataclass, field
+from scipy.spatial import cKDTree
+from mf_pipeline.mf_config import EXPORTS
+
+K_FILL = 24  # neighbourhood size used by fill_channel
+
+def geometry_key(pos: np.ndarray, k_nn: int, k_fill: int=K_FILL) -> str:
+    h = hashlib.sha1(np.ascontiguousarray(pos, dtype=np.float64).tobytes())
+    h.update(f"{pos.shape}|{k_nn}|{k_fill}".encode())
+    return h.hexdigest()[:16]
+
+def multiquadric_eps(X: np.ndarray) -> np.ndarray:
+    # scipy Rbf default epsilon ("average distance between nodes") per system; X is (B,n,3)
+    edges = X.max(axis=1) - X.min(axis=1)
+    nz = edges > 0
+    cnt = nz.sum(axis=-1)
+    eps = np.power(np.prod(np.where(nz, edges, 1.0), axis=-1) / X.shape[1], 1.0 / np.maximum(cnt, 1))
+    return np.where(cnt > 0, eps, 1.0)
+
+def query_knn(tree: cKDTree, pos: np.ndarray, k: int) -> np.ndarray:
+    _, idx = tree.query(pos, k=min(k, len(pos)))
+    return idx.reshape(len(pos), -1)
+
+@dataclass
+class ScanGeometry:
+    """Spatial index of a scan: KD-tree, kNN matrix and fill neighbourhoods.
+
+    Positions are identical for every frequency bin, so one geometry serves
+    a whole sweep. The index matrices are persisted; the tree and the
+    lattice (structured-grid fast path) are rebuilt lazily on load.
+    """
+    pos: np.ndarray       # (N,3)
+    k_nn: int
+    k_fill: int
+    knn_idx: np.ndarray   # (N,k_nn) neighbours for robust statistics
+    fill_idx: np.ndarray  # (N,k_fill) neighbourhoods for RBF fill
+    key: str
+    _tree: cKDTree = field(default=None, repr=False)
+    _lattice: object = field(default=False, repr=False)   # False = not detected yet
+
+    @property
+    def tree(self) -> cKDTree:
+        if self._tree is None:
+            self._tree = cKDTree(self.pos)
+        return self._tree
+
+    @property
+    def lattice(self):
+        # mf_grid.Lattice if the positions sit on a regular grid, else None
+        if self._lattice is False:
+            from mf_pipeline.mf_grid import detect_lattice
+            self._lattice = detect_lattice(self.pos)
+        return self._lattice
+
+    @classmethod
+    def build(cls, pos: np.ndarray, k_nn: int=12, k_fill: int=K_FILL) -> "ScanGeometry":
+        tree = cKDTree(pos)
+        return cls(pos, k_nn, k_fill, query_knn(tree, pos, k_nn), query_knn(tree, pos, k_fill),
+                   geometry_key(pos, k_nn, k_fill), tree)
+
+    def save(self, path: Path) -> Path:
+        np.savez(path, pos=self.pos, knn_idx=self.knn_idx, fill_idx=self.fill_idx,
+                 k=np.array([self.k_nn, self.k_fill]), key=np.array(self.key))
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> "ScanGeometry":
+        with np.load(path) as Z:
+            k_nn, k_fill = (int(v) for v in Z["k"])
+            return cls(Z["pos"], k_nn, k_fill, Z["knn_idx"], Z["fill_idx"], str(Z["key"]))
+
+_GEOMETRIES = {}
+
+def get_geometry(pos: np.ndarray, k_nn: int=12, k_fill: int=K_FILL, cache_dir: Path=EXPORTS) -> ScanGeometry:
+    """Return the geometry for `pos`, from memory, from `cache_dir`, or freshly built."""
+    key = geometry_key(pos, k_nn, k_fill)
+    G = _GEOMETRIES.get(key)
+    if G is not None:
+        return G
+    path = Path(cache_dir) / f"geometry_{key}.npz" if cache_dir is not None else None
+    if path is not None and path.exists():
+        G = ScanGeometry.load(path)
+        if not np.array_equal(G.pos, pos):
+            G = None
+    if G is None:
+        G = ScanGeometry.build(pos, k_nn, k_fill)
+        if path is not None:
+            G.save(path)
+    _GEOMETRIES[key] = G
+    return G
@@ -0,0 +1,162 @@
+# mf_pipeline/mf_grid.py
+import numpy as np
+from dataclasses import dataclass, field
+from mf_pipeline.mf_geometry import multiquadric_eps
+
+@dataclass
+class Lattice:
+    """Regular (nx,ny,nz) grid that the scan positions sit on, possibly with missing nodes."""
+    origin: np.ndarray    # (3,)
+    spacing: np.ndarray   # (3,), np.inf along a singleton axis (planar or line scans)
+    shape: tuple          # (nx,ny,nz)
+    ijk: np.ndarray       # (N,3) node index of every sensor
+    index: np.ndarray     # (nx,ny,nz) sensor index, -1 where no sensor
+    _weights: dict = field(default_factory=dict, repr=False)  # stencil weight table, see stencil_weights
+    _stencils: dict = field(default_factory=dict, repr=False)  # k -> (offsets, sensor indices), see stencil
+
+    @property
+    def complete(self) -> bool:
+        return bool((self.index >= 0).all())
+
+def _axis_levels(x: np.ndarray, rtol: float):
+    xs = np.sort(x)
+    scale = max(xs[-1] - xs[0], 1e-12)
+    levels = xs[np.r_[0, np.flatnonzero(np.diff(xs) > rtol*scale) + 1]]
+    if levels.size == 1:
+        return levels[0], np.inf, np.zeros(x.size, int)
+    h = np.diff(levels).min()
+    t = (x - levels[0]) / h
+    i = np.round(t).astype(int)
+    if np.abs(t - i).max() > 0.05:
+        return None
+    return levels[0], h, i
+
+def detect_lattice(pos: np.ndarray, rtol: float=1e-3, min_fill: float=0.5):
+    """Return the Lattice under `pos`, or None if the positions are not on a regular grid."""
+    axes = [_axis_levels(pos[:, d], rtol) for d in range(3)]
+    if any(a is None for a in axes):
+        return None
+    ijk = np.stack([a[2] for a in axes], axis=1)
+    shape = tuple(int(v) for v in ijk.max(axis=0) + 1)
+    if len(pos) < min_fill * np.prod(shape):
+        return None
+    index = np.full(shape, -1, int)
+    index[tuple(ijk.T)] = np.arange(len(pos))
+    if (index >= 0).sum() != len(pos):      # two sensors on one node
+        return None
+    return Lattice(np.array([a[0] for a in axes]), np.array([a[1] for a in axes]), shape, ijk, index)
+
+def stencil_offsets(lat: Lattice, k: int) -> np.ndarray:
+    # smallest ball of whole distance shells around a node holding >= k nodes (self included);
+    # ties are kept, so e.g. k=12 and k=16 on a cubic grid both give the 19-point stencil and
+    # k=24 the 27-point one (see stencil_size). Singleton axes are left out, so the stencil of a
+    # planar scan stays in the plane whatever the coordinate units.
+    live = np.array(lat.shape) > 1
+    if not live.any():
+        return np.zeros((1, 3), int)
+    h = lat.spacing[live]
+    r = 1
+    while True:
+        g = np.arange(-r, r+1)
+        off = np.zeros(((2*r+1)**live.sum(), 3), int)
+        off[:, live] = np.stack(np.meshgrid(*[g]*live.sum(), indexing="ij"), axis=-1).reshape(-1, live.sum())
+        d = np.round(np.linalg.norm(off[:, live]*h, axis=1), 12)
+        order = np.argsort(d, kind="stable")
+        off, d = off[order], d[order]
+        dk = d[min(k, len(d)) - 1]
+        if dk <= r*h.min():   # the ball fits in the cube, so no closer node is missed
+            return off[d <= dk]
+        r += 1
+
+def stencil_size(lat: Lattice, k: int) -> int:
+    # nodes the lattice path actually uses for a requested neighbourhood size k
+    return len(stencil(lat, k)[0])
+
+def stencil_indices(lat: Lattice, off: np.ndarray) -> np.ndarray:
+    # (N,S) sensor index of each stencil node, -1 where missing or off-grid
+    J = lat.ijk[:, None, :] + off[None]
+    ok = ((J >= 0) & (J < np.array(lat.shape))).all(axis=-1)
+    nb = np.full(ok.shape, -1, int)
+    nb[ok] = lat.index[tuple(J[ok].T)]
+    return nb
+
+def stencil(lat: Lattice, k: int):
+    # (offsets (S,3), sensor indices (N,S)) for neighbourhood size k, built once per lattice
+    hit = lat._stencils.get(k)
+    if hit is None:
+        off = stencil_offsets(lat, k)
+        hit = lat._stencils[k] = (off, stencil_indices(lat, off))
+    return hit
+
+def grid_robust_zscores(values: np.ndarray, lat: Lattice, k: int=12, max_elems: int=2**24) -> np.ndarray:
+    """Robust z-scores over fixed lattice stencils; `values` is (..., N) like robust_zscores.
+
+    The number of nodes present in each sensor's stencil is fixed by the
+    geometry, so after sorting (NaN last) both medians are read at
+    precomputed positions instead of counting NaNs per row.
+    """
+    values = np.asarray(values, float)
+    _, nb = stencil(lat, k)
+    N, S = nb.shape
+    lead = values.shape[:-1]
+    Vx = np.concatenate([values, np.full(lead + (1,), np.nan)], axis=-1)   # index -1 (no node) reads NaN
+    cnt = (nb >= 0).sum(axis=1)
+    z = np.empty(values.shape)
+    step = max(1, max_elems // max(1, int(np.prod(lead))*S))
+    for a in range(0, N, step):
+        b = min(N, a + step)
+        r = np.arange(b - a)
+        lo, hi = (cnt[a:b] - 1)//2, cnt[a:b]//2
+        G = np.take(Vx, nb[a:b], axis=-1)                           # (..., n, S)
+        G.sort(axis=-1)                                             # NaN last
+        med = 0.5*(G[..., r, lo] + G[..., r, hi])
+        np.subtract(G, med[..., None], out=G)
+        np.abs(G, out=G)
+        G.sort(axis=-1)
+        mad = 0.5*(G[..., r, lo] + G[..., r, hi])
+        z[..., a:b] = np.abs(values[..., a:b] - med) / (1.4826*mad + 1e-12)
+    return z
+
+def stencil_weights(lat: Lattice, off: np.ndarray, bits: np.ndarray, smooth: float=0.2) -> np.ndarray:
+    """Multiquadric RBF weights (P,S) for availability patterns `bits` over the stencil `off`.
+
+    Weights depend only on the lattice spacing and which stencil nodes are
+    used, so each pattern is solved once and kept in the lattice's table
+    for every later frequency.
+    """
+    table = lat._weights
+    key = lambda b: (smooth, off.tobytes(), int(b))
+    new = np.array([b for b in np.unique(bits) if key(b) not in table], np.int64)
+    S = len(off)
+    if new.size:
+        use = ((new[:, None] >> np.arange(S)) & 1).astype(bool)
+        Xo = off * np.where(np.isfinite(lat.spacing), lat.spacing, 0.0)   # offsets are 0 on singleton axes
+        for n in np.unique(use.sum(axis=1)):
+            sel = np.flatnonzero(use.sum(axis=1) == n)
+            Xp = np.broadcast_to(Xo, (sel.size, S, 3))[use[sel]].reshape(sel.size, n, 3)
+            eps = multiquadric_eps(Xp)[:, None, None]
+            D = np.sqrt(((Xp[:, :, None, :] - Xp[:, None, :, :])**2).sum(-1))
+            K = np.sqrt((D/eps)**2 + 1.0) - smooth*np.eye(n)
+            kt = np.sqrt((np.linalg.norm(Xp, axis=-1)/eps[:, :, 0])**2 + 1.0)   # target at offset 0
+            w = np.linalg.solve(K, kt[..., None])[..., 0]                        # K symmetric
+            for j, s in enumerate(sel):
+                full = np.zeros(S); full[use[s]] = w[j]
+                table[key(new[s])] = full
+    return np.stack([table[key(b)] for b in bits]) if len(bits) else np.zeros((0, S))
+
+def grid_fill_channels(X: np.ndarray, masks: np.ndarray, lat: Lattice, smooth: float=0.2, k_fill: int=24) -> np.ndarray:
+    """Lattice counterpart of mf_fill.fill_channels using the stencil weight table."""
+    off, nb = stencil(lat, k_fill)
+    X2 = np.array(X, dtype=np.result_type(X.dtype, np.complex128))
+    chans, targets = np.nonzero(masks)
+    if targets.size == 0:
+        return X2
+    nbt = nb[targets]
+    present = nbt >= 0
+    use = present & ~masks[chans[:, None], np.where(present, nbt, 0)]
+    none = ~use.any(axis=1)
+    use[none] = present[none]   # no clean neighbour: fall back to the full stencil
+    bits = (use.astype(np.int64) << np.arange(len(off))).sum(axis=1)
+    w = stencil_weights(lat, off, bits, smooth=smooth)
+    X2[chans, targets] = np.einsum("rs,rs->r", w, X[chans[:, None], np.where(present, nbt, 0)])
+    return X2
@@ -1,79 +1,247 @@
 # mf_pipeline/mf_plots.py
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib import rcParams
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.colors import TwoSlopeNorm
 from mpl_toolkits.mplot3d import Axes3D  # noqa: F401
 
-def _scatter3(ax, P, c, title, highlight=None, s=18, cb_label="value"):
-    sc = ax.scatter(P[:,0], P[:,1], P[:,2], c=c, s=s)
-    ax.set_xlabel("x [m]"); ax.set_ylabel("y [m]"); ax.set_zlabel("z [m]")
-    ax.set_title(title)
-    cb = plt.colorbar(sc, ax=ax, shrink=0.8, pad=0.02)
-    cb.set_label(cb_label)
-    if highlight is not None and np.any(highlight):
-        sel = np.flatnonzero(highlight)
-        ax.scatter(P[sel,0], P[sel,1], P[sel,2], facecolors="none", edgecolors="k", s=80, linewidths=1.4)
+# Figures here never touch pyplot: each one owns an Agg canvas, is not kept in
+# a global registry, and is freed with the object (or explicitly by close()).
+# The *Template classes build their artists once and update them per frequency.
 
-def plot_cloud_before_after(P, v_raw, v_fill, mask_noisy=None, quantity_label="|U|"):
-    fig = plt.figure(figsize=(14,4.5))
-    ax1 = fig.add_subplot(131, projection="3d")
-    ax2 = fig.add_subplot(132, projection="3d")
-    ax3 = fig.add_subplot(133, projection="3d")
-
-    _scatter3(ax1, P, v_raw, f"Raw ({quantity_label})", highlight=mask_noisy, cb_label=quantity_label)
-    _scatter3(ax2, P, v_fill, f"Filled ({quantity_label})", highlight=mask_noisy, cb_label=quantity_label)
-
-    dv = v_fill - v_raw
-    norm = TwoSlopeNorm(vcenter=0.0)
-    sc = ax3.scatter(P[:,0], P[:,1], P[:,2], c=dv, s=18, norm=norm)
-    ax3.set_title("Difference (filled - raw)")
-    ax3.set_xlabel("x [m]"); ax3.set_ylabel("y [m]"); ax3.set_zlabel("z [m]")
-    cb = plt.colorbar(sc, ax=ax3, shrink=0.8, pad=0.02)
-    cb.set_label(f"Delta {quantity_label}")
-    fig.tight_layout()
+def new_figure(figsize) -> Figure:
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
     return fig
 
-def plot_hist_residuals(v_raw, v_fill, mask_noisy=None, quantity_label="|U|"):
-    dv = v_fill - v_raw
-    fig, ax = plt.subplots(figsize=(6,3.5))
-    ax.hist(dv, bins=40, alpha=0.7, label="All")
-    if mask_noisy is not None and np.any(mask_noisy):
-        ax.hist(dv[mask_noisy], bins=40, alpha=0.7, label="Noisy subset")
-    ax.set_xlabel(f"Delta {quantity_label} (filled - raw)")
-    ax.set_ylabel("Count")
-    ax.legend()
+def _relayout(fig):
+    # tight_layout from the default subplot box: equal-aspect axes would otherwise start from
+    # the previous frame's shrunk box, so a reused figure would not lay out like a fresh one
+    fig.subplots_adjust(**{k: rcParams[f"figure.subplot.{k}"]
+                           for k in ("left", "right", "bottom", "top", "wspace", "hspace")})
     fig.tight_layout()
-    return fig
+
+def _limits(*vs, pad=0.05):
+    lo = min(float(np.min(v)) for v in vs); hi = max(float(np.max(v)) for v in vs)
+    d = (hi - lo) * pad or abs(hi) * pad or 1.0
+    return lo - d, hi + d
+
+def _clim(v):
+    lo, hi = float(np.min(v)), float(np.max(v))
+    return (lo, hi) if hi > lo else (lo - 0.5, hi + 0.5)
+
+class CloudTemplate:
+    """Raw / filled / difference 3-D scatter panels for a fixed set of positions."""
+    def __init__(self, P, quantity_label="|U|"):
+        self.fig = fig = new_figure((14, 4.5))
+        N = len(P)
+        self._sc, self._hl = [], []
+        for i, title in enumerate((f"Raw ({quantity_label})", f"Filled ({quantity_label})")):
+            ax = fig.add_subplot(1, 3, i+1, projection="3d")
+            sc = ax.scatter(P[:,0], P[:,1], P[:,2], c=np.zeros(N), s=18)
+            hl = ax.scatter(P[:,0], P[:,1], P[:,2], facecolors="none", edgecolors=np.zeros((N, 4)), s=80, linewidths=1.4)
+            ax.set_xlabel("x [m]"); ax.set_ylabel("y [m]"); ax.set_zlabel("z [m]")
+            ax.set_title(title)
+            cb = fig.colorbar(sc, ax=ax, shrink=0.8, pad=0.02)
+            cb.set_label(quantity_label)
+            self._sc.append(sc); self._hl.append(hl)
+        ax3 = fig.add_subplot(133, projection="3d")
+        self._diff = ax3.scatter(P[:,0], P[:,1], P[:,2], c=np.zeros(N), s=18,
+                                 norm=TwoSlopeNorm(vcenter=0.0, vmin=-1.0, vmax=1.0))
+        ax3.set_title("Difference (filled - raw)")
+        ax3.set_xlabel("x [m]"); ax3.set_ylabel("y [m]"); ax3.set_zlabel("z [m]")
+        cb = fig.colorbar(self._diff, ax=ax3, shrink=0.8, pad=0.02)
+        cb.set_label(f"Delta {quantity_label}")
+        self._laid_out = False
+
+    def update(self, v_raw, v_fill, mask_noisy=None):
+        edge = np.zeros((len(v_raw), 4))
+        if mask_noisy is not None:
+            edge[np.asarray(mask_noisy, bool), 3] = 1.0
+        for sc, hl, v in zip(self._sc, self._hl, (v_raw, v_fill)):
+            sc.set_array(np.asarray(v)); sc.set_clim(*_clim(v))
+            hl.set_edgecolor(edge)
+        dv = v_fill - v_raw
+        a = float(np.abs(dv).max()) or 1.0
+        self._diff.set_array(dv); self._diff.set_clim(-a, a)
+        if not self._laid_out:
+            self.fig.tight_layout(); self._laid_out = True
+        return self.fig
+
+class HistTemplate:
+    def __init__(self, quantity_label="|U|", bins=40):
+        self.fig = fig = new_figure((6, 3.5))
+        self.ax = ax = fig.add_subplot()
+        self.bins = bins
+        e = np.linspace(0, 1, bins+1)
+        self._all = ax.stairs(np.zeros(bins), e, fill=True, alpha=0.7, label="All")
+        self._noisy = ax.stairs(np.zeros(bins), e, fill=True, alpha=0.7, color="C1", label="Noisy subset")
+        ax.set_xlabel(f"Delta {quantity_label} (filled - raw)")
+        ax.set_ylabel("Count")
+
+    def update(self, v_raw, v_fill, mask_noisy=None):
+        dv = v_fill - v_raw
+        h, e = np.histogram(dv, bins=self.bins)
+        self._all.set_data(h, e)
+        has = mask_noisy is not None and np.any(mask_noisy)
+        if has:
+            h, e = np.histogram(dv[mask_noisy], bins=self.bins)
+            self._noisy.set_data(h, e)
+        self._noisy.set_visible(has)
+        self.ax.relim(); self.ax.autoscale_view()
+        self.ax.legend(handles=[self._all, self._noisy] if has else [self._all])
+        _relayout(self.fig)
+        return self.fig
+
+class DeltaTemplate:
+    def __init__(self, quantity_label="|U|"):
+        self.fig = fig = new_figure((12, 3.6))
+        self.ax1, self.ax2 = ax1, ax2 = fig.subplots(1, 2)
+        self._line, = ax1.plot([], [], linewidth=1.0)
+        self._noisy = ax1.scatter([], [], s=12, color="C3", label="Noisy")
+        ax1.set_title("Per-point Delta")
+        ax1.set_xlabel("Sensor index")
+        ax1.set_ylabel(f"Delta {quantity_label}")
+        self._sorted, = ax2.plot([], [], linewidth=1.0)
+        ax2.set_title("Sorted |Delta|")
+        ax2.set_xlabel("Rank")
+        ax2.set_ylabel(f"|Delta {quantity_label}|")
+
+    def update(self, dv, mask_noisy=None):
+        idx = np.arange(dv.size)
+        self._line.set_data(idx, dv)
+        has = mask_noisy is not None and np.any(mask_noisy)
+        self._noisy.set_offsets(np.c_[idx[mask_noisy], dv[mask_noisy]] if has else np.empty((0, 2)))
+        legend = self.ax1.get_legend()
+        if has and legend is None:
+            self.ax1.legend()
+        elif not has and legend is not None:
+            legend.remove()
+        self._sorted.set_data(idx, np.sort(np.abs(dv)))
+        for ax in (self.ax1, self.ax2):
+            ax.relim(); ax.autoscale_view()
+        _relayout(self.fig)
+        return self.fig
+
+class RawFilledTemplate:
+    def __init__(self, quantity_label="|U|"):
+        self.fig = fig = new_figure((4.8, 4.6))
+        self.ax = ax = fig.add_subplot()
+        self._sc = ax.scatter([], [], s=8, alpha=0.8)
+        self._diag, = ax.plot([], [], linestyle="--", linewidth=1.0)
+        ax.set_xlabel(f"Raw {quantity_label}")
+        ax.set_ylabel(f"Filled {quantity_label}")
+        ax.set_title("Raw vs Filled")
+        ax.set_aspect("equal", adjustable="box")
+
+    def update(self, v_raw, v_fill):
+        self._sc.set_offsets(np.c_[v_raw, v_fill])
+        lims = [min(v_raw.min(), v_fill.min()), max(v_raw.max(), v_fill.max())]
+        self._diag.set_data(lims, lims)
+        lo, hi = _limits(v_raw, v_fill)
+        self.ax.set_xlim(lo, hi); self.ax.set_ylim(lo, hi)
+        _relayout(self.fig)
+        return self.fig
+
+class CloudFigures:
+    """The four per-frequency cloud figures of one scan, reused across frequencies.
+
+    Built for fixed positions and quantity; `render` updates the artists in place
+    and writes the PNGs. `with_3d=False` skips the (slow) 3-D scatter panels.
+    """
+    def __init__(self, pos, quantity_label="|U|", with_3d=True):
+        self.pos, self.quantity_label, self.with_3d = pos, quantity_label, with_3d
+        self.cloud = CloudTemplate(pos, quantity_label) if with_3d else None
+        self.hist = HistTemplate(quantity_label)
+        self.delta = DeltaTemplate(quantity_label)
+        self.raw_filled = RawFilledTemplate(quantity_label)
+
+    def matches(self, pos, quantity_label, with_3d) -> bool:
+        return (self.quantity_label == quantity_label and self.with_3d == with_3d
+                and self.pos.shape == pos.shape and np.array_equal(self.pos, pos))
+
+    def render(self, base, v_raw, v_fill, mask_noisy=None, dpi=200) -> list:
+        saved = []
+        if self.cloud is not None:
+            saved.append(_save(self.cloud.update(v_raw, v_fill, mask_noisy), base, "_cloud_before_after.png", dpi))
+        saved.append(_save(self.hist.update(v_raw, v_fill, mask_noisy), base, "_residual_hist.png", dpi))
+        saved.append(_save(self.delta.update(v_fill - v_raw, mask_noisy), base, "_delta_series.png", dpi))
+        saved.append(_save(self.raw_filled.update(v_raw, v_fill), base, "_raw_vs_filled.png", dpi))
+        return saved
+
+    def close(self):
+        for T in (self.cloud, self.hist, self.delta, self.raw_filled):
+            if T is not None:
+                T.fig.clear()
+        self.cloud = self.hist = self.delta = self.raw_filled = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class DirectivityFigures:
+    """Map, horizontal polar and vertical cut figures, reused across metrics and frequencies."""
+    def __init__(self):
+        self.map_fig = fig = new_figure((7.0, 3.2))
+        self._map_ax = ax = fig.add_subplot()
+        self._im = ax.imshow(np.zeros((2, 2)), origin="lower", aspect="auto")
+        ax.set_xlabel("Azimuth [deg]"); ax.set_ylabel("Elevation [deg]")
+        self._cb = fig.colorbar(self._im, ax=ax)
+
+        self.h_fig = fig = new_figure((4.8, 4.8))
+        self._h_ax = ax = fig.add_subplot(projection="polar")
+        self._h_line, = ax.plot([], [])
+
+        self.v_fig = fig = new_figure((5.8, 4.4))
+        self._v_ax = ax = fig.add_subplot()
+        self._v_line, = ax.plot([], [])
+        ax.set_xlabel("Elevation [deg]")
+
+    def render(self, base, f0, metric, lon, lat, Vmap, phi_deg, y_h, elev_deg, y_v, db=False, dpi=180) -> list:
+        # values already in plotting units (dB or linear); see mf_export._write_metric_outputs
+        at = f"{f0:.1f} Hz"
+        self._im.set_data(Vmap); self._im.set_extent([lon.min(), lon.max(), lat.min(), lat.max()])
+        self._im.set_clim(*_clim(Vmap))
+        self._map_ax.set_title(f"Directivity @ {at} ({metric})" + (" [dB]" if db else ""))
+        self._cb.set_label("dB (norm)" if db else "value")
+        _relayout(self.map_fig)
+
+        self._h_line.set_data(np.deg2rad(phi_deg), y_h)
+        self._h_ax.relim(); self._h_ax.autoscale_view()
+        self._h_ax.set_title(f"Horizontal polar @ {at}" + (" [dB]" if db else ""))
+        _relayout(self.h_fig)
+
+        self._v_line.set_data(elev_deg, y_v)
+        self._v_ax.relim(); self._v_ax.autoscale_view()
+        self._v_ax.set_ylabel("dB (norm)" if db else "|value|")
+        self._v_ax.set_title(f"Vertical cut (az=0°) @ {at}")
+        _relayout(self.v_fig)
+        return [_save(self.map_fig, base, "_directivity.png", dpi, bbox_inches=None),
+                _save(self.h_fig, base, "_polar_horizontal_0deg.png", dpi, bbox_inches=None),
+                _save(self.v_fig, base, "_polar_vertical_az0deg.png", dpi, bbox_inches=None)]
+
+    def close(self):
+        for fig in (self.map_fig, self.h_fig, self.v_fig):
+            fig.clear()
+
+def _save(fig, base, suffix, dpi, bbox_inches="tight"):
+    # same savefig arguments as before the templates: fill plots tight, directivity plots full canvas
+    out = base.with_name(base.name + suffix)
+    fig.savefig(out, dpi=dpi, bbox_inches=bbox_inches)
+    return out
+
+# one-shot helpers (kept for scripts that want a single Figure)
+def plot_cloud_before_after(P, v_raw, v_fill, mask_noisy=None, quantity_label="|U|"):
+    return CloudTemplate(P, quantity_label).update(v_raw, v_fill, mask_noisy)
+
+def plot_hist_residuals(v_raw, v_fill, mask_noisy=None, quantity_label="|U|"):
+    return HistTemplate(quantity_label).update(v_raw, v_fill, mask_noisy)
 
 def plot_delta_series(dv, mask_noisy=None, quantity_label="|U|"):
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12,3.6))
-    n = dv.size
-    idx = np.arange(n)
-    ax1.plot(idx, dv, linewidth=1.0)
-    ax1.set_title("Per-point Delta")
-    ax1.set_xlabel("Sensor index")
-    ax1.set_ylabel(f"Delta {quantity_label}")
-    if mask_noisy is not None and np.any(mask_noisy):
-        ax1.scatter(idx[mask_noisy], dv[mask_noisy], s=12, color="C3", label="Noisy")
-        ax1.legend()
-
-    mag = np.abs(dv)
-    order = np.argsort(mag)
-    ax2.plot(np.arange(n), mag[order], linewidth=1.0)
-    ax2.set_title("Sorted |Delta|")
-    ax2.set_xlabel("Rank")
-    ax2.set_ylabel(f"|Delta {quantity_label}|")
-    fig.tight_layout()
-    return fig
+    return DeltaTemplate(quantity_label).update(dv, mask_noisy)
 
 def plot_raw_vs_filled(v_raw, v_fill, quantity_label="|U|"):
-    fig, ax = plt.subplots(figsize=(4.8,4.6))
-    ax.scatter(v_raw, v_fill, s=8, alpha=0.8)
-    lims = [min(v_raw.min(), v_fill.min()), max(v_raw.max(), v_fill.max())]
-    ax.plot(lims, lims, linestyle="--", linewidth=1.0)
-    ax.set_xlabel(f"Raw {quantity_label}")
-    ax.set_ylabel(f"Filled {quantity_label}")
-    ax.set_title("Raw vs Filled")
-    ax.set_aspect("equal", adjustable="box")
-    fig.tight_layout()
-    return fig
+    return RawFilledTemplate(quantity_label).update(v_raw, v_fill)
@@ -0,0 +1,179 @@
+# mf_pipeline/mf_profile.py
+import cProfile, csv, json, os, sys, time
+from pathlib import Path
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return float("nan")
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10  # bytes on macOS, KiB on Linux
+
+# Linux only: VmHWM is the RSS high-water mark and writing "5" to clear_refs
+# resets it to the current RSS, which gives a true peak per stage.
+_STATUS, _CLEAR_REFS = "/proc/self/status", "/proc/self/clear_refs"
+
+def _hwm_mb() -> float:
+    with open(_STATUS) as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 2**10
+    raise OSError("no VmHWM")
+
+def _reset_hwm():
+    with open(_CLEAR_REFS, "w") as f:
+        f.write("5")
+
+def _hwm_supported() -> bool:
+    try:
+        _hwm_mb(); _reset_hwm()
+        return True
+    except OSError:
+        return False
+
+class _NullStage:
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def note(self, **info):
+        pass
+
+_NULL = _NullStage()
+
+class _Stage:
+    def __init__(self, prof, name, info):
+        self.prof, self.rec = prof, dict(stage=name, **info)
+
+    def note(self, **info):
+        # extra fields known only after the work, e.g. output array sizes
+        self.rec.update(info)
+
+    def __enter__(self):
+        p = self.prof
+        self._cp = None
+        if p.cprofile_dir is not None and p._depth == 0:
+            self._cp = p._cprofiles.setdefault(self.rec["stage"], cProfile.Profile())
+            self._cp.enable()
+        p._depth += 1
+        if p._hwm:
+            p._hwm_fold(); _reset_hwm()
+            self._peak = 0.0
+            p._open.append(self)
+        self._w, self._c = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        p = self.prof
+        self.rec["wall_s"] = time.perf_counter() - self._w
+        self.rec["cpu_s"] = time.process_time() - self._c
+        p._depth -= 1
+        if self._cp is not None:
+            self._cp.disable()
+        if p._hwm:
+            p._hwm_fold(); p._open.remove(self)
+            self.rec["peak_rss_mb"] = self._peak
+        # the HWM reset also clears ru_maxrss, so keep the process peak here
+        p._proc_peak = max(p._proc_peak, self.rec.get("peak_rss_mb", 0.0), peak_rss_mb())
+        self.rec["process_peak_rss_mb"] = p._proc_peak
+        if exc_type is not None:
+            self.rec["error"] = exc_type.__name__
+        p.records.append(self.rec)
+        return False
+
+class Profiler:
+    """Per-stage wall/CPU time, peak RSS and array sizes; a no-op unless enabled.
+
+    Stages are opened with `with PROFILER.stage("fill", f0=..., n=...) as st:`
+    and may add fields via `st.note(...)`. With a cProfile directory, each
+    top-level stage also accumulates into its own cProfile dump.
+
+    `peak_rss_mb` is the RSS high-water mark reached inside the stage (Linux
+    only, via VmHWM resets; nested stages fold into their parents).
+    `process_peak_rss_mb` is the process peak so far (`ru_maxrss`, carried
+    across those resets).
+    """
+    def __init__(self):
+        self.enabled = False
+        self.cprofile_dir = None
+        self.records = []
+        self._cprofiles = {}
+        self._depth = 0
+        self._hwm = False
+        self._open = []
+        self._proc_peak = 0.0
+
+    def enable(self, cprofile_dir=None):
+        self.enabled = True
+        self._proc_peak = max(self._proc_peak, peak_rss_mb())
+        self._hwm = _hwm_supported()
+        self.cprofile_dir = Path(cprofile_dir) if cprofile_dir is not None else None
+
+    def disable(self):
+        self.enabled = False; self.cprofile_dir = None
+
+    def _hwm_fold(self):
+        # the HWM since the last reset belongs to every stage still open
+        hwm = _hwm_mb()
+        self._proc_peak = max(self._proc_peak, hwm)
+        for st in self._open:
+            st._peak = max(st._peak, hwm)
+
+    def stage(self, name: str, **info):
+        return _Stage(self, name, info) if self.enabled else _NULL
+
+    def mark(self) -> int:
+        return len(self.records)
+
+    def since(self, mark: int) -> list:
+        return self.records[mark:]
+
+    def dump_cprofiles(self, tag: str="") -> list:
+        out = []
+        if self.cprofile_dir is None:
+            return out
+        self.cprofile_dir.mkdir(parents=True, exist_ok=True)
+        for name, cp in self._cprofiles.items():
+            path = self.cprofile_dir / f"{name}{tag}.prof"
+            cp.dump_stats(path); out.append(path)
+        return out
+
+PROFILER = Profiler()
+
+def stage(name: str, **info):
+    return PROFILER.stage(name, **info)
+
+def write_report(records: list, base: Path) -> tuple:
+    base = Path(base)
+    out_json = base.with_name(base.name + ".json")
+    out_csv = base.with_name(base.name + ".csv")
+    out_json.write_text(json.dumps(records, indent=1, default=str))
+    cols = []
+    for r in records:
+        cols += [k for k in r if k not in cols]
+    with open(out_csv, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=cols)
+        w.writeheader(); w.writerows(records)
+    return out_json, out_csv
+
+# --- CLI helpers shared by the run_* scripts ---
+def add_profile_args(ap):
+    ap.add_argument("--report", action="store_true", help="Record per-stage timing/memory and write a run report")
+    ap.add_argument("--profile", action="store_true", help="As --report, plus cProfile dumps of the hot stages")
+
+def start_profiling(args, exports: Path, script: str):
+    if not (args.report or args.profile):
+        return None
+    base = Path(exports) / f"run_report_{script}_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}"
+    PROFILER.enable(cprofile_dir=base.with_name(base.name + "_cprofile") if args.profile else None)
+    return base
+
+def finish_profiling(base, extra_records=()):
+    if base is None:
+        return []
+    saved = list(write_report(PROFILER.records + list(extra_records), base))
+    saved += PROFILER.dump_cprofiles()
+    return saved
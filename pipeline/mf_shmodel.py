@@ -0,0 +1,111 @@
+# mf_pipeline/mf_shmodel.py
+import numpy as np
+from pathlib import Path
+from dataclasses import dataclass
+from mf_pipeline.mf_directivity import design_SH
+from mf_pipeline.mf_store import ResultsStore
+from mf_pipeline.mf_profile import PROFILER
+
+@dataclass
+class SHModel:
+    """Fitted SH directivity of one metric over frequency, queried on the fly.
+
+    Built from a results store (sh/<metric>) or from the `*_sh_coeffs.npz`
+    files written by run_directivity.py. Values at arbitrary directions and
+    frequencies are synthesized from the coefficients; between bins the
+    coefficients are interpolated linearly, outside the fitted range the
+    nearest bin is used. `lam` is the regularization of each bin: constant
+    for a fixed-lam fit, chosen per bin when lmax/lam were selected
+    automatically.
+    """
+    freq: np.ndarray     # (F,) ascending
+    coeffs: np.ndarray   # (F,K)
+    lmax: int
+    lam: np.ndarray      # (F,)
+    center: np.ndarray   # (3,) acoustic centre the directions are taken from
+    metric: str = "u_mag"
+
+    @classmethod
+    def from_store(cls, path, metric: str="u_mag") -> "SHModel":
+        with ResultsStore(path) as S:
+            hit = S.read_sh(metric)
+            if hit is None:
+                raise KeyError(f"{path}: no SH coefficients for metric {metric!r}")
+            C, info = hit
+            ok = ~np.isnan(C).any(axis=1)
+            lam = info["select"]["lam"][ok] if "select" in info else np.full(int(ok.sum()), info["lam"])
+            return cls(S.freq[ok].astype(float), C[ok], info["lmax"], lam, info["center"], metric)
+
+    @classmethod
+    def from_npz(cls, paths, metric: str="u_mag") -> "SHModel":
+        f0, C, lams, ref = [], [], [], None
+        for p in paths:
+            Z = np.load(p)
+            metrics = [str(m) for m in Z["metrics"]]
+            if metric not in metrics:
+                raise KeyError(f"{p}: no SH coefficients for metric {metric!r}")
+            # lam is per metric when lmax/lam were chosen automatically (coeffs then zero-padded to lmax)
+            lmax, center, auto = int(Z["lmax"]), Z["center"], "select_lam" in Z.files
+            lam = float(np.broadcast_to(Z["lam"], len(metrics))[metrics.index(metric)])
+            if ref is None:
+                ref = (lmax, lam, center, auto)
+            elif lmax != ref[0] or not np.allclose(center, ref[2]):
+                raise ValueError(f"{p}: lmax/center differ from the other coefficient files")
+            elif auto != ref[3] or (not auto and not np.isclose(lam, ref[1])):
+                # a fixed lam must be the same in every file; selected lams may differ per bin
+                raise ValueError(f"{p}: lam={lam:g} ({'selected' if auto else 'fixed'}) does not match "
+                                 f"the other coefficient files (lam={ref[1]:g}, {'selected' if ref[3] else 'fixed'})")
+            f0.append(float(Z["f0"])); C.append(Z["coeffs"][metrics.index(metric)]); lams.append(lam)
+        if ref is None:
+            raise ValueError("no coefficient files given")
+        order = np.argsort(f0)
+        return cls(np.asarray(f0)[order], np.stack(C)[order], ref[0], np.asarray(lams)[order], ref[2], metric)
+
+    @classmethod
+    def load(cls, source, metric: str="u_mag") -> "SHModel":
+        # a results store (.h5/.hdf5) or one or more *_sh_coeffs.npz files
+        if isinstance(source, (str, Path)):
+            if Path(source).suffix in (".h5", ".hdf5"):
+                return cls.from_store(source, metric)
+            source = [source]
+        return cls.from_npz(source, metric)
+
+    def weights(self, freqs) -> np.ndarray:
+        # (n_freq, F) linear interpolation matrix between bins, clamped at the ends
+        f = np.atleast_1d(np.asarray(freqs, float))
+        F = self.freq.size
+        W = np.zeros((f.size, F))
+        if F == 1:
+            W[:, 0] = 1.0
+            return W
+        j = np.clip(np.searchsorted(self.freq, f), 1, F-1)
+        t = np.clip((f - self.freq[j-1]) / (self.freq[j] - self.freq[j-1]), 0.0, 1.0)
+        r = np.arange(f.size)
+        W[r, j-1] = 1.0 - t
+        W[r, j] += t
+        return W
+
+    def query(self, directions, freqs, chunk: int=65536) -> np.ndarray:
+        """Metric values at M directions for each requested frequency.
+
+        `directions` is (M,3) vectors from the acoustic centre (need not be
+        unit length) or a (theta, phi) tuple in radians. The basis is built
+        `chunk` directions at a time, so memory stays O(chunk*K) however many
+        directions are asked for. Returns (n_freq, M), or (M,) for a scalar
+        frequency.
+        """
+        if isinstance(directions, tuple):
+            theta, phi = (np.asarray(a, float).ravel() for a in directions)
+        else:
+            d = np.asarray(directions, float).reshape(-1, 3)
+            r = np.linalg.norm(d, axis=1) + 1e-12
+            theta, phi = np.arccos(np.clip(d[:, 2]/r, -1, 1)), np.arctan2(d[:, 1], d[:, 0])
+        Cq = self.weights(freqs) @ self.coeffs              # (n_freq,K)
+        M = theta.size
+        out = np.empty((Cq.shape[0], M))
+        B = np.empty((min(chunk, M), Cq.shape[1]))
+        with PROFILER.stage("sh_query", metric=self.metric, lmax=self.lmax, n_dir=M, n_freq=Cq.shape[0]):
+            for a in range(0, M, chunk):
+                b = min(M, a + chunk)
+                out[:, a:b] = Cq @ design_SH(theta[a:b], phi[a:b], self.lmax, out=B[:b-a]).T
+        return out[0] if np.ndim(freqs) == 0 else out
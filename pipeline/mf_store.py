@@ -0,0 +1,147 @@
+# mf_pipeline/mf_store.py
+import h5py
+import numpy as np
+from pathlib import Path
+
+# bit per channel in the (F,N) uint8 flag mask
+FLAG_BITS = dict(p=1, ux=2, uy=4, uz=8)
+
+# (bins, sensors) per chunk of the (F,N) datasets. "bins" suits per-bin writes and reads
+# (one row of chunks per bin), but "all frequencies at sensor i" then touches F/16 chunks of
+# 4096 sensors each. "sensors" makes that read a few small chunks (F/64 chunks of 16 sensors)
+# at the price of bin writes touching N/16 chunks, which the chunk cache below absorbs.
+LAYOUTS = {"bins": (16, 4096), "sensors": (64, 16)}
+CHUNK_CACHE_MB = 64          # per dataset; holds a full row of "sensors" chunks of u for N up to ~20000
+
+def pack_flags(flags: dict) -> np.ndarray:
+    bits = None
+    for name, b in FLAG_BITS.items():
+        v = np.asarray(flags[name], bool).astype(np.uint8) * np.uint8(b)
+        bits = v if bits is None else bits | v
+    return bits
+
+def unpack_flags(bits: np.ndarray) -> dict:
+    return {name: (bits & b) != 0 for name, b in FLAG_BITS.items()}
+
+class ResultsStore:
+    """Columnar results of a band sweep in one chunked HDF5 file.
+
+    Layout: freq (F,), pos (N,3) stored once, p/p_raw (F,N) and u/u_raw
+    (F,N,3) complex, flags (F,N) uint8 bitmask, done (F,) bool and
+    sh/<metric> (F,K) coefficients (plus sh/<metric>_select/<field> (F,)
+    per-bin lmax/lam selection when fitted with --auto). Sweep parameters live in the file
+    attributes. Everything is read lazily by bin, channel or sensor; the
+    chunk `layout` (see LAYOUTS) decides which of those reads is cheapest.
+    """
+    def __init__(self, path, mode: str="r"):
+        self.path = Path(path)
+        self._f = h5py.File(self.path, mode, rdcc_nbytes=CHUNK_CACHE_MB*2**20, rdcc_nslots=100003)
+        self.freq = self._f["freq"][()]
+
+    @classmethod
+    def create(cls, path, pos: np.ndarray, freqs, params: dict=None, layout: str="bins") -> "ResultsStore":
+        if layout not in LAYOUTS:
+            raise ValueError(f"layout must be one of: {', '.join(LAYOUTS)}")
+        freqs = np.asarray(freqs, float); F, N = freqs.size, len(pos)
+        cb, cn = min(F, LAYOUTS[layout][0]), min(N, LAYOUTS[layout][1])
+        with h5py.File(path, "w") as f:
+            f.attrs["layout"] = layout
+            f["freq"] = freqs
+            f["pos"] = np.asarray(pos, float)
+            for name in ("p", "p_raw"):
+                f.create_dataset(name, (F, N), np.complex128, chunks=(cb, cn))
+            for name in ("u", "u_raw"):
+                f.create_dataset(name, (F, N, 3), np.complex128, chunks=(cb, cn, 3))
+            f.create_dataset("flags", (F, N), np.uint8, chunks=(cb, cn))
+            f.create_dataset("done", (F,), bool, fillvalue=False)
+            f.create_group("sh")
+            for k, v in (params or {}).items():
+                f.attrs[k] = v
+        return cls(path, "r+")
+
+    @property
+    def params(self) -> dict:
+        return dict(self._f.attrs)
+
+    @property
+    def pos(self) -> np.ndarray:
+        return self._f["pos"][()]
+
+    @property
+    def done(self) -> np.ndarray:
+        return self._f["done"][()]
+
+    def bin_index(self, f0: float) -> int:
+        return int(np.argmin(np.abs(self.freq - f0)))
+
+    def write_bin(self, k, P, U, P_raw, U_raw, flags: dict, done: bool=True):
+        # k: one bin, or a slice / increasing index array with arrays stacked along the first axis
+        f = self._f
+        f["p"][k], f["u"][k] = P, U
+        f["p_raw"][k], f["u_raw"][k] = P_raw, U_raw
+        f["flags"][k] = pack_flags(flags)
+        if done:
+            self.mark_done(k)
+
+    def mark_done(self, k):
+        # flush the data first so a bin is never marked done before it is on disk
+        self._f.flush()
+        self._f["done"][k] = True
+        self._f.flush()
+
+    def write_fill(self, R, done: bool=True):
+        # R: mf_fill.FillResult
+        self.write_bin(self.bin_index(R.f0), R.P, R.U, R.P_raw, R.U_raw, R.flags, done=done)
+
+    def write_sh(self, metric: str, k, coeffs: np.ndarray, lmax: int, lam: float, center, select: dict=None):
+        # coeffs (K,) for one bin, or (B,K) for an index array / slice k
+        # select: automatic selection of these bins, field -> value(s) (see mf_directivity.SELECT_FIELDS)
+        g = self._f["sh"]
+        K = np.shape(coeffs)[-1]
+        if metric not in g:
+            d = g.create_dataset(metric, (self.freq.size, K), float, fillvalue=np.nan,
+                                 chunks=(min(self.freq.size, 64), K))
+            d.attrs["lmax"], d.attrs["lam"], d.attrs["center"] = lmax, lam, np.asarray(center, float)
+        if select is not None:
+            s = g.require_group(f"{metric}_select")
+            for name, v in select.items():
+                if name not in s:
+                    s.create_dataset(name, (self.freq.size,), float, fillvalue=np.nan)
+                s[name][k] = v
+        g[metric][k] = coeffs
+
+    def read_sh(self, metric: str, bins=slice(None)):
+        # (coeffs (F,K), dict(lmax, lam, center[, select])) or None if this metric was never fitted;
+        # select (field -> (F,)) is there when lmax/lam were chosen per bin
+        g = self._f["sh"]
+        if metric not in g:
+            return None
+        d = g[metric]
+        info = dict(lmax=int(d.attrs["lmax"]), lam=float(d.attrs["lam"]), center=d.attrs["center"][()])
+        if f"{metric}_select" in g:
+            info["select"] = {name: v[bins] for name, v in g[f"{metric}_select"].items()}
+        return d[bins], info
+
+    def read(self, name: str, bins=slice(None), sensors=slice(None)) -> np.ndarray:
+        # lazy hyperslab read, e.g. read("p", sensors=i) = all frequencies at sensor i
+        return self._f[name][bins, sensors]
+
+    def read_bin(self, k: int) -> dict:
+        f = self._f
+        meta = self.params; meta["f0"] = float(self.freq[k])
+        return dict(pos=self.pos, p=f["p"][k], u=f["u"][k], p_raw=f["p_raw"][k], u_raw=f["u_raw"][k],
+                    flags=unpack_flags(f["flags"][k]), meta=meta)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close(); self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load_filled_bin(store_path: Path, f0: float) -> dict:
+    with ResultsStore(store_path) as S:
+        return S.read_bin(S.bin_index(f0))
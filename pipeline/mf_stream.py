@@ -0,0 +1,136 @@
+# mf_pipeline/mf_stream.py
+import time
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from mf_pipeline.mf_config import H5_PATH, H5_GROUP
+from mf_pipeline.mf_fill import (CHANNELS, SliceReader, channel_magnitudes, robust_zscores, fill_channels,
+                                 select_lattice)
+from mf_pipeline.mf_geometry import get_geometry
+from mf_pipeline.mf_grid import grid_robust_zscores, grid_fill_channels
+from mf_pipeline.mf_directivity import fit_SH_band
+from mf_pipeline.mf_store import ResultsStore
+from mf_pipeline.mf_profile import PROFILER
+
+# parameters that must match for a store to be resumed
+RESUME_KEYS = ("tau", "k_nn", "smooth", "grid", "h5_path", "group", "metrics", "lmax", "lam")
+
+def bin_bytes(n_pos: int, k_nn: int=12) -> int:
+    # working set of one bin in flight: raw + filled P/U (4 complex channels each), magnitudes,
+    # z-scores and flags, plus the neighbour gathers of the detection step
+    return n_pos * len(CHANNELS) * (16 + 16 + 8 + 8 + 1 + 8*k_nn)
+
+def chunk_bins_for(mem_mb: float, n_pos: int, k_nn: int=12) -> int:
+    # two chunks are alive at once (the one being computed and the one being prefetched)
+    return max(1, int(mem_mb * 2**20 // (2*bin_bytes(n_pos, k_nn))))
+
+def _chunks(bins: np.ndarray, size: int):
+    # consecutive pieces of at most `size` bins, also split at gaps so writes stay contiguous
+    cut = np.flatnonzero(np.diff(bins) != 1) + 1
+    for run in np.split(bins, cut):
+        for a in range(0, run.size, size):
+            yield run[a:a+size]
+
+def read_chunks(reader: SliceReader, chunks):
+    """Yield (bins, P, U) per chunk while the next chunk is read in a background thread."""
+    chunks = iter(chunks)
+    with ThreadPoolExecutor(1) as io:
+        nxt = next(chunks, None)
+        fut = io.submit(reader.read_bins, nxt) if nxt is not None else None
+        while fut is not None:
+            bins = nxt
+            with PROFILER.stage("stream_read_wait", n_bins=bins.size):
+                P, U = fut.result()
+            nxt = next(chunks, None)
+            fut = io.submit(reader.read_bins, nxt) if nxt is not None else None
+            yield bins, P, U
+
+def detect_chunks(items, geom, lattice, tau: float):
+    for bins, P, U in items:
+        with PROFILER.stage("stream_detect", n_bins=bins.size):
+            M = channel_magnitudes(P, U)                                    # (B,4,N)
+            z = grid_robust_zscores(M, lattice, geom.k_nn) if lattice is not None else robust_zscores(M, geom.knn_idx)
+        yield bins, P, U, z > tau
+
+def fill_chunks(items, geom, lattice, smooth: float):
+    # every (bin, channel) row is an independent channel for the batched fill
+    for bins, P, U, flags in items:
+        with PROFILER.stage("stream_fill", n_bins=bins.size, n_flagged=int(flags.sum())):
+            B, C, N = flags.shape
+            X = np.concatenate([P[:, None, :], np.moveaxis(U, -1, -2)], axis=1).reshape(B*C, N)
+            if lattice is not None:
+                Xf = grid_fill_channels(X, flags.reshape(B*C, N), lattice, smooth=smooth, k_fill=geom.k_fill)
+            else:
+                Xf = fill_channels(geom.pos, X, flags.reshape(B*C, N), smooth=smooth, nbr_idx=geom.fill_idx)
+            Xf = Xf.reshape(B, C, N)
+        yield bins, P, U, Xf[:, 0], np.moveaxis(Xf[:, 1:], 1, 2), flags
+
+def fit_chunks(items, pos, metrics, lmax: int, lam: float):
+    for bins, P, U, P_fill, U_fill, flags in items:
+        coeffs = info = None
+        if metrics:
+            coeffs, info = fit_SH_band(pos, P_fill, U_fill, metrics=metrics, lmax=lmax, lam=lam)   # (B,M,K)
+        yield bins, P, U, P_fill, U_fill, flags, coeffs, info
+
+def open_stream_store(path, pos, freqs, params: dict, restart: bool=False, layout: str="bins") -> ResultsStore:
+    """Create the output store, or reopen it for resuming when it matches this run."""
+    path = Path(path)
+    if restart or not path.exists():
+        return ResultsStore.create(path, pos, freqs, params, layout=layout)
+    S = ResultsStore(path, "r+")
+    old = S.params
+    same = (S.freq.size == len(freqs) and np.allclose(S.freq, freqs) and np.array_equal(S.pos, pos)
+            and all(str(old.get(k)) == str(params.get(k)) for k in RESUME_KEYS))
+    if not same:
+        S.close()
+        raise ValueError(f"{path} was written with other frequencies, positions or fill parameters; "
+                         "use another --store or --restart")
+    return S
+
+def stream_band(store, f_lo: float=None, f_hi: float=None, tau: float=3.5, k_nn: int=12, smooth: float=0.2,
+                grid: str="auto", metrics=("u_mag",), lmax: int=8, lam: float=1e-3, mem_mb: float=1024,
+                restart: bool=False, layout: str="bins", h5_path=H5_PATH, group=H5_GROUP, log=print) -> Path:
+    """Fill (and SH-fit) every bin in [f_lo, f_hi] into a results store with bounded memory.
+
+    Bins are processed in chunks sized from `mem_mb` through read -> detect ->
+    fill -> fit -> write generators; the next chunk is read while the current
+    one is computed. Each chunk is marked done only after it is written, so a
+    rerun skips finished bins and resumes where the last one stopped.
+    """
+    metrics = list(metrics or ())
+    with SliceReader(h5_path, group) as R:
+        sel = np.ones(R.freq.size, bool)
+        if f_lo is not None:
+            sel &= R.freq >= f_lo
+        if f_hi is not None:
+            sel &= R.freq <= f_hi
+        bins = np.flatnonzero(sel)
+        if bins.size == 0:
+            raise ValueError(f"no frequency bins in [{f_lo}, {f_hi}] Hz")
+        pos = R.pos
+        geom = get_geometry(pos, k_nn=k_nn)
+        lattice = select_lattice(geom, grid)
+        params = dict(tau=tau, k_nn=k_nn, smooth=smooth, grid=grid, mode="grid" if lattice is not None else "knn",
+                      h5_path=str(h5_path), group=group, metrics=",".join(metrics), lmax=lmax, lam=lam)
+
+        with open_stream_store(store, pos, R.freq[bins].astype(float), params, restart=restart, layout=layout) as S:
+            todo = np.flatnonzero(~S.done)          # store-local bin indices
+            if todo.size < bins.size:
+                log(f"resuming: {bins.size - todo.size}/{bins.size} bins already done")
+            size = chunk_bins_for(mem_mb, len(pos), k_nn)
+            items = read_chunks(R, (bins[c] for c in _chunks(todo, size)))
+            items = fit_chunks(fill_chunks(detect_chunks(items, geom, lattice, tau), geom, lattice, smooth),
+                               pos, metrics, lmax, lam)
+            n, t0 = bins.size - todo.size, time.perf_counter()
+            for src, P, U, P_fill, U_fill, flags, coeffs, info in items:
+                a = int(np.searchsorted(bins, src[0]))
+                k = slice(a, a + src.size)             # chunks are contiguous
+                with PROFILER.stage("stream_write", n_bins=src.size):
+                    S.write_bin(k, P_fill, U_fill, P, U, dict(zip(CHANNELS, np.moveaxis(flags, 1, 0))), done=False)
+                    for i, metric in enumerate(metrics):
+                        S.write_sh(metric, k, coeffs[:, i], lmax, lam, info["center"])
+                    S.mark_done(k)
+                n += src.size
+                log(f"[{n}/{bins.size}] up to {R.freq[src[-1]]:.1f} Hz ({src.size} bins, "
+                    f"elapsed {time.perf_counter()-t0:.1f}s)")
+    return Path(store)
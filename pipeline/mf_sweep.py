@@ -0,0 +1,131 @@
+# mf_pipeline/mf_sweep.py
+import csv, warnings
+import numpy as np
+from pathlib import Path
+from mf_pipeline.mf_fill import (CHANNELS, SliceReader, robust_zscores,
+                                 rbf_fill_batch, select_lattice)
+from mf_pipeline.mf_geometry import get_geometry
+from mf_pipeline.mf_grid import grid_robust_zscores, grid_fill_channels, stencil_size
+from mf_pipeline.mf_profile import PROFILER
+
+SWEEP_COLS = ("k_nn", "tau", "channel", "n_flagged", "frac_flagged", "rel_delta", "max_delta_db")
+
+def fill_memo(pos: np.ndarray, X: np.ndarray, masks: np.ndarray, nbr_idx: np.ndarray, smooth: float, memo: tuple):
+    """fill_channels with a memo of RBF estimates keyed by (channel, sensor, neighbour subset).
+
+    `memo` is (sorted int64 keys, complex values) for one bin's raw `X`; an entry
+    flagged under several (tau, k_nn) settings with the same clean neighbours is
+    solved once. Returns (X_fill, updated memo).
+    """
+    X2 = np.array(X, dtype=np.result_type(X.dtype, np.complex128))
+    chans, targets = np.nonzero(masks)
+    if targets.size == 0:
+        return X2, memo
+    k = nbr_idx.shape[1]
+    sub = ~masks[chans[:, None], nbr_idx[targets]]
+    sub[~sub.any(axis=1)] = True   # no clean neighbour: fall back to the full neighbourhood
+    key = ((chans.astype(np.int64)*len(pos) + targets) << k) | (sub.astype(np.int64) << np.arange(k)).sum(axis=1)
+    keys, vals = memo
+    i = np.minimum(np.searchsorted(keys, key), max(keys.size - 1, 0))
+    hit = keys[i] == key if keys.size else np.zeros(key.size, bool)
+    v = np.empty(key.size, complex)
+    v[hit] = vals[i[hit]]
+    miss = ~hit
+    if miss.any():
+        v[miss] = rbf_fill_batch(pos, X2, targets[miss], chans[miss], sub[miss], nbr_idx, smooth=smooth)
+        keys, vals = np.concatenate([keys, key[miss]]), np.concatenate([vals, v[miss]])
+        order = np.argsort(keys, kind="stable")
+        keys, vals = keys[order], vals[order]
+    X2[chans, targets] = v
+    return X2, (keys, vals)
+
+def sweep_band(f_lo: float, f_hi: float, taus, k_nns, smooth: float=0.2, grid: str="auto",
+               chunk_bins: int=8, reader: SliceReader=None, log=print) -> list:
+    """Flag counts and fill deltas over a (tau, k_nn) grid for every bin in [f_lo, f_hi].
+
+    Z-scores are computed once per (chunk, k_nn) and every tau is a threshold on
+    them; fills reuse earlier RBF solves (kNN path) or the stencil weight table
+    (lattice path), so only entries whose neighbourhood pattern is new are solved.
+    With grid="on", k_nn values that give the same stencil as a smaller one are
+    skipped. Returns one row per (k_nn, tau, channel) plus a channel="all" row.
+    """
+    if reader is None:
+        with SliceReader() as R:
+            return sweep_band(f_lo, f_hi, taus, k_nns, smooth=smooth, grid=grid,
+                              chunk_bins=chunk_bins, reader=R, log=log)
+    taus, k_nns = sorted(set(map(float, taus))), sorted(set(map(int, k_nns)))
+    bins = np.flatnonzero((reader.freq >= f_lo) & (reader.freq <= f_hi))
+    if bins.size == 0:
+        raise ValueError(f"no frequency bins in [{f_lo}, {f_hi}] Hz")
+    pos = reader.pos
+    N, C = len(pos), len(CHANNELS)
+    geoms = {k: get_geometry(pos, k_nn=k) for k in k_nns}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")     # stencil sizes are reported below
+        lattices = {k: select_lattice(geoms[k], grid) for k in k_nns}
+    if grid == "on":
+        # rounded-up stencils: k_nn values that give the same stencil would give identical rows
+        seen = {}
+        for k in k_nns:
+            seen.setdefault(stencil_size(lattices[k], k), []).append(k)
+        for S, ks in seen.items():
+            log(f"lattice stencil of {S} nodes for k_nn={ks[0]}"
+                + (f"; skipping k_nn={', '.join(map(str, ks[1:]))} (same stencil)" if len(ks) > 1 else ""))
+        k_nns = [ks[0] for ks in seen.values()]
+    fill_idx = geoms[k_nns[0]].fill_idx
+    k_fill = geoms[k_nns[0]].k_fill
+
+    grid_shape = (len(k_nns), len(taus), C)
+    n_flag, d2, max_db = np.zeros(grid_shape, int), np.zeros(grid_shape), np.zeros(grid_shape)
+    r2 = np.zeros(C)
+    n_solved = 0
+    for a in range(0, bins.size, chunk_bins):
+        chunk = bins[a:a+chunk_bins]
+        with PROFILER.stage("sweep_load", n_bins=chunk.size):
+            P, U = reader.read_bins(chunk)
+            X = np.concatenate([P[:, None, :], np.moveaxis(U, -1, -2)], axis=1)   # (B,C,N)
+            M = np.abs(X)
+        r2 += (M**2).sum(axis=(0, 2))
+        memos = [(np.empty(0, np.int64), np.empty(0, complex)) for _ in chunk]
+        for ik, k in enumerate(k_nns):
+            with PROFILER.stage("sweep_zscores", k_nn=k, n_bins=chunk.size):
+                lattice = lattices[k]
+                z = grid_robust_zscores(M, lattice, k) if lattice is not None else robust_zscores(M, geoms[k].knn_idx)
+            for it, tau in enumerate(taus):
+                flags = z > tau
+                n_flag[ik, it] += flags.sum(axis=(0, 2))
+                with PROFILER.stage("sweep_fill", k_nn=k, tau=tau, n_flagged=int(flags.sum())):
+                    for b in range(chunk.size):
+                        if lattice is not None:
+                            Xf = grid_fill_channels(X[b], flags[b], lattice, smooth=smooth, k_fill=k_fill)
+                        else:
+                            before = memos[b][0].size
+                            Xf, memos[b] = fill_memo(pos, X[b], flags[b], fill_idx, smooth, memos[b])
+                            n_solved += memos[b][0].size - before
+                        c, n = np.nonzero(flags[b])
+                        d = Xf[c, n] - X[b, c, n]
+                        np.add.at(d2[ik, it], c, np.abs(d)**2)
+                        db = np.abs(20*np.log10((np.abs(Xf[c, n]) + 1e-30) / (M[b, c, n] + 1e-30)))
+                        np.maximum.at(max_db[ik, it], c, db)
+        log(f"[{min(a + chunk_bins, bins.size)}/{bins.size}] bins up to {reader.freq[chunk[-1]]:.1f} Hz")
+    if any(lat is None for lat in lattices.values()):
+        log(f"RBF solves: {n_solved} for {int(n_flag.sum())} flagged entries over the grid")
+
+    rows = []
+    for ik, k in enumerate(k_nns):
+        for it, tau in enumerate(taus):
+            for c, name in enumerate(CHANNELS + ("all",)):
+                sl = slice(None) if name == "all" else c
+                n = int(n_flag[ik, it, sl].sum())
+                rows.append(dict(k_nn=k, tau=tau, channel=name, n_flagged=n,
+                                 frac_flagged=n / (bins.size*N*(C if name == "all" else 1)),
+                                 rel_delta=float(np.sqrt(d2[ik, it, sl].sum() / max(r2[sl].sum(), 1e-300))),
+                                 max_delta_db=float(max_db[ik, it, sl].max())))
+    return rows
+
+def write_sweep_csv(rows: list, path: Path) -> Path:
+    with open(path, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=SWEEP_COLS)
+        w.writeheader()
+        w.writerows(rows)
+    return path
@@ -1,27 +1,67 @@
 #!/usr/bin/env python3
-import argparse, subprocess, sys
-from pathlib import Path
+# mf_pipeline/run_batch.py
+import argparse, sys, pathlib
+# Script-mode shim
+if __package__ is None or __package__ == "":
+    sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from mf_pipeline.mf_config import EXPORTS
+from mf_pipeline.mf_batch import run_batch
+from mf_pipeline.mf_cache import CACHE_DIR, StageCache
+from mf_pipeline.mf_profile import PROFILER, add_profile_args, start_profiling, finish_profiling
+from mf_pipeline.mf_directivity import METRICS
 
 def main():
     ap = argparse.ArgumentParser(description="Batch: fill + directivity for many frequencies")
     ap.add_argument("--freqs", type=float, nargs="+", required=True, help="List of frequencies in Hz")
-    ap.add_argument("--metric", type=str, default="u_mag", help="u_mag | ux | uy | uz | p")
+    ap.add_argument("--metric", type=str, nargs="+", default=["u_mag"], help="u_mag | ux | uy | uz | p | all (several allowed)")
+    ap.add_argument("--tau", type=float, default=3.5, help="Robust z-score threshold")
+    ap.add_argument("--k-nn", dest="k_nn", type=int, default=12, help="Neighbors for local stats")
+    ap.add_argument("--smooth", type=float, default=0.2, help="RBF smoothing")
+    ap.add_argument("--tag", type=str, default="noiseaware", help="Output tag (default: noiseaware)")
+    ap.add_argument("--grid", choices=("auto", "on", "off"), default="auto",
+                    help="Lattice stencil fast path: auto-detect, require, or disable")
+    ap.add_argument("--lmax", type=int, default=8, help="Spherical-harmonics degree")
+    ap.add_argument("--lam", type=float, default=1e-3, help="Tikhonov regularization")
+    ap.add_argument("--auto", nargs="?", const="gcv", choices=("gcv", "loo"), default=None,
+                    help="Choose lmax (up to --lmax) and lam per metric and frequency by GCV or leave-one-out")
+    ap.add_argument("--db", action="store_true", help="Plot/save in dB (normalized)")
+    ap.add_argument("--no-directivity", action="store_true", help="Only run the fill stage")
+    ap.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    ap.add_argument("--max-inflight", type=int, default=None, help="Max frequencies queued at once (default: 2x workers)")
+    ap.add_argument("--mem-mb", type=float, default=None, help="Cap in-flight frequencies to this memory budget")
+    ap.add_argument("--store", type=pathlib.Path, default=None,
+                    help="Write all bins into one HDF5 results store (name or path; relative names go to EXPORTS)")
+    ap.add_argument("--store-layout", choices=("bins", "sensors"), default="bins",
+                    help="Chunk the store for per-bin access or for per-sensor time series")
+    ap.add_argument("--force", action="store_true", help="Recompute stages even if cached")
+    ap.add_argument("--cache-mb", type=float, default=2048, help="Stage cache size bound (0 disables the cache)")
+    add_profile_args(ap)
     args = ap.parse_args()
+    report = start_profiling(args, EXPORTS, "batch")
+
+    fill_kw = dict(tau=args.tau, k_nn=args.k_nn, smooth=args.smooth, tag=args.tag, grid=args.grid)
+    dir_kw = None
+    if not args.no_directivity:
+        metrics = list(METRICS) if "all" in args.metric else args.metric
+        dir_kw = dict(metrics=metrics, lmax=args.lmax, lam=args.lam, db=args.db, auto=args.auto)
 
-    for f0 in args.freqs:
-        # 1) fill
-        code = subprocess.call([sys.executable, "run_fill.py", "--f0", str(f0)])
-        if code != 0:
-            print(f"[WARN] fill failed for f0={f0}")
-            continue
-        npz = Path("exports") / f"filled_arrays_noiseaware_{int(round(f0))}Hz.npz"
-        if not npz.exists():
-            print(f"[WARN] NPZ not found: {npz}")
-            continue
-        # 2) directivity
-        code = subprocess.call([sys.executable, "run_directivity.py", "--npz", str(npz), "--metric", args.metric])
-        if code != 0:
-            print(f"[WARN] directivity failed for {npz}")
+    cache = StageCache(CACHE_DIR, max_mb=args.cache_mb, force=args.force) if args.cache_mb > 0 else None
+    store = args.store
+    if store is not None and not store.is_absolute():
+        store = EXPORTS / store
+    results = run_batch(args.freqs, fill_kw=fill_kw, dir_kw=dir_kw, workers=args.workers,
+                        max_inflight=args.max_inflight, mem_mb=args.mem_mb, store=store,
+                        store_layout=args.store_layout, cache=cache,
+                        profile=dict(cprofile_dir=PROFILER.cprofile_dir) if report is not None else None)
+    if store is not None:
+        print(f"Saved: {store}")
+    for out in finish_profiling(report, [t for r in results for t in r.timings]):
+        print(f"Saved: {out}")
+    failed = [r.f0 for r in results if r.error is not None]
+    if failed:
+        print(f"[WARN] {len(failed)} frequencies failed: {sorted(failed)}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
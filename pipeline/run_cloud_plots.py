@@ -1,92 +1,149 @@
 #!/usr/bin/env python3
 # mf_pipeline/run_cloud_plots.py
-import argparse, sys, pathlib, csv
+import argparse, sys, pathlib, os
 # Script-mode shim
 if __package__ is None or __package__ == '':
     sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
 
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from mf_pipeline.mf_config import EXPORTS
 from mf_pipeline.mf_directivity import load_filled_npz, choose_metric
-from mf_pipeline.mf_plots import (
-    plot_cloud_before_after, plot_hist_residuals,
-    plot_delta_series, plot_raw_vs_filled
-)
+from mf_pipeline.mf_store import load_filled_bin
+from mf_pipeline.mf_profile import PROFILER, add_profile_args, start_profiling, finish_profiling
+from mf_pipeline.mf_plots import CloudFigures
 
-def main():
-    ap = argparse.ArgumentParser(description="Point-cloud plots with noisy highlighting and per-point deltas")
-    ap.add_argument("--npz", type=pathlib.Path, required=True, help="Path to .../exports/filled_arrays_noiseaware_{Hz}.npz")
-    ap.add_argument("--metric", type=str, default="u_mag", help="u_mag | ux | uy | uz | p")
-    args = ap.parse_args()
+QTY = {"u_mag": "|U|", "ux": "|Ux|", "uy": "|Uy|", "uz": "|Uz|", "p": "|P|"}
+
+# per-process figure template, reused while positions/metric stay the same
+_FIGURES = {}
 
-    # Output base in absolute EXPORTS
-    stem = args.npz.stem
-    base = (EXPORTS / f"{stem}_{args.metric}").resolve()
+def load_cloud_inputs(npz=None, h5=None, f0=None):
+    # -> stem, pos, P_fill, U_fill, meta, P_raw, U_raw, flags
+    if npz is not None:
+        npz = pathlib.Path(npz)
+        pos, P_fill, U_fill, meta = load_filled_npz(npz)
+        # optional raw + flags (for Δ plots and highlighting)
+        Z = np.load(npz, allow_pickle=True)
+        P_raw = Z["p_raw"] if "p_raw" in Z.files else None
+        U_raw = Z["u_raw"] if "u_raw" in Z.files else None
+        flags = Z["flags"].item() if "flags" in Z.files else {}
+        return npz.stem, pos, P_fill, U_fill, meta, P_raw, U_raw, flags
+    B = load_filled_bin(h5, f0)
+    stem = f"{pathlib.Path(h5).stem}_{int(round(B['meta']['f0']))}Hz"
+    return stem, B["pos"], B["p"], B["u"], B["meta"], B["p_raw"], B["u_raw"], B["flags"]
 
-    # Load filled arrays
-    pos, P_fill, U_fill, meta = load_filled_npz(args.npz)
+def noisy_mask(flags: dict, metric: str):
+    if metric == "u_mag":
+        if all(flags.get(c) is not None for c in ("ux", "uy", "uz")):
+            return flags["ux"] | flags["uy"] | flags["uz"]
+        return None
+    return flags.get(metric)
 
-    # Load optional raw + flags (for Δ plots and highlighting)
-    Z = np.load(args.npz, allow_pickle=True)
-    P_raw = Z["p_raw"] if "p_raw" in Z.files else None
-    U_raw = Z["u_raw"] if "u_raw" in Z.files else None
-    flags = Z["flags"].item() if "flags" in Z.files else {}
-    f_p  = flags.get("p", None); f_ux = flags.get("ux", None)
-    f_uy = flags.get("uy", None); f_uz = flags.get("uz", None)
+def write_delta_csv(path, v_raw, v_fill, mask=None):
+    dv = v_fill - v_raw
+    cols = [np.arange(dv.size), v_raw, v_fill, dv, np.abs(dv)]
+    header = "index,raw,filled,delta,abs_delta,"
+    if mask is not None:
+        cols.append(np.asarray(mask, int)); header += "is_noisy"
+        fmt = "%d,%.10g,%.10g,%.10g,%.10g,%d"
+    else:
+        header += "is_noisy(n/a)"
+        fmt = "%d,%.10g,%.10g,%.10g,%.10g,"
+    np.savetxt(path, np.column_stack(cols), fmt=fmt, header=header, comments="")
+    return path
+
+def export_cloud(metric="u_mag", with_3d=True, npz=None, h5=None, f0=None, log=print):
+    stem, pos, P_fill, U_fill, meta, P_raw, U_raw, flags = load_cloud_inputs(npz, h5, f0)
+    base = (EXPORTS / f"{stem}_{metric}").resolve()
 
-    # Metric for filled/raw
-    v_fill = choose_metric(P_fill, U_fill, which=args.metric)
+    v_fill = choose_metric(P_fill, U_fill, which=metric)
     if P_raw is not None and U_raw is not None:
-        v_raw = choose_metric(P_raw, U_raw, which=args.metric)
+        v_raw = choose_metric(P_raw, U_raw, which=metric)
     else:
-        print("[WARN] raw arrays not found in NPZ; using filled for both (Δ=0).")
+        log(f"[WARN] {stem}: raw arrays not found; using filled for both (Δ=0).")
         v_raw = v_fill.copy()
+    mask = noisy_mask(flags, metric)
+    qty = QTY[metric]
 
-    # Mask for highlighting
-    mask = None
-    if args.metric == "p" and f_p is not None: mask = f_p
-    if args.metric == "ux" and f_ux is not None: mask = f_ux
-    if args.metric == "uy" and f_uy is not None: mask = f_uy
-    if args.metric == "uz" and f_uz is not None: mask = f_uz
-    if args.metric == "u_mag" and (f_ux is not None) and (f_uy is not None) and (f_uz is not None):
-        mask = (f_ux | f_uy | f_uz)
+    with PROFILER.stage("plot_cloud", f0=meta.get("f0"), metric=metric, n_pos=len(pos), with_3d=with_3d):
+        F = _FIGURES.get("cloud")
+        if F is None or not F.matches(pos, qty, with_3d):
+            if F is not None:
+                F.close()
+            F = _FIGURES["cloud"] = CloudFigures(pos, qty, with_3d=with_3d)
+        saved = F.render(base, v_raw, v_fill, mask_noisy=mask)
+        saved.append(write_delta_csv(base.with_name(base.name + "_delta.csv"), v_raw, v_fill, mask))
+    return saved
 
-    qty = {"u_mag":"|U|","ux":"|Ux|","uy":"|Uy|","uz":"|Uz|","p":"|P|"}[args.metric]
-    dv = v_fill - v_raw
+def close_figures():
+    for F in _FIGURES.values():
+        F.close()
+    _FIGURES.clear()
+
+def _init_worker(profile=None):
+    if profile is not None:
+        PROFILER.enable(**profile)
 
-    # Save figures
-    out_cloud = base.with_name(base.name + "_cloud_before_after.png")
-    fig = plot_cloud_before_after(pos, v_raw, v_fill, mask_noisy=mask, quantity_label=qty)
-    fig.savefig(out_cloud, dpi=200, bbox_inches="tight")
-
-    out_hist = base.with_name(base.name + "_residual_hist.png")
-    fig2 = plot_hist_residuals(v_raw, v_fill, mask_noisy=mask, quantity_label=qty)
-    fig2.savefig(out_hist, dpi=200, bbox_inches="tight")
-
-    out_delta = base.with_name(base.name + "_delta_series.png")
-    fig3 = plot_delta_series(dv, mask_noisy=mask, quantity_label=qty)
-    fig3.savefig(out_delta, dpi=200, bbox_inches="tight")
-
-    out_scatt = base.with_name(base.name + "_raw_vs_filled.png")
-    fig4 = plot_raw_vs_filled(v_raw, v_fill, quantity_label=qty)
-    fig4.savefig(out_scatt, dpi=200, bbox_inches="tight")
-
-    # CSV with per-point Δ
-    out_csv = base.with_name(base.name + "_delta.csv")
-    with open(out_csv, "w", newline="") as f:
-        w = csv.writer(f)
-        w.writerow(["index", "raw", "filled", "delta", "abs_delta",
-                    "is_noisy" if mask is not None else "is_noisy(n/a)"])
-        for i in range(dv.size):
-            is_noisy = bool(mask[i]) if mask is not None else ""
-            w.writerow([i, float(v_raw[i]), float(v_fill[i]), float(dv[i]), float(abs(dv[i])), is_noisy])
+def _render_one(job):
+    mark = PROFILER.mark()
+    saved = export_cloud(**job)
+    timings = PROFILER.since(mark)
+    if PROFILER.enabled:
+        del PROFILER.records[mark:]
+        PROFILER.dump_cprofiles(tag=f"_{os.getpid()}")
+    return saved, timings
+
+def render_clouds(jobs, workers=1, profile=None):
+    """Render the cloud plots of many frequencies; returns (saved, worker profiler records).
+
+    Each job is export_cloud keyword arguments. With workers > 1 the frequencies
+    are spread over worker processes, each keeping its own figure template.
+    """
+    saved, records = [], []
+    if workers <= 1 or len(jobs) == 1:
+        try:
+            for job in jobs:
+                saved += export_cloud(**job)
+        finally:
+            close_figures()
+        return saved, records
+    chunk = max(1, len(jobs) // (4*workers))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(profile,)) as ex:
+        for out, timings in ex.map(_render_one, jobs, chunksize=chunk):
+            saved += out; records += timings
+    return saved, records
+
+def main():
+    ap = argparse.ArgumentParser(description="Point-cloud plots with noisy highlighting and per-point deltas")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--npz", type=pathlib.Path, nargs="+", help="Path(s) to .../exports/filled_arrays_noiseaware_{Hz}.npz")
+    src.add_argument("--h5", type=pathlib.Path, help="Results store written by run_batch.py --store")
+    ap.add_argument("--f0", type=float, nargs="+", default=None, help="Frequency bin(s) to read from --h5")
+    ap.add_argument("--metric", type=str, default="u_mag", help="u_mag | ux | uy | uz | p")
+    ap.add_argument("--no-3d", dest="with_3d", action="store_false", help="Skip the 3-D scatter panels")
+    ap.add_argument("--workers", type=int, default=None, help="Render processes (default: all cores, at most one per frequency)")
+    add_profile_args(ap)
+    args = ap.parse_args()
+    report = start_profiling(args, EXPORTS, "cloud_plots")
+    if args.metric not in QTY:
+        ap.error(f"--metric must be one of: {', '.join(QTY)}")
+
+    if args.npz is not None:
+        jobs = [dict(npz=p) for p in args.npz]
+    else:
+        if args.f0 is None:
+            ap.error("--h5 needs --f0")
+        jobs = [dict(h5=args.h5, f0=f) for f in args.f0]
+    for job in jobs:
+        job.update(metric=args.metric, with_3d=args.with_3d)
+    workers = min(len(jobs), max(1, args.workers or os.cpu_count() or 1))
+    profile = dict(cprofile_dir=PROFILER.cprofile_dir) if report is not None else None
+    saved, records = render_clouds(jobs, workers=workers, profile=profile)
 
     print("Saved:")
-    print(" ", out_cloud)
-    print(" ", out_hist)
-    print(" ", out_delta)
-    print(" ", out_scatt)
-    print(" ", out_csv)
+    for out in saved + finish_profiling(report, records):
+        print(" ", out)
 
 if __name__ == "__main__":
     main()
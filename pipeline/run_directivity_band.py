@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# mf_pipeline/run_directivity_band.py
+import argparse, sys, pathlib
+# Script-mode shim
+if __package__ is None or __package__ == "":
+    sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from mf_pipeline.mf_config import EXPORTS
+from mf_pipeline.mf_directivity import (
+    METRICS, load_filled_npz, fit_SH_band, band_cuts, beamwidth, directivity_index
+)
+from mf_pipeline.mf_store import ResultsStore
+from mf_pipeline.mf_plots import new_figure
+from mf_pipeline.mf_profile import PROFILER, add_profile_args, start_profiling, finish_profiling
+
+def band_coeffs_from_store(path, metrics, lmax=8, lam=1e-3, band=None, chunk_bins=64, log=print):
+    """Stacked (F,K) coefficients per metric for the finished bins of a results store.
+
+    Stored sh/<metric> rows are used when they were fitted with the same lmax
+    and lam; anything else is fitted from the stored fill arrays, chunk_bins
+    bins per read, all sharing one cached factorization.
+    """
+    with ResultsStore(path) as S:
+        sel = S.done.copy()
+        if band is not None:
+            sel &= (S.freq >= band[0]) & (S.freq <= band[1])
+        bins = np.flatnonzero(sel)
+        if bins.size == 0:
+            raise ValueError(f"{path}: no finished bins" + (f" in {band[0]}-{band[1]} Hz" if band else ""))
+        coeffs, center, todo = {}, None, []
+        for metric in metrics:
+            hit = S.read_sh(metric, bins)
+            if hit is not None and hit[1]["lmax"] == lmax and np.isclose(hit[1]["lam"], lam) \
+                    and not np.isnan(hit[0]).any():
+                coeffs[metric], center = hit[0], hit[1]["center"]
+            else:
+                todo.append(metric)
+        if todo:
+            log(f"fitting {', '.join(todo)} for {bins.size} bins (lmax={lmax}, lam={lam})")
+            pos, parts = S.pos, []
+            for a in range(0, bins.size, chunk_bins):
+                b = bins[a:a+chunk_bins]
+                c, info = fit_SH_band(pos, S.read("p", b), S.read("u", b), metrics=todo, lmax=lmax, lam=lam)
+                parts.append(c)
+            c = np.concatenate(parts)   # (F,M,K)
+            coeffs.update({m: c[:, i] for i, m in enumerate(todo)})
+            center = info["center"]
+        return S.freq[bins].astype(float), coeffs, dict(lmax=lmax, lam=lam, center=center)
+
+def band_coeffs_from_npz(paths, metrics, lmax=8, lam=1e-3, band=None):
+    # filled NPZs of one scan (same positions), one per frequency -> one fit for all of them
+    pos, P, U, f0 = None, [], [], []
+    for p in paths:
+        pos_k, P_k, U_k, meta = load_filled_npz(p)
+        if band is not None and not band[0] <= meta["f0"] <= band[1]:
+            continue
+        if pos is not None and not np.array_equal(pos, pos_k):
+            raise ValueError(f"{p}: sensor positions differ from the other NPZ files")
+        pos = pos_k; P.append(P_k); U.append(U_k); f0.append(float(meta["f0"]))
+    if not f0:
+        raise ValueError("no NPZ files in the requested band")
+    order = np.argsort(f0)
+    c, info = fit_SH_band(pos, np.stack(P)[order], np.stack(U)[order], metrics=metrics, lmax=lmax, lam=lam)
+    return np.asarray(f0)[order], {m: c[:, i] for i, m in enumerate(metrics)}, info
+
+def band_products(freq, coeffs, lmax, n=361, drop_db=6.0):
+    a, v_h, v_v = band_cuts(coeffs, lmax, n=n)
+    i0 = int(np.argmin(np.abs(a)))
+    return dict(freq=freq, angle_deg=a, v_h=v_h, v_v=v_v,
+                beamwidth_h=beamwidth(a, v_h, drop_db), beamwidth_v=beamwidth(a, v_v, drop_db),
+                di=directivity_index(coeffs, v_h[:, i0]))
+
+def _write_band_heatmap(out_png, metric, B, drop_db=6.0, floor_db=-30.0):
+    a, f = B["angle_deg"], B["freq"]
+    i0 = int(np.argmin(np.abs(a)))
+    fig = new_figure((11.0, 4.6))
+    axes = fig.subplots(1, 2, sharey=True)
+    for ax, key, name in ((axes[0], "v_h", "Horizontal (el=0°)"), (axes[1], "v_v", "Vertical (az=0° plane)")):
+        A = np.abs(B[key]) + 1e-30
+        L = np.maximum(20*np.log10(A / A[:, i0:i0+1]), floor_db)
+        m = ax.pcolormesh(a, f, L, shading="auto", vmin=floor_db, vmax=0.0)
+        if f.size > 1:
+            ax.contour(a, f, L, levels=[-drop_db], colors="w", linewidths=0.8)
+            ax.set_yscale("log")
+        ax.set_xlabel("Angle from axis [deg]"); ax.set_title(name)
+    axes[0].set_ylabel("Frequency [Hz]")
+    cb = fig.colorbar(m, ax=axes); cb.set_label("dB re on-axis")
+    fig.suptitle(f"Directivity vs frequency ({metric}), -{drop_db:g} dB contour")
+    fig.savefig(out_png, dpi=180)
+    fig.clear()
+    return out_png
+
+def export_band(stem, freq, coeffs, info, n=361, drop_db=6.0, plot=True):
+    saved = []
+    for metric, C in coeffs.items():
+        B = band_products(freq, C, info["lmax"], n=n, drop_db=drop_db)
+        base = (EXPORTS / f"{stem}_{metric}_band").resolve()
+        out_npz = base.with_name(base.name + ".npz")
+        np.savez(out_npz, **B, coeffs=C, lmax=info["lmax"], lam=info["lam"],
+                 center=np.asarray(info["center"], float), drop_db=drop_db)
+        saved.append(out_npz)
+        if plot:
+            with PROFILER.stage("plot_band", metric=metric, n_freq=freq.size):
+                saved.append(_write_band_heatmap(base.with_name(base.name + ".png"), metric, B, drop_db=drop_db))
+    return saved
+
+def main():
+    ap = argparse.ArgumentParser(description="Full-band directivity: polar maps, beamwidth and DI for every frequency")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--h5", type=pathlib.Path, help="Results store written by run_batch.py --store")
+    src.add_argument("--npz", type=pathlib.Path, nargs="+", help="Filled NPZ files of one scan (one per frequency)")
+    ap.add_argument("--band", type=float, nargs=2, default=None, metavar=("F_LO", "F_HI"), help="Limit to this band (Hz)")
+    ap.add_argument("--metric", type=str, nargs="+", default=["u_mag"], help="u_mag | ux | uy | uz | p | all (several allowed)")
+    ap.add_argument("--lmax", type=int, default=8, help="Spherical-harmonics degree")
+    ap.add_argument("--lam", type=float, default=1e-3, help="Tikhonov regularization")
+    ap.add_argument("--n-angle", type=int, default=361, help="Samples per polar cut (-180..180 deg)")
+    ap.add_argument("--drop-db", type=float, default=6.0, help="Beamwidth level below on-axis (dB)")
+    ap.add_argument("--tag", type=str, default=None, help="Output stem (default: store name, or 'band')")
+    ap.add_argument("--no-plot", action="store_true", help="Only write the arrays")
+    add_profile_args(ap)
+    args = ap.parse_args()
+    report = start_profiling(args, EXPORTS, "directivity_band")
+    metrics = list(METRICS) if "all" in args.metric else args.metric
+    band = sorted(args.band) if args.band else None
+
+    if args.h5 is not None:
+        freq, coeffs, info = band_coeffs_from_store(args.h5, metrics, lmax=args.lmax, lam=args.lam, band=band)
+        stem = args.tag or args.h5.stem
+    else:
+        freq, coeffs, info = band_coeffs_from_npz(args.npz, metrics, lmax=args.lmax, lam=args.lam, band=band)
+        stem = args.tag or "band"
+    saved = export_band(stem, freq, coeffs, info, n=args.n_angle, drop_db=args.drop_db, plot=not args.no_plot)
+    print(f"{freq.size} frequencies, {freq.min():.1f}-{freq.max():.1f} Hz")
+    for out in saved + finish_profiling(report):
+        print("Saved:", out)
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,9 @@ if __package__ is None or __package__ == "":
     sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
 
 from mf_pipeline.mf_fill import noiseaware_fill
+from mf_pipeline.mf_config import EXPORTS
+from mf_pipeline.mf_cache import CACHE_DIR, StageCache
+from mf_pipeline.mf_profile import add_profile_args, start_profiling, finish_profiling
 
 def main():
     ap = argparse.ArgumentParser(description="Noise-aware fill for Microflown speaker scans")
@@ -14,10 +17,20 @@ def main():
     ap.add_argument("--k-nn", dest="k_nn", type=int, default=12, help="Neighbors for local stats")
     ap.add_argument("--smooth", type=float, default=0.2, help="RBF smoothing")
     ap.add_argument("--tag", type=str, default="noiseaware", help="Output tag (default: noiseaware)")
+    ap.add_argument("--grid", choices=("auto", "on", "off"), default="auto",
+                    help="Lattice stencil fast path: auto-detect, require, or disable")
+    ap.add_argument("--force", action="store_true", help="Recompute stages even if cached")
+    ap.add_argument("--cache-mb", type=float, default=2048, help="Stage cache size bound (0 disables the cache)")
+    add_profile_args(ap)
     args = ap.parse_args()
+    report = start_profiling(args, EXPORTS, "fill")
 
-    out = noiseaware_fill(args.f0, tau=args.tau, k_nn=args.k_nn, smooth=args.smooth, tag=args.tag)
+    cache = StageCache(CACHE_DIR, max_mb=args.cache_mb, force=args.force) if args.cache_mb > 0 else None
+    out = noiseaware_fill(args.f0, tau=args.tau, k_nn=args.k_nn, smooth=args.smooth, tag=args.tag,
+                          cache=cache, grid=args.grid)
     print(f"Saved: {out}")
+    for out in finish_profiling(report):
+        print(f"Saved: {out}")
 
 if __name__ == "__main__":
     main()
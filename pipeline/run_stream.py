@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# mf_pipeline/run_stream.py
+import argparse, sys, pathlib
+# Script-mode shim: allow "python mf_pipeline/run_stream.py"
+if __package__ is None or __package__ == "":
+    sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from mf_pipeline.mf_config import EXPORTS
+from mf_pipeline.mf_directivity import METRICS
+from mf_pipeline.mf_stream import stream_band
+from mf_pipeline.mf_profile import add_profile_args, start_profiling, finish_profiling
+
+def main():
+    ap = argparse.ArgumentParser(description="Out-of-core full-band fill + SH fit into a results store")
+    ap.add_argument("--store", type=pathlib.Path, required=True,
+                    help="Output HDF5 results store (name or path; relative names go to EXPORTS)")
+    ap.add_argument("--band", type=float, nargs=2, default=None, metavar=("F_LO", "F_HI"),
+                    help="Band in Hz (default: every bin)")
+    ap.add_argument("--mem-mb", type=float, default=1024, help="Memory budget that sizes the frequency chunks")
+    ap.add_argument("--tau", type=float, default=3.5, help="Robust z-score threshold")
+    ap.add_argument("--k-nn", dest="k_nn", type=int, default=12, help="Neighbors for local stats")
+    ap.add_argument("--smooth", type=float, default=0.2, help="RBF smoothing")
+    ap.add_argument("--grid", choices=("auto", "on", "off"), default="auto",
+                    help="Lattice stencil fast path: auto-detect, require, or disable")
+    ap.add_argument("--metric", type=str, nargs="+", default=["u_mag"], help="u_mag | ux | uy | uz | p | all (several allowed)")
+    ap.add_argument("--lmax", type=int, default=8, help="Spherical-harmonics degree")
+    ap.add_argument("--lam", type=float, default=1e-3, help="Tikhonov regularization")
+    ap.add_argument("--no-directivity", action="store_true", help="Only fill; no SH coefficients")
+    ap.add_argument("--restart", action="store_true", help="Overwrite the store instead of resuming it")
+    ap.add_argument("--store-layout", choices=("bins", "sensors"), default="bins",
+                    help="Chunk the store for per-bin access or for per-sensor time series")
+    add_profile_args(ap)
+    args = ap.parse_args()
+    report = start_profiling(args, EXPORTS, "stream")
+
+    store = args.store if args.store.is_absolute() else EXPORTS / args.store
+    metrics = [] if args.no_directivity else (list(METRICS) if "all" in args.metric else args.metric)
+    f_lo, f_hi = sorted(args.band) if args.band else (None, None)
+    out = stream_band(store, f_lo, f_hi, tau=args.tau, k_nn=args.k_nn, smooth=args.smooth, grid=args.grid,
+                      metrics=metrics, lmax=args.lmax, lam=args.lam, mem_mb=args.mem_mb, restart=args.restart,
+                      layout=args.store_layout)
+    print(f"Saved: {out}")
+    for out in finish_profiling(report):
+        print(f"Saved: {out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# mf_pipeline/run_sweep.py
+import argparse, sys, pathlib
+# Script-mode shim: allow "python mf_pipeline/run_sweep.py"
+if __package__ is None or __package__ == "":
+    sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from mf_pipeline.mf_sweep import sweep_band, write_sweep_csv
+from mf_pipeline.mf_config import EXPORTS
+from mf_pipeline.mf_profile import add_profile_args, start_profiling, finish_profiling
+
+def main():
+    ap = argparse.ArgumentParser(description="Sweep --tau / --k-nn over a band: flagged counts and fill deltas")
+    ap.add_argument("--band", type=float, nargs=2, required=True, metavar=("F_LO", "F_HI"), help="Band in Hz")
+    ap.add_argument("--taus", type=float, nargs="+", default=[3.0, 3.5, 4.0], help="Z-score thresholds")
+    ap.add_argument("--k-nn", dest="k_nn", type=int, nargs="+", default=[12, 16, 24], help="Neighbor counts")
+    ap.add_argument("--smooth", type=float, default=0.2, help="RBF smoothing")
+    ap.add_argument("--grid", choices=("auto", "on", "off"), default="auto",
+                    help="Lattice stencil fast path: auto-detect, require, or disable")
+    ap.add_argument("--chunk-bins", type=int, default=8, help="Frequency bins loaded at once")
+    ap.add_argument("--tag", type=str, default="noiseaware", help="Output tag (default: noiseaware)")
+    add_profile_args(ap)
+    args = ap.parse_args()
+    report = start_profiling(args, EXPORTS, "sweep")
+
+    f_lo, f_hi = sorted(args.band)
+    rows = sweep_band(f_lo, f_hi, args.taus, args.k_nn, smooth=args.smooth, grid=args.grid,
+                      chunk_bins=args.chunk_bins)
+    out = write_sweep_csv(rows, EXPORTS / f"sweep_{args.tag}_{int(round(f_lo))}-{int(round(f_hi))}Hz.csv")
+
+    print(f"{'k_nn':>5} {'tau':>5} {'flagged':>9} {'frac':>8} {'rel_delta':>10} {'max_dB':>8}")
+    for r in rows:
+        if r["channel"] == "all":
+            print(f"{r['k_nn']:>5} {r['tau']:>5.2f} {r['n_flagged']:>9} {r['frac_flagged']:>8.4f} "
+                  f"{r['rel_delta']:>10.4g} {r['max_delta_db']:>8.2f}")
+    print(f"Saved: {out}")
+    for out in finish_profiling(report):
+        print(f"Saved: {out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+# tests/conftest.py
+import os, sys, types, tempfile
+from pathlib import Path
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# outputs and the stage/geometry caches go to a scratch directory, not the configured EXPORTS
+os.environ["MF_EXPORTS"] = tempfile.mkdtemp(prefix="mf_exports_")
+
+# the modules live in pipeline/ but import each other as mf_pipeline.*
+_pkg = types.ModuleType("mf_pipeline")
+_pkg.__path__ = [str(ROOT / "pipeline")]
+sys.modules.setdefault("mf_pipeline", _pkg)
+
+@pytest.fixture(scope="session")
+def scan(tmp_path_factory):
+    # small synthetic lattice scan with known outliers (see bench/synth.py)
+    from mf_pipeline.bench.synth import make_scan
+    return make_scan(tmp_path_factory.mktemp("scan") / "scan.h5", shape=(8, 8, 8), n_freq=8,
+                     source="mixed", outlier_frac=0.02, seed=3)
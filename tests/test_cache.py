@@ -0,0 +1,106 @@
+# tests/test_cache.py
+import os
+import numpy as np
+from mf_pipeline.mf_cache import StageCache, stage_key, array_digest
+from mf_pipeline.mf_fill import SliceReader, noiseaware_compute
+
+class CountingCache(StageCache):
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self.hits, self.misses = [], []
+
+    def get(self, key):
+        out = super().get(key)
+        (self.hits if out is not None else self.misses).append(key.split("-")[0])
+        return out
+
+def test_stage_key_depends_on_every_part():
+    k = stage_key("fill", flags="abc", smooth=0.2)
+    assert k == stage_key("fill", smooth=0.2, flags="abc")
+    assert k != stage_key("fill", flags="abc", smooth=0.3)
+    assert k != stage_key("flags", flags="abc", smooth=0.2)
+    assert array_digest(np.arange(3)) != array_digest(np.arange(3.0))
+
+def test_put_get_force(tmp_path):
+    C = StageCache(tmp_path)
+    assert C.get("x-1") is None
+    C.put("x-1", a=np.arange(4), b=np.eye(2))
+    hit = C.get("x-1")
+    np.testing.assert_array_equal(hit["a"], np.arange(4))
+    assert StageCache(tmp_path, force=True).get("x-1") is None
+
+def test_evicts_least_recently_used(tmp_path):
+    C = StageCache(tmp_path, max_mb=2.5)
+    for i, name in enumerate(("a-1", "b-1")):
+        C.put(name, x=np.zeros(2**17))          # 1 MiB each
+        os.utime(C.path(name), (1000 + i, 1000 + i))
+    C.get("a-1")                                # refreshes a-1, so b-1 is now the oldest
+    C.put("c-1", x=np.zeros(2**17))
+    assert C.path("a-1").exists() and C.path("c-1").exists()
+    assert not C.path("b-1").exists()
+
+def test_noiseaware_compute_cache_hit_and_miss(scan, tmp_path):
+    C = CountingCache(tmp_path)
+    with SliceReader(scan["path"]) as R:
+        f0 = float(R.freq[2])
+        first = noiseaware_compute(f0, reader=R, cache=C)
+        assert C.hits == [] and C.misses == ["fill", "flags"]
+        again = noiseaware_compute(f0, reader=R, cache=C)
+        assert C.hits == ["fill"]
+        np.testing.assert_array_equal(again.P, first.P)
+        np.testing.assert_array_equal(again.flags["ux"], first.flags["ux"])
+        C.hits.clear(); C.misses.clear()
+        noiseaware_compute(f0, reader=R, cache=C, smooth=0.3)      # new fill, same flags
+        assert C.misses == ["fill"] and C.hits == ["flags"]
+
+def test_truncated_artifact_is_a_miss(tmp_path):
+    C = StageCache(tmp_path)
+    C.put("x-1", a=np.arange(1000))
+    data = C.path("x-1").read_bytes()
+    C.path("x-1").write_bytes(data[:len(data)//2])
+    assert C.get("x-1") is None
+    assert not C.path("x-1").exists()
+
+def test_eviction_keeps_in_flight_temp_files(tmp_path):
+    C = StageCache(tmp_path, max_mb=0.5)
+    tmp = tmp_path / "fill-0.999.tmp.npz"
+    np.savez(tmp, x=np.zeros(2**17))
+    os.utime(tmp, (1, 1))                       # oldest file in the directory
+    C.put("a-1", x=np.zeros(2**16))
+    C.evict()
+    assert tmp.exists()
+
+def test_put_does_not_rescan_every_time(tmp_path, monkeypatch):
+    C = StageCache(tmp_path, max_mb=100)
+    scans = []
+    orig = StageCache.evict
+    monkeypatch.setattr(StageCache, "evict", lambda self: (scans.append(1), orig(self)))
+    for i in range(20):
+        C.put(f"x-{i}", a=np.arange(10))
+    assert len(scans) == 1
+    C.max_mb = 1e-3                              # over budget: the next put evicts
+    C.put("y-1", a=np.arange(10))
+    assert len(scans) == 2
+    assert sum(p.stat().st_size for p in tmp_path.glob("*.npz")) <= C.max_mb * 2**20
+
+def test_keys_carry_the_code_version(monkeypatch):
+    from mf_pipeline import mf_cache
+    k = stage_key("fill", flags="abc")
+    monkeypatch.setattr(mf_cache, "CODE_SALT", "other")
+    assert stage_key("fill", flags="abc") != k
+
+def test_batch_workers_keep_one_cache_each(scan, tmp_path, monkeypatch):
+    # each worker builds its size estimate once, not once per task
+    from mf_pipeline.mf_batch import run_batch
+    marks = tmp_path / "scans"; marks.mkdir()
+    orig = StageCache.evict
+    def counted(self):
+        (marks / f"{os.getpid()}-{len(list(marks.iterdir()))}-{id(self)}").touch()
+        return orig(self)
+    monkeypatch.setattr(StageCache, "evict", counted)      # inherited by the forked workers
+    with SliceReader(scan["path"]) as R:
+        freqs = R.freq.astype(float).tolist()
+    res = run_batch(freqs, workers=2, h5_path=scan["path"], cache=StageCache(tmp_path / "c"),
+                    store=tmp_path / "s.h5", log=lambda *a: None)
+    assert all(r.error is None for r in res)
+    assert len(list(marks.iterdir())) <= 2
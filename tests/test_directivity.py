@@ -0,0 +1,114 @@
+# tests/test_directivity.py
+import numpy as np
+import pytest
+from mf_pipeline.mf_directivity import (design_SH, eval_SH_map, sh_synthesize, fit_SH, fit_SH_band,
+                                        to_spherical, METRICS, cut_directions, band_cuts, beamwidth,
+                                        directivity_index, select_SH)
+
+try:
+    from scipy.special import sph_harm_y
+except ImportError:     # scipy < 1.15
+    sph_harm_y = None
+
+def _directions(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.arccos(rng.uniform(-1, 1, n)), rng.uniform(-np.pi, np.pi, n)
+
+@pytest.mark.skipif(sph_harm_y is None, reason="scipy.special.sph_harm_y needs scipy >= 1.15")
+def test_design_SH_matches_scipy():
+    th, ph = _directions()
+    lmax = 10
+    A = design_SH(th, ph, lmax)
+    for l in range(lmax+1):
+        np.testing.assert_allclose(A[:, l*l], sph_harm_y(l, 0, th, ph).real, atol=1e-12)
+        for m in range(1, l+1):
+            Y = sph_harm_y(l, m, th, ph)
+            np.testing.assert_allclose(A[:, l*l + 2*m - 1], np.sqrt(2)*Y.real, atol=1e-12)
+            np.testing.assert_allclose(A[:, l*l + 2*m], np.sqrt(2)*Y.imag, atol=1e-12)
+
+def test_synthesis_matches_design_matrix():
+    c = np.random.default_rng(3).standard_normal(49)
+    lon, lat, V = eval_SH_map(c, lmax=6, res=(37, 19))
+    Lon, Lat = np.meshgrid(np.deg2rad(lon), np.deg2rad(lat))
+    np.testing.assert_allclose(V, (design_SH(np.pi/2 - Lat, Lon, 6) @ c).reshape(Lat.shape), atol=1e-12)
+    th = np.linspace(0, np.pi, 7); ph = np.linspace(-np.pi, np.pi, 9)
+    T, Ph = np.meshgrid(th, ph, indexing="ij")
+    np.testing.assert_allclose(sh_synthesize(c, 6, th, ph), (design_SH(T, Ph, 6) @ c).reshape(T.shape), atol=1e-12)
+
+def test_fit_SH_matches_normal_equations():
+    rng = np.random.default_rng(1)
+    P = rng.standard_normal((300, 3))
+    v = rng.random(300)
+    c, info = fit_SH(P, v, lmax=6, lam=1e-3)
+    _, th, ph, _ = to_spherical(P)
+    A = design_SH(th, ph, 6)
+    ref = np.linalg.solve(A.T@A + 1e-3*np.eye(A.shape[1]), A.T@v)
+    np.testing.assert_allclose(c, ref, rtol=1e-8, atol=1e-10)
+
+def test_fit_SH_band_equals_per_metric_fits():
+    rng = np.random.default_rng(2)
+    P = rng.standard_normal((200, 3))
+    P_fill = rng.standard_normal((3, 200)) + 1j*rng.standard_normal((3, 200))
+    U_fill = rng.standard_normal((3, 200, 3)) + 1j*rng.standard_normal((3, 200, 3))
+    coeffs, _ = fit_SH_band(P, P_fill, U_fill, metrics=METRICS, lmax=5)
+    v = {"u_mag": np.linalg.norm(U_fill[1], axis=1), "ux": np.abs(U_fill[1, :, 0]), "p": np.abs(P_fill[1])}
+    for name, vals in v.items():
+        np.testing.assert_allclose(coeffs[1, METRICS.index(name)], fit_SH(P, vals, lmax=5)[0], atol=1e-10)
+
+def _project(fn, lmax, n=4000):
+    # SH coefficients of fn(theta, phi) by least squares over many directions
+    th, ph = _directions(n, seed=5)
+    return np.linalg.lstsq(design_SH(th, ph, lmax), fn(th, ph), rcond=None)[0]
+
+def test_cut_directions_follow_the_great_circles():
+    a, th, ph = cut_directions(361)
+    n, r = a.size, np.deg2rad(a)
+    d = np.stack([np.sin(th)*np.cos(ph), np.sin(th)*np.sin(ph), np.cos(th)], axis=1)
+    np.testing.assert_allclose(d[:n], np.stack([np.cos(r), np.sin(r), 0*r], axis=1), atol=1e-7)
+    np.testing.assert_allclose(d[n:], np.stack([np.cos(r), 0*r, np.sin(r)], axis=1), atol=1e-7)
+
+def test_monopole_and_dipole_beamwidth_and_di():
+    mono = _project(lambda th, ph: np.ones_like(th), 2)
+    dip = _project(lambda th, ph: np.sin(th)*np.cos(ph), 2)      # cosine of the angle to +x
+    C = np.stack([mono, dip])
+    a, h, v = band_cuts(C, 2)
+    i0 = int(np.argmin(np.abs(a)))
+    for cut in (h, v):
+        np.testing.assert_allclose(beamwidth(a, cut), [360.0, 120.0], atol=0.5)
+    np.testing.assert_allclose(directivity_index(C, h[:, i0]), [0.0, 10*np.log10(3)], atol=1e-6)
+
+def _brute_force_select(A, v, lambdas, lmax, criterion):
+    # refit every (lmax, lam) explicitly; first minimum wins, as in select_SH
+    N, best = len(v), None
+    for L in range(1, lmax+1):
+        AL = A[:, :(L+1)**2]
+        for lam in lambdas:
+            M = np.linalg.solve(AL.T@AL + lam*np.eye(AL.shape[1]), AL.T)
+            c, h = M @ v, np.einsum("ij,ji->i", AL, M)
+            e = v - AL @ c
+            dof = h.sum()
+            gcv = N*(e**2).sum() / (N - dof)**2
+            loo = np.mean((e / (1 - h))**2)
+            score = gcv if criterion == "gcv" else loo
+            if best is None or score < best[0]:
+                best = (score, dict(lmax=L, lam=lam, gcv=gcv, dof=dof, rms=np.sqrt(np.mean(e**2)),
+                                    loo_rms=np.sqrt(loo)), c)
+    return best[1], best[2]
+
+@pytest.mark.parametrize("criterion", ["gcv", "loo"])
+def test_select_SH_matches_brute_force_refits(criterion):
+    rng = np.random.default_rng(7)
+    P = rng.standard_normal((120, 3))
+    _, th, ph, _ = to_spherical(P)
+    A = design_SH(th, ph, 4)
+    V = np.stack([A[:, :9] @ rng.standard_normal(9), A[:, :4] @ rng.standard_normal(4)], axis=1)
+    V += 0.05*rng.standard_normal(V.shape)
+    lambdas = np.logspace(-6, 0, 7)
+    c, info = select_SH(P, V, lmax=4, lambdas=lambdas, criterion=criterion)
+    for r in range(V.shape[1]):
+        ref, c_ref = _brute_force_select(A, V[:, r], lambdas, 4, criterion)
+        for name, val in ref.items():
+            np.testing.assert_allclose(info[name][r], val, rtol=1e-8, err_msg=name)
+        K = (ref["lmax"]+1)**2
+        np.testing.assert_allclose(c[:K, r], c_ref, rtol=1e-7, atol=1e-10)
+        assert not c[K:, r].any()                       # zero-padded to lmax
@@ -0,0 +1,103 @@
+# tests/test_fill.py
+import warnings
+import numpy as np
+import h5py
+from scipy.interpolate import Rbf
+from scipy.spatial import cKDTree
+from mf_pipeline.mf_fill import (_bin_runs, SliceReader, build_knn, robust_flags, robust_zscores,
+                                 fill_channel, CHANNELS, noiseaware_compute)
+
+class _CountingDataset:
+    # wraps an h5py dataset and counts hyperslab reads
+    def __init__(self, ds):
+        self.ds, self.shape, self.dtype, self.calls = ds, ds.shape, ds.dtype, 0
+
+    def read_direct(self, *a, **kw):
+        self.calls += 1
+        return self.ds.read_direct(*a, **kw)
+
+def test_bin_runs_coalesce_contiguous_bins():
+    assert _bin_runs(np.array([1, 2, 3, 7, 8, 10])) == [(1, 4), (7, 9), (10, 11)]
+    assert _bin_runs(np.array([], int)) == []
+
+def test_load_slices_unsorted_and_duplicate_freqs(scan):
+    bins = [5, 1, 2, 5, 0]
+    with SliceReader(scan["path"]) as R, h5py.File(scan["path"], "r") as f:
+        g = f[R.group]
+        M = R.load_slices(R.freq[bins] + 1.0)          # off-bin requests snap to the nearest bin
+        np.testing.assert_array_equal(M.f0, R.freq[bins])
+        for i, k in enumerate(bins):
+            np.testing.assert_array_equal(M.P[i], g["REAL_TFpref1"][k] + 1j*g["IMAG_TFpref1"][k])
+            np.testing.assert_array_equal(M.U[i], g["REAL_TFxyzref1"][k] + 1j*g["IMAG_TFxyzref1"][k])
+        S = R.load_slice(R.freq[5])
+        assert S.f0 == M.f0[0]
+        np.testing.assert_array_equal(S.Pk, M.P[0])
+        np.testing.assert_array_equal(S.Uk, M.U[0])
+
+def test_read_bins_one_hyperslab_per_run(scan):
+    with SliceReader(scan["path"]) as R:
+        ref, _ = R.read_bins([4, 0, 1, 2, 4])
+        R._rp = counted = _CountingDataset(R._rp)
+        P, _ = R.read_bins([4, 0, 1, 2, 4])            # unique bins 0-2 and 4: two runs
+        assert counted.calls == 2
+        np.testing.assert_array_equal(P, ref)
+
+def _cloud(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random((n, 3)) * 0.2
+
+def _baseline_flags(values, nbr_idx, tau):
+    # the original per-sensor loop
+    med = np.array([np.median(values[nbr_idx[i]]) for i in range(len(values))])
+    mad = np.array([np.median(np.abs(values[nbr_idx[i]] - med[i])) for i in range(len(values))])
+    return np.abs(values - med) / (1.4826*mad + 1e-12) > tau
+
+def test_robust_flags_matches_baseline_loop():
+    pos = _cloud()
+    rng = np.random.default_rng(1)
+    v = 1.0 + 0.05*rng.standard_normal(len(pos))
+    v[rng.choice(len(pos), 15, replace=False)] *= 4.0
+    nbr = build_knn(pos, k=12)
+    for tau in (2.5, 3.5):
+        np.testing.assert_array_equal(robust_flags(v, nbr, tau), _baseline_flags(v, nbr, tau))
+
+def test_robust_zscores_batched_over_channels():
+    pos = _cloud()
+    V = np.random.default_rng(2).random((3, 4, len(pos)))
+    nbr = build_knn(pos, k=12)
+    z = robust_zscores(V, nbr, max_elems=5000)      # forces several row chunks
+    for idx in np.ndindex(V.shape[:-1]):
+        np.testing.assert_array_equal(z[idx] > 3.5, _baseline_flags(V[idx], nbr, 3.5))
+
+def _baseline_fill(pos, x, noisy_mask, smooth=0.2):
+    # the original per-sensor scipy Rbf fill
+    x2 = x.copy()
+    tree = cKDTree(pos)
+    for i in np.flatnonzero(noisy_mask):
+        _, ii = tree.query(pos[i], k=min(24, len(pos)))
+        ii = ii[~noisy_mask[ii]] if np.any(~noisy_mask[ii]) else ii
+        rr = Rbf(pos[ii, 0], pos[ii, 1], pos[ii, 2], x[ii].real, function="multiquadric", smooth=smooth)
+        ri = Rbf(pos[ii, 0], pos[ii, 1], pos[ii, 2], x[ii].imag, function="multiquadric", smooth=smooth)
+        x2[i] = rr(*pos[i]) + 1j*ri(*pos[i])
+    return x2
+
+def test_fill_channel_matches_scipy_rbf():
+    pos = _cloud(seed=4)
+    rng = np.random.default_rng(5)
+    x = np.sin(8*pos[:, 0]) + 1j*np.cos(6*pos[:, 1]) + 0.01*rng.standard_normal(len(pos))
+    mask = np.zeros(len(pos), bool)
+    mask[rng.choice(len(pos), 30, replace=False)] = True
+    np.testing.assert_allclose(fill_channel(pos, x, mask), _baseline_fill(pos, x, mask), rtol=1e-8, atol=1e-10)
+
+def test_noiseaware_compute_flags_injected_outliers(scan):
+    with SliceReader(scan["path"]) as R:
+        for grid in ("off", "on"):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")     # rounded-up stencils under grid="on"
+                res = noiseaware_compute(float(R.freq[3]), reader=R, grid=grid)
+            assert res.meta["mode"] == ("knn" if grid == "off" else "grid")
+            flags = np.stack([res.flags[c] for c in CHANNELS])
+            truth = scan["outliers"][3]
+            assert flags[truth].mean() > 0.85                # recall
+            assert truth[flags].mean() > 0.85                # precision
+            assert np.array_equal(res.P[~res.flags["p"]], res.P_raw[~res.flags["p"]])
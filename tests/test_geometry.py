@@ -0,0 +1,30 @@
+# tests/test_geometry.py
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+from mf_pipeline import mf_geometry
+from mf_pipeline.mf_geometry import ScanGeometry, get_geometry
+
+def test_geometry_matches_kdtree_queries():
+    pos = np.random.default_rng(0).random((200, 3))
+    G = ScanGeometry.build(pos, k_nn=10, k_fill=16)
+    _, knn = cKDTree(pos).query(pos, k=10)
+    np.testing.assert_array_equal(np.sort(G.knn_idx, axis=1), np.sort(knn, axis=1))
+    assert G.fill_idx.shape == (200, 16)
+
+def test_geometry_persisted_and_reloaded(tmp_path, monkeypatch):
+    pos = np.random.default_rng(1).random((150, 3))
+    monkeypatch.setattr(mf_geometry, "_GEOMETRIES", {})
+    G = get_geometry(pos, k_nn=10, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob("geometry_*.npz"))) == 1
+    assert get_geometry(pos, k_nn=10, cache_dir=tmp_path) is G          # in memory
+    assert get_geometry(pos, k_nn=12, cache_dir=tmp_path) is not G      # k_nn is part of the key
+
+    # a new process: the index matrices come from disk, the tree is rebuilt lazily
+    monkeypatch.setattr(mf_geometry, "_GEOMETRIES", {})
+    monkeypatch.setattr(ScanGeometry, "build", classmethod(lambda *a, **kw: pytest.fail("rebuilt")))
+    H = get_geometry(pos, k_nn=10, cache_dir=tmp_path)
+    assert H is not G and H.key == G.key and H._tree is None
+    np.testing.assert_array_equal(H.knn_idx, G.knn_idx)
+    np.testing.assert_array_equal(H.fill_idx, G.fill_idx)
+    np.testing.assert_array_equal(H.tree.query(pos[:5], k=10)[1], G.tree.query(pos[:5], k=10)[1])
@@ -0,0 +1,101 @@
+# tests/test_grid.py
+import warnings
+import numpy as np
+import pytest
+from mf_pipeline.bench.synth import cuboid_grid
+from mf_pipeline.mf_fill import build_knn, robust_zscores, fill_channels, select_lattice, SliceReader
+from mf_pipeline.mf_geometry import get_geometry
+from mf_pipeline.mf_grid import detect_lattice, grid_robust_zscores, grid_fill_channels, stencil_size
+from mf_pipeline.mf_sweep import sweep_band
+
+def _interior(lat, r=1):
+    return ((lat.ijk >= r) & (lat.ijk < np.array(lat.shape) - r)).all(axis=1)
+
+def test_detect_lattice():
+    pos = cuboid_grid((5, 4, 3), spacing=0.02, origin=(0.1, -0.2, 0.3))
+    keep = np.random.default_rng(0).random(len(pos)) > 0.2
+    lat = detect_lattice(pos[keep])
+    assert lat.shape == (5, 4, 3) and not lat.complete
+    np.testing.assert_allclose(lat.spacing, 0.02)
+    np.testing.assert_allclose(lat.origin + lat.ijk*lat.spacing, pos[keep], atol=1e-12)
+    jitter = pos + np.random.default_rng(1).normal(0, 0.004, pos.shape)
+    assert detect_lattice(jitter) is None
+
+def test_grid_zscores_match_knn_on_interior():
+    # k=7 is the face stencil on a cubic grid and exactly the 7 nearest nodes away from the edges
+    pos = cuboid_grid((9, 9, 9))
+    V = np.random.default_rng(2).random((2, 4, len(pos)))
+    lat = detect_lattice(pos)
+    inner = _interior(lat)
+    z_grid = grid_robust_zscores(V, lat, k=7, max_elems=3000)
+    z_knn = robust_zscores(V, build_knn(pos, k=7))
+    np.testing.assert_allclose(z_grid[..., inner], z_knn[..., inner], rtol=1e-12)
+
+def test_grid_fill_matches_knn_fill_on_interior():
+    # k_fill=24 rounds up to the full 27-node cube, i.e. the 27 nearest nodes in the interior
+    pos = cuboid_grid((8, 8, 8))
+    rng = np.random.default_rng(3)
+    X = rng.standard_normal((4, len(pos))) + 1j*rng.standard_normal((4, len(pos)))
+    masks = rng.random(X.shape) < 0.05
+    lat = detect_lattice(pos)
+    inner = _interior(lat)
+    Xg = grid_fill_channels(X, masks, lat, k_fill=24)
+    Xk = fill_channels(pos, X, masks, nbr_idx=build_knn(pos, k=27))
+    sel = masks & inner
+    np.testing.assert_allclose(Xg[sel], Xk[sel], rtol=1e-8, atol=1e-10)
+    np.testing.assert_array_equal(Xg[~masks], X[~masks])
+
+def test_grid_detects_spikes_on_holey_lattice():
+    pos = cuboid_grid((10, 10, 10))
+    rng = np.random.default_rng(4)
+    keep = rng.random(len(pos)) > 0.1
+    pos = pos[keep]
+    v = 1.0 + 0.01*rng.standard_normal(len(pos))
+    spikes = rng.choice(len(pos), 10, replace=False)
+    v[spikes] += 1.0
+    flagged = np.flatnonzero(grid_robust_zscores(v, detect_lattice(pos), k=12) > 3.5)
+    assert set(spikes) <= set(flagged)
+    assert len(flagged) < 3*len(spikes)
+
+def test_stencil_sizes():
+    cube = detect_lattice(cuboid_grid((6, 6, 6)))
+    assert [stencil_size(cube, k) for k in (7, 12, 16, 24)] == [7, 19, 19, 27]
+    plane = detect_lattice(cuboid_grid((6, 6, 1)))
+    assert [stencil_size(plane, k) for k in (5, 12, 24)] == [5, 13, 25]
+
+@pytest.mark.parametrize("spacing", [20.0, 0.02])
+def test_planar_scan_detects_spikes(spacing):
+    # mm or m units: the stencil must stay in the plane
+    pos = cuboid_grid((10, 10, 1), spacing=spacing, origin=(0.0, 0.0, 5.0))
+    lat = detect_lattice(pos)
+    assert lat.shape == (10, 10, 1)
+    rng = np.random.default_rng(5)
+    v = 1.0 + 0.01*rng.standard_normal(len(pos))
+    spikes = np.array([11, 44, 87])
+    v[spikes] += 0.5
+    z = grid_robust_zscores(v, lat, k=12)
+    assert (z[spikes] > 20).all()
+    assert set(np.flatnonzero(z > 3.5)) >= set(spikes)
+    X = v[None] + 0j
+    filled = grid_fill_channels(X, (z > 3.5)[None], lat)[0]
+    np.testing.assert_allclose(filled[spikes].real, 1.0, atol=0.05)
+
+def test_select_lattice_auto_only_with_exact_stencils():
+    pos = cuboid_grid((6, 6, 6))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        # default k_nn=12 / k_fill=24 round up to 19 / 27 nodes: auto keeps the kNN path, silently
+        assert select_lattice(get_geometry(pos, k_nn=12, cache_dir=None)) is None
+        # face stencil (7) and full cube (27) are exact
+        assert select_lattice(get_geometry(pos, k_nn=7, k_fill=27, cache_dir=None)) is not None
+    with pytest.warns(UserWarning, match="19/27 nodes"):
+        assert select_lattice(get_geometry(pos, k_nn=12, cache_dir=None), grid="on") is not None
+
+def test_sweep_keeps_every_k_unless_grid_on(scan):
+    lines = []
+    with SliceReader(scan["path"]) as R:
+        rows = sweep_band(0, 1e9, taus=[3.5], k_nns=[12, 16, 24], reader=R, log=lines.append)
+        assert sorted({r["k_nn"] for r in rows}) == [12, 16, 24]
+        rows = sweep_band(0, 1e9, taus=[3.5], k_nns=[12, 16, 24], grid="on", reader=R, log=lines.append)
+    assert sorted({r["k_nn"] for r in rows}) == [12, 24]
+    assert any("skipping k_nn=16" in line for line in lines)
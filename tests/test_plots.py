@@ -0,0 +1,57 @@
+# tests/test_plots.py
+import numpy as np
+from matplotlib.image import imread
+from mf_pipeline.mf_plots import CloudFigures
+from mf_pipeline.run_cloud_plots import write_delta_csv
+
+def _frames(n_pos, n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(rng.random(n_pos), 2*rng.random(n_pos), rng.random(n_pos) > 0.8) for _ in range(n)]
+
+def _state(fig):
+    # what a reader sees: limits, ticks, legend entries and plotted data of every axes
+    out = []
+    for ax in fig.axes:
+        legend = ax.get_legend()
+        out.append((ax.get_xlim(), ax.get_ylim(), [t.get_text() for t in ax.get_yticklabels()],
+                    [t.get_text() for t in legend.get_texts()] if legend is not None else None,
+                    [np.asarray(l.get_xydata()) for l in ax.lines],
+                    [np.asarray(c.get_offsets()) for c in ax.collections]))
+    return out
+
+def test_reused_templates_render_like_fresh_ones(tmp_path):
+    pos = np.random.default_rng(1).random((60, 3))
+    (v0, f0, m0), (v1, f1, m1) = _frames(60, 2)
+    with CloudFigures(pos, with_3d=False) as A, CloudFigures(pos, with_3d=False) as B:
+        A.render(tmp_path / "a", v0, f0, mask_noisy=m0, dpi=50)
+        reused = A.render(tmp_path / "b", v1, f1, mask_noisy=m1, dpi=50)
+        fresh = B.render(tmp_path / "c", v1, f1, mask_noisy=m1, dpi=50)
+        assert [p.name[1:] for p in reused] == ["_residual_hist.png", "_delta_series.png", "_raw_vs_filled.png"]
+        for Ta, Tb in ((A.hist, B.hist), (A.delta, B.delta), (A.raw_filled, B.raw_filled)):
+            for sa, sb in zip(_state(Ta.fig), _state(Tb.fig)):
+                for x, y in zip(sa, sb):
+                    if isinstance(x, list) and x and isinstance(x[0], np.ndarray):
+                        assert all(np.array_equal(u, w) for u, w in zip(x, y))
+                    else:
+                        assert x == y
+            # tight_layout may differ in the last float digit, nothing more
+            pa, pb = Ta.fig.subplotpars, Tb.fig.subplotpars
+            np.testing.assert_allclose([pa.left, pa.right, pa.bottom, pa.top], [pb.left, pb.right, pb.bottom, pb.top])
+    for a, b in zip(reused, fresh):
+        assert imread(a).shape == imread(b).shape
+
+def test_cloud_template_renders_all_four(tmp_path):
+    pos = np.random.default_rng(2).random((40, 3))
+    with CloudFigures(pos) as F:
+        for i, (v, f, m) in enumerate(_frames(40, 2)):
+            saved = F.render(tmp_path / f"s{i}", v, f, mask_noisy=m, dpi=40)
+    assert saved[0].name == "s1_cloud_before_after.png"
+    assert all(p.stat().st_size > 0 for p in saved) and len(saved) == 4
+
+def test_write_delta_csv(tmp_path):
+    raw, filled = np.array([1.0, 2.0, 3.0]), np.array([1.0, 2.5, 2.0])
+    lines = write_delta_csv(tmp_path / "d.csv", raw, filled, np.array([False, True, True])).read_text().splitlines()
+    assert lines[0] == "index,raw,filled,delta,abs_delta,is_noisy"
+    assert lines[2:] == ["1,2,2.5,0.5,0.5,1", "2,3,2,-1,1,1"]
+    lines = write_delta_csv(tmp_path / "e.csv", raw, filled).read_text().splitlines()
+    assert lines[0] == "index,raw,filled,delta,abs_delta,is_noisy(n/a)" and lines[1] == "0,1,1,0,0,"
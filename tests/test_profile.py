@@ -0,0 +1,43 @@
+# tests/test_profile.py
+import numpy as np
+import pytest
+
+from mf_pipeline import mf_profile
+from mf_pipeline.mf_profile import Profiler
+
+@pytest.mark.skipif(not mf_profile._hwm_supported(), reason="needs /proc VmHWM reset")
+def test_stage_peak_is_per_stage():
+    prof = Profiler(); prof.enable()
+    with prof.stage("outer"):
+        with prof.stage("big"):
+            a = np.ones(2**25); a += 1     # 256 MB touched
+            del a
+        with prof.stage("small"):
+            b = np.ones(2**10); del b
+    rec = {r["stage"]: r for r in prof.records}
+    assert rec["big"]["peak_rss_mb"] - rec["small"]["peak_rss_mb"] > 200
+    assert rec["outer"]["peak_rss_mb"] >= rec["big"]["peak_rss_mb"]
+    # the process peak so far never goes back down
+    assert rec["small"]["process_peak_rss_mb"] >= rec["big"]["peak_rss_mb"] - 1
+
+def test_disabled_is_noop():
+    prof = Profiler()
+    with prof.stage("x") as st:
+        st.note(n=1)
+    assert prof.records == []
+
+def test_flags_stage_reports_the_gather_width(scan):
+    import warnings
+    from mf_pipeline.mf_fill import SliceReader, noiseaware_compute
+    prof = mf_profile.PROFILER
+    prof.enable()
+    try:
+        with SliceReader(scan["path"]) as R, warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for grid, width in (("off", 12), ("on", 19)):     # 19-node stencil for k_nn=12 on a cube
+                mark = prof.mark()
+                noiseaware_compute(float(R.freq[2]), reader=R, grid=grid)
+                rec = [r for r in prof.since(mark) if r["stage"] == "flags"][0]
+                assert rec["nbytes"] == len(R.pos)*width*4*8
+    finally:
+        prof.disable(); prof.records.clear()
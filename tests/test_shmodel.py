@@ -0,0 +1,38 @@
+# tests/test_shmodel.py
+import numpy as np
+import pytest
+from mf_pipeline.mf_directivity import design_SH
+from mf_pipeline.mf_shmodel import SHModel
+
+def test_query_matches_design_matrix_and_interpolates():
+    rng = np.random.default_rng(0)
+    C = rng.standard_normal((3, 25))
+    m = SHModel(np.array([100.0, 200.0, 400.0]), C, 4, np.full(3, 1e-3), np.zeros(3))
+    th, ph = np.arccos(rng.uniform(-1, 1, 50)), rng.uniform(-np.pi, np.pi, 50)
+    A = design_SH(th, ph, 4)
+    np.testing.assert_allclose(m.query((th, ph), 200.0), A @ C[1], atol=1e-12)
+    # linear between bins, clamped outside; chunking does not change the result
+    V = m.query((th, ph), [150.0, 300.0, 50.0, 900.0], chunk=7)
+    expected = np.stack([0.5*(C[0] + C[1]), 0.5*(C[1] + C[2]), C[0], C[2]]) @ A.T
+    np.testing.assert_allclose(V, expected, atol=1e-12)
+    # (M,3) vectors of any length give the same directions
+    d = 3.0*np.stack([np.sin(th)*np.cos(ph), np.sin(th)*np.sin(ph), np.cos(th)], axis=1)
+    np.testing.assert_allclose(m.query(d, 200.0), A @ C[1], atol=1e-10)
+
+def _coeff_file(path, f0, lam, select=False):
+    extra = dict(select_lam=np.array([lam])) if select else {}
+    np.savez(path, coeffs=np.ones((1, 9)), metrics=np.array(["u_mag"]), lmax=2,
+             lam=np.array([lam]) if select else lam, center=np.zeros(3), f0=f0, **extra)
+    return path
+
+def test_shmodel_lam_per_bin(tmp_path):
+    fixed = [_coeff_file(tmp_path / f"a{i}.npz", f0, 1e-3) for i, f0 in enumerate((200.0, 100.0))]
+    assert np.allclose(SHModel.from_npz(fixed).lam, [1e-3, 1e-3])
+    # automatically selected lam differs per bin and is kept per bin
+    auto = [_coeff_file(tmp_path / f"s{i}.npz", f0, lam, select=True)
+            for i, (f0, lam) in enumerate(((200.0, 1e-2), (100.0, 1e-4)))]
+    assert np.allclose(SHModel.from_npz(auto).lam, [1e-4, 1e-2])
+    with pytest.raises(ValueError, match="lam"):
+        SHModel.from_npz(fixed + [_coeff_file(tmp_path / "b.npz", 300.0, 1e-2)])
+    with pytest.raises(ValueError, match="lam"):
+        SHModel.from_npz(fixed + auto[:1])
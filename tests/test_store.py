@@ -0,0 +1,114 @@
+# tests/test_store.py
+import numpy as np
+import pytest
+from mf_pipeline.mf_fill import CHANNELS, SliceReader, noiseaware_compute
+from mf_pipeline.mf_store import ResultsStore, pack_flags, unpack_flags
+from mf_pipeline.mf_stream import stream_band
+
+def test_flags_roundtrip():
+    rng = np.random.default_rng(0)
+    flags = {c: rng.random((3, 10)) < 0.3 for c in CHANNELS}
+    back = unpack_flags(pack_flags(flags))
+    for c in CHANNELS:
+        np.testing.assert_array_equal(back[c], flags[c])
+
+def test_store_bin_and_sensor_reads(tmp_path):
+    rng = np.random.default_rng(1)
+    F, N = 5, 40
+    pos = rng.random((N, 3))
+    P = rng.standard_normal((F, N)) + 1j*rng.standard_normal((F, N))
+    U = rng.standard_normal((F, N, 3)) + 1j*rng.standard_normal((F, N, 3))
+    flags = {c: rng.random((F, N)) < 0.2 for c in CHANNELS}
+    with ResultsStore.create(tmp_path / "s.h5", pos, np.arange(F)*100.0 + 100, dict(tau=3.5)) as S:
+        S.write_bin(slice(1, 4), P[1:4], U[1:4], P[1:4], U[1:4], {c: v[1:4] for c, v in flags.items()})
+        np.testing.assert_array_equal(S.done, [False, True, True, True, False])
+        B = S.read_bin(S.bin_index(290.0))
+        np.testing.assert_array_equal(B["p"], P[2])
+        np.testing.assert_array_equal(B["flags"]["uy"], flags["uy"][2])
+        assert B["meta"]["tau"] == 3.5 and B["meta"]["f0"] == 300.0
+        np.testing.assert_array_equal(S.read("u", bins=slice(1, 4), sensors=7), U[1:4, 7])
+
+@pytest.mark.parametrize("layout", ["bins", "sensors"])
+def test_store_layouts(tmp_path, layout):
+    pos = np.random.default_rng(2).random((100, 3))
+    with ResultsStore.create(tmp_path / "s.h5", pos, np.arange(70.0), layout=layout) as S:
+        chunks = S._f["p"].chunks
+        U = np.arange(100*3).reshape(100, 3) + 1j
+        S.write_bin(3, U[:, 0], U, U[:, 0], U, {c: np.zeros(100, bool) for c in CHANNELS})
+        np.testing.assert_array_equal(S.read("u", sensors=5)[3], U[5])
+    assert chunks == {"bins": (16, 100), "sensors": (64, 16)}[layout]
+    with pytest.raises(ValueError):
+        ResultsStore.create(tmp_path / "t.h5", pos, np.arange(4.0), layout="rows")
+
+def test_batch_store_marks_done_after_sh(scan, tmp_path, monkeypatch):
+    from mf_pipeline.mf_batch import run_batch
+    with SliceReader(scan["path"]) as R:
+        freqs = R.freq[:3].astype(float).tolist()
+    dir_kw = dict(metrics=["u_mag"], lmax=4, res_lon=19, res_lat=10)
+    quiet = lambda *a: None
+    run_batch(freqs, dir_kw=dir_kw, workers=1, h5_path=scan["path"], store=tmp_path / "ok.h5", log=quiet)
+    with ResultsStore(tmp_path / "ok.h5") as S:
+        assert S.done.all() and not np.isnan(S.read_sh("u_mag")[0]).any()
+
+    def fail(self, *a, **kw):
+        raise OSError("disk full")
+    monkeypatch.setattr(ResultsStore, "write_sh", fail)
+    res = run_batch(freqs, dir_kw=dir_kw, workers=1, h5_path=scan["path"], store=tmp_path / "bad.h5", log=quiet)
+    assert all(r.error is not None for r in res)
+    with ResultsStore(tmp_path / "bad.h5") as S:
+        assert not S.done.any()
+
+def _store_arrays(path):
+    with ResultsStore(path) as S:
+        return dict(done=S.done, p=S.read("p"), u=S.read("u"), flags=S.read("flags"), sh=S.read_sh("u_mag")[0])
+
+def test_stream_matches_per_bin_compute(scan, tmp_path):
+    out = stream_band(tmp_path / "st.h5", h5_path=scan["path"], mem_mb=2, log=lambda *a: None)
+    A = _store_arrays(out)
+    assert A["done"].all()
+    with SliceReader(scan["path"]) as R:
+        for k in (0, 5):
+            res = noiseaware_compute(float(R.freq[k]), reader=R)
+            np.testing.assert_array_equal(A["p"][k], res.P)
+            np.testing.assert_array_equal(A["u"][k], res.U)
+            np.testing.assert_array_equal(A["flags"][k], pack_flags(res.flags))
+
+def test_stream_resume_after_crash(scan, tmp_path):
+    ref = _store_arrays(stream_band(tmp_path / "ref.h5", h5_path=scan["path"], mem_mb=2, log=lambda *a: None))
+
+    def crash(msg):
+        if msg.startswith("["):          # progress line, printed after a chunk is marked done
+            raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        stream_band(tmp_path / "st.h5", h5_path=scan["path"], mem_mb=2, log=crash)
+    partial = _store_arrays(tmp_path / "st.h5")["done"]
+    assert 0 < partial.sum() < partial.size
+
+    lines = []
+    stream_band(tmp_path / "st.h5", h5_path=scan["path"], mem_mb=2, log=lines.append)
+    assert lines[0].startswith(f"resuming: {partial.sum()}/")
+    A = _store_arrays(tmp_path / "st.h5")
+    for name in ref:
+        np.testing.assert_array_equal(A[name], ref[name])
+
+def test_stream_refuses_other_parameters(scan, tmp_path):
+    stream_band(tmp_path / "st.h5", h5_path=scan["path"], f_hi=1000.0, log=lambda *a: None)
+    with pytest.raises(ValueError):
+        stream_band(tmp_path / "st.h5", h5_path=scan["path"], f_hi=1000.0, tau=3.0, log=lambda *a: None)
+
+def test_batch_store_keeps_auto_selection(scan, tmp_path):
+    from mf_pipeline.mf_batch import run_batch
+    from mf_pipeline.mf_shmodel import SHModel
+    with SliceReader(scan["path"]) as R:
+        freqs = R.freq[:3].astype(float).tolist()
+    lines = []
+    dir_kw = dict(metrics=["u_mag", "p"], lmax=4, res_lon=19, res_lat=10, auto="gcv")
+    run_batch(freqs, dir_kw=dir_kw, workers=1, h5_path=scan["path"], store=tmp_path / "a.h5", log=lines.append)
+    assert sum("lam=" in line for line in lines) == 2*len(freqs)    # selection lines reach run_batch's log
+    with ResultsStore(tmp_path / "a.h5") as S:
+        C, info = S.read_sh("p")
+        sel = info["select"]
+        assert set(sel) == {"lmax", "lam", "gcv", "rms", "loo_rms", "dof"}
+        assert np.isfinite(sel["lam"]).all() and (sel["lmax"] <= 4).all()
+    m = SHModel.from_store(tmp_path / "a.h5", metric="p")
+    np.testing.assert_array_equal(m.lam, sel["lam"])